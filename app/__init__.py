@@ -4,7 +4,9 @@ from logging.handlers import RotatingFileHandler
 import os
 import atexit
 import sys
-from flask import Flask
+from app import startup
+startup.begin()  # Before the imports below, so STARTUP_PROFILE can time them
+from flask import Flask, request
 from config import Config
 
 def setup_logging(config):
@@ -58,32 +60,76 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    # Uploads stream to disk in the upload folder, hashed as they arrive
+    from app.uploads import UploadRequest
+    app.request_class = UploadRequest
+    
     logger.info('Mirage startup')
     
     with app.app_context():
         # Import components here to avoid circular imports
-        from app.hardware.display import Display
         from app.hardware.system import SystemHardware
         from app.controller import Controller
+        from app.jobs import DisplayQueue
         from app.metrics import MetricsCollector
+        from app.ownership import DisplayOwner, SharedDisplay, SharedDisplayQueue
+        from app.catalog import Catalog
+        from app.renditions import RenditionWorker
+        from app.retention import GarbageCollector
+        
+        def create_display():
+            # Imported when the panel is first used, numpy, PIL and the driver are slow to load
+            from app.hardware.display import Display
+            from app.hardware.panel import create_panel
+            return Display(panel=create_panel(config_class))
         
-        # Initialize components
-        app.display = Display()
+        # Initialize components, only the process that owns the panel opens it
+        app.display_owner = DisplayOwner(
+            create_display=create_display,
+            lock_file=config_class.DISPLAY_LOCK_FILE,
+            socket_path=config_class.DISPLAY_SOCKET,
+            history=config_class.DISPLAY_JOB_HISTORY,
+            coalesce=config_class.DISPLAY_COALESCE,
+            claim=not config_class.DISPLAY_DAEMON
+        )
+        app.display = SharedDisplay(app.display_owner)
         app.system = SystemHardware()
+        app.display_queue = SharedDisplayQueue(app.display_owner)
+        app.collector = GarbageCollector(
+            keep=config_class.KEEP_IMAGES,
+            quota=config_class.STORAGE_QUOTA_BYTES,
+            min_free=config_class.MIN_FREE_BYTES,
+            interval=config_class.GC_INTERVAL,
+            batch_size=config_class.GC_BATCH_SIZE
+        )
+        app.renditions = RenditionWorker() if config_class.RENDITIONS else None
         app.controller = Controller(
             display=app.display,
-            system=app.system
-        )
-        app.metrics = MetricsCollector(
-            controller=app.controller,
-            interval=config_class.METRICS_INTERVAL
+            system=app.system,
+            jobs=app.display_queue,
+            collector=app.collector,
+            renditions=app.renditions
         )
+        app.metrics = MetricsCollector(controller=app.controller)
         
-        # Register cleanup for all collectors
+        # Register cleanup for all collectors, display and rendition workers and catalogs
         atexit.register(MetricsCollector.shutdown_all)
+        atexit.register(DisplayQueue.shutdown_all)
+        atexit.register(DisplayOwner.shutdown_all)
+        atexit.register(GarbageCollector.shutdown_all)
+        atexit.register(RenditionWorker.shutdown_all)
+        atexit.register(Catalog.close_all)
         
         # Register blueprints
         from app.routes import bp
         app.register_blueprint(bp)
     
+    if startup.profile:
+        startup.profile.mark('app_created')
+        
+        @app.after_request
+        def record_first_request(response):
+            startup.profile.request_finished(request.path)
+            return response
+    
     return app
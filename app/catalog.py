@@ -0,0 +1,242 @@
+"""
+SQLite catalog of stored images.
+
+One row per image in UPLOAD_FOLDER with its size, dimensions, hash, mtime,
+display history and the bytes its renditions take, so listings, totals and
+retention never have to scan and stat the folder. Image count and total
+bytes live in a one-row table kept up to date by triggers, so reading them
+costs the same however many images there are.
+
+The database is opened in WAL mode: every worker process and the display
+daemon can read while one of them writes, and commits only append to the
+log, which is gentler on an SD card than rewriting pages in place.
+"""
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 3
+BUSY_TIMEOUT_MS = 5000  # How long a writer waits for another process's write to finish
+
+COLUMNS = ('id', 'filename', 'original_filename', 'content_hash', 'format', 'width', 'height',
+           'size', 'modified', 'last_displayed', 'display_count', 'pinned', 'renditions_size')
+# Kept when an image is added again
+_HISTORY = ('last_displayed', 'display_count', 'pinned', 'renditions_size')
+# Counters that start at zero
+_ZEROED = ('display_count', 'pinned', 'renditions_size')
+
+_SCHEMA = [
+    """CREATE TABLE images (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        original_filename TEXT,
+        content_hash TEXT,
+        format TEXT,
+        width INTEGER,
+        height INTEGER,
+        size INTEGER NOT NULL,
+        modified REAL NOT NULL,
+        last_displayed REAL,
+        display_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX images_modified ON images (modified)",
+    """CREATE TABLE totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        image_count INTEGER NOT NULL,
+        total_size INTEGER NOT NULL
+    )""",
+    "INSERT INTO totals VALUES (0, 0, 0)",
+    """CREATE TRIGGER images_added AFTER INSERT ON images BEGIN
+        UPDATE totals SET image_count = image_count + 1, total_size = total_size + NEW.size;
+    END""",
+    """CREATE TRIGGER images_removed AFTER DELETE ON images BEGIN
+        UPDATE totals SET image_count = image_count - 1, total_size = total_size - OLD.size;
+    END""",
+    """CREATE TRIGGER images_resized AFTER UPDATE OF size ON images BEGIN
+        UPDATE totals SET total_size = total_size - OLD.size + NEW.size;
+    END"""
+]
+
+# Statements that bring a catalog from the previous version to each version
+_MIGRATIONS = {
+    2: [
+        "ALTER TABLE images ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0",
+        # Eviction order, least recently displayed first
+        "CREATE INDEX images_last_used ON images (pinned, COALESCE(last_displayed, modified))"
+    ],
+    3: [
+        # Bytes under UPLOAD_FOLDER/renditions/<id>/, counted against the storage quota
+        "ALTER TABLE images ADD COLUMN renditions_size INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE totals ADD COLUMN renditions_size INTEGER NOT NULL DEFAULT 0",
+        "DROP TRIGGER images_added",
+        """CREATE TRIGGER images_added AFTER INSERT ON images BEGIN
+            UPDATE totals SET image_count = image_count + 1, total_size = total_size + NEW.size,
+                              renditions_size = renditions_size + NEW.renditions_size;
+        END""",
+        "DROP TRIGGER images_removed",
+        """CREATE TRIGGER images_removed AFTER DELETE ON images BEGIN
+            UPDATE totals SET image_count = image_count - 1, total_size = total_size - OLD.size,
+                              renditions_size = renditions_size - OLD.renditions_size;
+        END""",
+        """CREATE TRIGGER images_renditions_resized AFTER UPDATE OF renditions_size ON images BEGIN
+            UPDATE totals SET renditions_size = renditions_size - OLD.renditions_size + NEW.renditions_size;
+        END"""
+    ]
+}
+
+class Catalog:
+    """
+    The image catalog at path, shared by every process that opens it.
+    populate, called only when the database is first created, returns the
+    rows for images that were stored before there was a catalog.
+    """
+
+    # Class variable to track instances
+    _instances = set()
+
+    def __init__(self, path: Path, populate: Optional[Callable[[], Iterable[Dict]]] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit, writes open their own transaction in _transaction
+        self._connection = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_MS / 1000,
+                                           isolation_level=None, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints, safe in WAL mode
+        self._create(populate)
+        Catalog._instances.add(self)
+
+    @classmethod
+    def close_all(cls):
+        """Close all open catalogs"""
+        for catalog in list(cls._instances):
+            catalog.close()
+        cls._instances.clear()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        A write transaction. IMMEDIATE takes the database write lock up
+        front, so writers from other processes queue instead of deadlocking.
+        """
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._connection
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+
+    def _create(self, populate):
+        # Only the first process to take the write lock creates or migrates the schema
+        with self._transaction() as connection:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version == SCHEMA_VERSION:
+                return
+            created = version == 0
+            if created:
+                for statement in _SCHEMA:
+                    connection.execute(statement)
+                version = 1
+            for migration in range(version + 1, SCHEMA_VERSION + 1):
+                for statement in _MIGRATIONS[migration]:
+                    connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            if created and populate:
+                rows = list(populate())
+                self._upsert(rows)
+                logger.info(f"Created image catalog {self.path} with {len(rows)} existing images")
+
+    def _write(self, sql: str, parameters=()) -> int:
+        """Run one write statement in its own transaction, returns the rows changed"""
+        with self._transaction() as connection:
+            return connection.execute(sql, parameters).rowcount
+
+    def _read(self, sql: str, parameters=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _upsert(self, rows: List[Dict]):
+        values = [tuple(row.get(column, 0 if column in _ZEROED else None) for column in COLUMNS)
+                  for row in rows]
+        self._connection.executemany(
+            f"INSERT INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)}) "
+            "ON CONFLICT (id) DO UPDATE SET "
+            + ', '.join(f"{column} = excluded.{column}" for column in COLUMNS
+                        if column != 'id' and column not in _HISTORY),
+            values
+        )
+
+    def add(self, row: Dict):
+        """Add or replace an image, keeping its display history if it was already known"""
+        with self._transaction():
+            self._upsert([row])
+
+    def remove(self, image_id: str) -> bool:
+        """Forget an image, returns whether it was catalogued"""
+        return self._write('DELETE FROM images WHERE id = ?', (image_id,)) > 0
+
+    def remove_many(self, image_ids: List[str]) -> int:
+        """Forget several images in one transaction, returns how many were catalogued"""
+        with self._transaction() as connection:
+            return connection.executemany('DELETE FROM images WHERE id = ?', [(i,) for i in image_ids]).rowcount
+
+    def set_pinned(self, image_id: str, pinned: bool) -> bool:
+        """Pin or unpin an image, pinned images are never evicted. Returns whether it is catalogued"""
+        return self._write('UPDATE images SET pinned = ? WHERE id = ?', (int(pinned), image_id)) > 0
+
+    def add_renditions_size(self, image_id: str, delta: int):
+        """Count bytes written (or, if negative, freed) under an image's renditions"""
+        self._write('UPDATE images SET renditions_size = MAX(0, renditions_size + ?) WHERE id = ?',
+                    (delta, image_id))
+    
+    def touch(self, image_id: str, modified: float):
+        """Record that an image was stored again or redisplayed"""
+        self._write('UPDATE images SET modified = ? WHERE id = ?', (modified, image_id))
+
+    def record_display(self, image_id: str, when: float):
+        """Count a display of an image"""
+        self._write('UPDATE images SET last_displayed = ?, display_count = display_count + 1 WHERE id = ?',
+                    (when, image_id))
+
+    def get(self, image_id: str) -> Optional[Dict]:
+        rows = self._read('SELECT * FROM images WHERE id = ?', (image_id,))
+        return dict(rows[0]) if rows else None
+
+    def page(self, limit: int, offset: int = 0) -> List[Dict]:
+        """Images newest first, limit of them starting at offset"""
+        rows = self._read('SELECT * FROM images ORDER BY modified DESC, id LIMIT ? OFFSET ?', (limit, offset))
+        return [dict(row) for row in rows]
+
+    def beyond(self, keep: int) -> List[Dict]:
+        """The id and filename of every unpinned image but the keep newest, oldest last"""
+        rows = self._read('SELECT id, filename FROM images WHERE pinned = 0 ORDER BY modified DESC, id LIMIT -1 OFFSET ?',
+                          (keep,))
+        return [dict(row) for row in rows]
+
+    def least_recently_used(self, limit: int, offset: int = 0) -> List[Dict]:
+        """Unpinned images in eviction order, least recently displayed (or stored, if never shown) first"""
+        rows = self._read('SELECT * FROM images WHERE pinned = 0 ORDER BY COALESCE(last_displayed, modified), id '
+                          'LIMIT ? OFFSET ?', (limit, offset))
+        return [dict(row) for row in rows]
+
+    def unpinned_count(self) -> int:
+        return self._read('SELECT COUNT(*) FROM images WHERE pinned = 0')[0][0]
+
+    def totals(self) -> Dict[str, int]:
+        """Image count, total bytes of the images and of their renditions, without touching the images table"""
+        row = self._read('SELECT image_count, total_size, renditions_size FROM totals')[0]
+        return {"image_count": row["image_count"], "total_size": row["total_size"],
+                "renditions_size": row["renditions_size"]}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+        Catalog._instances.discard(self)
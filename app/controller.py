@@ -1,48 +1,70 @@
 import logging
 from pathlib import Path
-from typing import Dict, Optional, Tuple
-from app.hardware.display import Display
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+from app import renditions, store
 from app.hardware.system import SystemHardware
-from app.utils import save_image
+from app.jobs import DisplayJob, DisplayQueue, JobStatus
+from app.metrics import observe_stage
+from app.status import FIELDS, StatusCache, build_status
+from app.timing import StageTimer
+from app.utils import find_image, ingest_image, list_images, storage_totals
 from config import Config
 
+if TYPE_CHECKING:
+    from app.hardware.display import Display
+    from app.renditions import RenditionWorker
+    from app.retention import GarbageCollector
+
 logger = logging.getLogger(__name__)
 
 class Controller:
     """High-level system controller for display and hardware management"""
     
-    def __init__(self, display: Display, system: SystemHardware):
+    def __init__(self, display: 'Display', system: SystemHardware, jobs: Optional[DisplayQueue] = None,
+                 collector: Optional['GarbageCollector'] = None,
+                 renditions: Optional['RenditionWorker'] = None):
         self.display = display
         self.system = system
-        self.image_dir = Config.UPLOAD_FOLDER
-    
-    def get_status(self) -> Dict:
-        """Get comprehensive system status"""
-        return {
-            "status": "online",
-            "system": {
-                "temperature": self.system.get_temperature(),
-                "service": self.system.get_service_status(),
-                **self.system.get_system_stats()
-            },
-            "storage": self.get_storage_stats(),
-            "display": self.display.get_info()
+        self.jobs = jobs if jobs is not None else DisplayQueue(display)
+        self.collector = collector
+        self.renditions = renditions
+        self.status_cache = StatusCache()
+        # One probe per status field, each cached for Config.STATUS_TTLS[field]
+        self._probes = {
+            'system.temperature': lambda: self.system.get_temperature(),
+            'system.service': lambda: self.system.get_service_status(),
+            'system.cpu': lambda: self._get_cpu_stats(),
+            'system.memory': lambda: self.system.get_memory_stats(),
+            'system.disk': lambda: self.system.get_disk_stats(),
+            'storage': lambda: self.get_storage_stats(),
+            'display': lambda: self.display.get_info()
         }
     
+    def get_status(self, fields: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Get system status, from cached probes
+        fields limits it to some of status.FIELDS, e.g. ['system.temperature', 'storage']
+        """
+        return build_status((field, self._probe(field)) for field in (fields or FIELDS))
+    
+    def _probe(self, field: str) -> Any:
+        """Cached value of one status field, None if its probe fails"""
+        def compute():
+            try:
+                return self._probes[field]()
+            except Exception as e:
+                logger.error(f"Failed to collect {field} status: {e}", exc_info=True)
+                return None
+        return self.status_cache.get(field, compute, Config.STATUS_TTLS.get(field, 0))
+    
+    def _get_cpu_stats(self) -> Dict:
+        return {**self.system.get_cpu_stats(), "temperature": self._probe('system.temperature')}
+    
     def get_storage_stats(self) -> Dict:
         """Get image storage statistics"""
         try:
-            if not self.image_dir.exists():
-                return {"image_count": 0, "total_size": 0}
-            
-            total_size = 0
-            image_count = 0
-            
-            for file in self.image_dir.glob('*'):
-                if file.suffix.lower() in Config.SUPPORTED_FORMATS:
-                    total_size += file.stat().st_size
-                    image_count += 1
-            
+            totals = storage_totals()
+            image_count, total_size = totals["image_count"], totals["total_size"]
             logger.debug(f"Storage stats: {image_count} images, {total_size} bytes")
             return {
                 "image_count": image_count,
@@ -52,16 +74,91 @@ class Controller:
             logger.error(f"Failed to collect storage stats: {e}", exc_info=True)
             return {"image_count": 0, "total_size": 0}
     
+    def submit_display(self, image_file, fit: Optional[str] = None,
+                       timer: Optional[StageTimer] = None) -> DisplayJob:
+        """
+        Save an uploaded image and queue it for display without waiting
+        timer, if the request started one, carries its stage timings through to the job.
+        """
+        timer = timer or StageTimer(observer=observe_stage)
+        ingested = ingest_image(image_file, target_size=self.display.resolution, fit=fit, timer=timer)
+        self.status_cache.invalidate('storage')
+        if self.collector and not ingested.deduplicated:
+            self.collector.trigger()
+        if self.renditions:
+            # Missing renditions only, so a duplicate upload is usually a no-op
+            self.renditions.submit(ingested.path, self.display.resolution, fit, image=ingested.image)
+        return self.jobs.submit(ingested.path, image=ingested.image, content_hash=ingested.content_hash,
+                                fit=fit, timer=timer)
+    
+    def display_image(self, image_id: str, fit: Optional[str] = None) -> Optional[DisplayJob]:
+        """Queue a stored image for display, returns None if there is no such image"""
+        image_path = find_image(image_id)
+        if image_path is None:
+            return None
+        # Count a redisplay as recent use so cleanup keeps the image around
+        try:
+            store.touch(image_path)
+        except FileNotFoundError:
+            return None  # Removed by a concurrent cleanup
+        # Stored images are named after their content, which keys the frame cache
+        content_hash = image_id if store.is_content_hash(image_id) else None
+        return self.jobs.submit(image_path, content_hash=content_hash, fit=fit)
+    
+    def list_images(self, limit: Optional[int] = None, offset: int = 0) -> Dict:
+        """A page of stored images, newest first, and how many there are in all"""
+        return {
+            "images": list_images(limit, offset),
+            "total": storage_totals()["image_count"],
+            "limit": limit,
+            "offset": offset
+        }
+    
+    def get_thumbnail(self, image_id: str, size: Optional[int] = None) -> Tuple[Optional[Path], bool]:
+        """
+        The thumbnail of a stored image closest above size, and whether it is
+        ready. A missing one is queued on the rendition worker, never made on
+        the request thread. None if there is no such image, or it has no
+        thumbnail and renditions are off.
+        """
+        image_path = find_image(image_id)
+        if image_path is None:
+            return None, False
+        thumbnail = renditions.thumbnail_path(image_id, renditions.thumbnail_size(size))
+        if thumbnail.exists():
+            return thumbnail, True
+        if not self.renditions:
+            return None, False
+        self.renditions.submit(image_path, self.display.resolution)
+        return thumbnail, False
+    
+    def pin_image(self, image_id: str, pinned: bool) -> bool:
+        """Exempt a stored image from eviction, or make it evictable again. False if there is no such image"""
+        return store.set_pinned(image_id, pinned)
+    
     def update_display(self, image_file) -> Tuple[bool, Optional[str]]:
-        """Process and update display with new image"""
+        """Process and update display with new image, waiting for the refresh"""
         try:
-            image_path = save_image(image_file)
-            success = self.display.update(str(image_path))
-            return success, None if success else "Display update failed"
+            job = self.submit_display(image_file)
+            if not job.wait(timeout=Config.DISPLAY_UPDATE_TIMEOUT):
+                return False, f"Display update timed out after {Config.DISPLAY_UPDATE_TIMEOUT}s"
+            if job.status == JobStatus.SUPERSEDED:
+                return False, "Superseded by a newer display update"
+            success = job.status == JobStatus.DONE
+            return success, None if success else job.error
         except Exception as e:
             logger.error(f"Display update failed: {e}", exc_info=True)
             return False, str(e)
     
+    def get_display_job(self, job_id: str) -> Optional[Dict]:
+        """Get the state of a single display job"""
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+    
+    def get_display_jobs(self) -> List[Dict]:
+        """Get recent display jobs, newest first"""
+        return [job.to_dict() for job in self.jobs.recent()]
+    
     def control_service(self, action: str) -> Tuple[bool, str]:
         """Control the system service"""
         return self.system.control_service(action)
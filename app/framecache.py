@@ -0,0 +1,111 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+from app.metrics import (
+    RENDER_CACHE_HITS_TOTAL, RENDER_CACHE_MISSES_TOTAL,
+    RENDER_CACHE_EVICTIONS_TOTAL, RENDER_CACHE_BYTES, RENDER_CACHE_FRAMES
+)
+
+logger = logging.getLogger(__name__)
+
+def pack_4bpp(indices: np.ndarray) -> bytes:
+    """Pack palette indices (< 16) two pixels per byte, high nibble first"""
+    flat = np.ascontiguousarray(indices, dtype=np.uint8).reshape(-1)
+    if flat.size % 2:
+        flat = np.append(flat, np.uint8(0))
+    return ((flat[0::2] << 4) | (flat[1::2] & 0x0F)).tobytes()
+
+def unpack_4bpp(data: bytes, shape: Tuple[int, int]) -> np.ndarray:
+    """Reverse of pack_4bpp"""
+    packed = np.frombuffer(data, dtype=np.uint8)
+    flat = np.empty(packed.size * 2, dtype=np.uint8)
+    flat[0::2] = packed >> 4
+    flat[1::2] = packed & 0x0F
+    return flat[:shape[0] * shape[1]].reshape(shape)
+
+def frame_key(content_hash: str, resolution: Tuple[int, int], settings: Tuple) -> str:
+    """Cache key for a rendered frame: source content, panel size and render settings"""
+    width, height = resolution
+    return ':'.join([content_hash, f"{width}x{height}", *(str(s) for s in settings)])
+
+class FrameCache:
+    """
+    LRU cache of panel-ready frames, stored as 4bpp palette indices.
+    An 800x480 frame takes 192KB, so a few MB holds a useful history.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._frames: "OrderedDict[str, Tuple[Tuple[int, int], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Get a cached frame as a (height, width) index array"""
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is None:
+                self.misses += 1
+                RENDER_CACHE_MISSES_TOTAL.inc()
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            RENDER_CACHE_HITS_TOTAL.inc()
+
+        shape, data = entry
+        return unpack_4bpp(data, shape)
+
+    def put(self, key: str, indices: np.ndarray):
+        """Store a frame, evicting least recently used frames to stay within budget"""
+        data = pack_4bpp(indices)
+        if len(data) > self.max_bytes:
+            logger.debug(f"Frame of {len(data)} bytes exceeds render cache budget")
+            return
+
+        with self._lock:
+            if key in self._frames:
+                self._size -= len(self._frames.pop(key)[1])
+            self._frames[key] = (indices.shape, data)
+            self._size += len(data)
+
+            while self._size > self.max_bytes:
+                old_key, (_, old_data) = self._frames.popitem(last=False)
+                self._size -= len(old_data)
+                self.evictions += 1
+                RENDER_CACHE_EVICTIONS_TOTAL.inc()
+                logger.debug(f"Evicted rendered frame {old_key}")
+
+            self._update_gauges()
+
+    def discard(self, content_hash: str):
+        """Drop every frame rendered from the given source content"""
+        with self._lock:
+            for key in [k for k in self._frames if k.startswith(f"{content_hash}:")]:
+                self._size -= len(self._frames.pop(key)[1])
+            self._update_gauges()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._size = 0
+            self._update_gauges()
+
+    def _update_gauges(self):
+        RENDER_CACHE_BYTES.set(self._size)
+        RENDER_CACHE_FRAMES.set(len(self._frames))
+
+    def get_info(self) -> Dict:
+        with self._lock:
+            return {
+                "frames": len(self._frames),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
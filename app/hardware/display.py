@@ -1,28 +1,52 @@
 import logging
 import time
 import threading
+from typing import Callable, Optional
 from PIL import Image
-from inky.auto import auto
 from config import Config
+from app import renditions
+from app.framecache import FrameCache, frame_key
+from app.hardware.panel import create_panel
+from app.imaging import fit_image
+from app.metrics import (
+    DISPLAY_CONNECTED, DISPLAY_CONSECUTIVE_FAILURES, DISPLAY_LAST_UPDATE_TIMESTAMP,
+    DISPLAY_UPDATE_DURATION, DISPLAY_UPDATES_TOTAL, RENDITION_SOURCE_TOTAL
+)
+from app.quantize import create_quantizer
+from app.timing import StageTimer, stage
+from app.utils import file_sha256
 
 logger = logging.getLogger(__name__)
 
 class Display:
     """Hardware interface for the e-ink display"""
     
-    def __init__(self):
-        """Initialize the display hardware"""
+    def __init__(self, panel=None):
+        """
+        Initialize the display hardware
+        panel is an already created driver, by default the one picked by Config.DISPLAY_DRIVER
+        """
         logger.info("Initializing display")
         self._consecutive_failures = 0
         self._last_successful_update = None
         self._lock = threading.Lock()  # Prevent concurrent hardware access
         
         try:
-            self.inky = auto(verbose=True)
+            self.inky = panel if panel is not None else create_panel(Config)
             self.resolution = self.inky.resolution
             self.colour = self.inky.colour
+            self.quantizer = create_quantizer(
+                self.inky,
+                Config.DISPLAY_DITHER,
+                Config.DISPLAY_SATURATION,
+                lut_bits=Config.DISPLAY_LUT_BITS,
+                lut_dir=Config.LUT_FOLDER
+            )
+            self.frame_cache = FrameCache(Config.RENDER_CACHE_BYTES) if self.quantizer and Config.RENDER_CACHE_BYTES else None
+            DISPLAY_CONNECTED.set(1)
             logger.info(f"Display initialized with resolution {self.resolution}")
         except Exception as e:
+            DISPLAY_CONNECTED.set(0)
             logger.error(f"Failed to initialize display: {e}")
             raise
     
@@ -31,45 +55,122 @@ class Display:
         return {
             "resolution": self.resolution,
             "colour": self.colour,
+            "driver": type(self.inky).__name__,
             "connected": True,  # We know it's connected if initialization succeeded
             "supported_formats": Config.SUPPORTED_FORMATS,
+            "dither": self.quantizer.algorithm if self.quantizer else "driver",
+            "render_cache": self.frame_cache.get_info() if self.frame_cache else None,
             "consecutive_failures": self._consecutive_failures,
             "last_successful_update": self._last_successful_update
         }
     
-    def update(self, image_path: str) -> bool:
-        """Update display with new image"""
+    def _render_settings(self, fit: str) -> tuple:
+        """Settings that change the rendered frame, part of the frame cache key"""
+        lut_bits = self.quantizer.lut.bits if self.quantizer.lut else 0
+        return (fit, self.quantizer.algorithm, Config.DISPLAY_SATURATION, lut_bits)
+    
+    def _render(self, image_path: str, content_hash: Optional[str] = None,
+                image: Optional[Image.Image] = None, fit: Optional[str] = None,
+                timer: Optional[StageTimer] = None) -> Image.Image:
+        """Turn an image into something the driver's set_image accepts"""
+        fit = fit or Config.DISPLAY_FIT
+        settings = self._render_settings(fit) if self.quantizer else None
+        cache_key = None
+        if self.frame_cache:
+            content_hash = content_hash or file_sha256(image_path)
+            cache_key = frame_key(content_hash, self.resolution, settings)
+            indices = self.frame_cache.get(cache_key)
+            if indices is not None:
+                logger.debug("Using cached rendered frame")
+                return self.quantizer.to_image(indices)
+        
+        if settings and Config.RENDITIONS:
+            # Quantized by an earlier display of this stored image
+            indices = renditions.load_frame(image_path, self.resolution, settings)
+            if indices is not None:
+                logger.debug("Using the stored frame rendition")
+                RENDITION_SOURCE_TOTAL.labels(source='frame').inc()
+                if cache_key:
+                    self.frame_cache.put(cache_key, indices)
+                return self.quantizer.to_image(indices)
+        
+        if image is None:
+            # The panel rendition is already fitted, far cheaper to decode than the original
+            panel = renditions.load_panel(image_path, self.resolution, fit) if Config.RENDITIONS else None
+            RENDITION_SOURCE_TOTAL.labels(source='panel' if panel else 'original').inc()
+            with panel or Image.open(image_path) as image:
+                logger.debug("Image opened successfully")
+                resized = fit_image(image, self.resolution, fit, timer=timer)
+        else:
+            # Already decoded during ingest
+            RENDITION_SOURCE_TOTAL.labels(source='upload').inc()
+            resized = fit_image(image, self.resolution, fit, timer=timer)
+        logger.debug(f"Image fitted to display ({fit})")
+        
+        if not self.quantizer:
+            return resized
+        
+        # Hand the driver palette indices so it skips its own conversion
+        with stage(timer, 'quantize'):
+            indices = self.quantizer.quantize(resized)
+        logger.debug(f"Image quantized with '{self.quantizer.algorithm}'")
+        if cache_key:
+            self.frame_cache.put(cache_key, indices)
+        if Config.RENDITIONS:
+            renditions.save_frame(image_path, self.resolution, settings, indices)
+        return self.quantizer.to_image(indices)
+    
+    def update(self, image_path: str, on_stage: Optional[Callable[[str], None]] = None,
+               content_hash: Optional[str] = None, image: Optional[Image.Image] = None,
+               fit: Optional[str] = None, timer: Optional[StageTimer] = None) -> bool:
+        """
+        Update display with new image
+        on_stage, if given, is called with 'refreshing' before the panel refresh starts.
+        content_hash, if known, saves hashing the file for the frame cache lookup.
+        image, if given, is the already decoded contents of image_path.
+        fit is one of the imaging.FIT_MODES, defaulting to Config.DISPLAY_FIT.
+        timer, if given, records the render, 'set_image' and 'refresh' stages.
+        """
         start_time = time.time()
         
         if not self._lock.acquire(timeout=Config.DISPLAY_UPDATE_TIMEOUT):
             logger.error(f"Timeout ({Config.DISPLAY_UPDATE_TIMEOUT}s) waiting for display lock")
             self._consecutive_failures += 1
+            DISPLAY_CONSECUTIVE_FAILURES.inc()
+            DISPLAY_UPDATES_TOTAL.labels(status="failure").inc()
             return False
             
         try:
             logger.info(f"Updating display with image: {image_path}")
             
             # Break down the update into steps for better logging
-            with Image.open(image_path) as image:
-                logger.debug("Image opened successfully")
-                resized = image.resize(self.resolution)
-                logger.debug("Image resized successfully")
-                self.inky.set_image(resized)
-                logger.debug("Image set to display buffer")
-                logger.info(f"Starting display refresh (this may take up to {Config.DISPLAY_UPDATE_TIMEOUT}s)...")
+            frame = self._render(image_path, content_hash, image, fit, timer)
+            with stage(timer, 'set_image'):
+                self.inky.set_image(frame)
+            logger.debug("Image set to display buffer")
+            if on_stage:
+                on_stage('refreshing')
+            logger.info(f"Starting display refresh (this may take up to {Config.DISPLAY_UPDATE_TIMEOUT}s)...")
+            with stage(timer, 'refresh'):
                 self.inky.show()
-                logger.debug("Display refresh completed")
+            logger.debug("Display refresh completed")
             
             # Update success metrics
             self._consecutive_failures = 0
             self._last_successful_update = time.time()
+            DISPLAY_LAST_UPDATE_TIMESTAMP.set(self._last_successful_update)
             
             duration = time.time() - start_time
+            DISPLAY_UPDATE_DURATION.observe(duration)
+            DISPLAY_UPDATES_TOTAL.labels(status="success").inc()
             logger.info(f"Display update successful (took {duration:.2f}s)")
             return True
             
         except Exception as e:
             self._consecutive_failures += 1
+            DISPLAY_CONSECUTIVE_FAILURES.inc()
+            DISPLAY_UPDATE_DURATION.observe(time.time() - start_time)
+            DISPLAY_UPDATES_TOTAL.labels(status="failure").inc()
             logger.error(f"Display update failed: {e}", exc_info=True)
             return False
             
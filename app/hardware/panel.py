@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DRIVERS = ('inky', 'virtual')
+
+class VirtualPanel:
+    """
+    Stand-in for an Inky Impression panel.
+
+    Accepts the same set_image()/show() calls as the inky drivers, sleeps
+    for a configurable SPI transfer and refresh time, and writes each
+    shown frame out as a PNG so the pipeline can run on any machine.
+    """
+
+    # Palettes of the Inky Impression 7.3", blended by saturation like the real driver
+    DESATURATED_PALETTE = [
+        [0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255],
+        [255, 0, 0], [255, 255, 0], [255, 140, 0], [255, 255, 255]
+    ]
+    SATURATED_PALETTE = [
+        [0, 0, 0], [217, 242, 255], [3, 124, 76], [27, 46, 198],
+        [245, 80, 34], [255, 255, 68], [239, 121, 44], [255, 255, 255]
+    ]
+
+    def __init__(self, resolution: Tuple[int, int] = (800, 480), spi_seconds: float = 0.0,
+                 refresh_seconds: float = 0.0, output_dir: Optional[Path] = None, keep_frames: int = 10):
+        self.resolution = tuple(resolution)
+        self.width, self.height = self.resolution
+        self.colour = 'multi'
+        self.spi_seconds = spi_seconds
+        self.refresh_seconds = refresh_seconds
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.keep_frames = keep_frames
+        self.buf = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.frames_shown = 0
+        self._saturation = 0.5
+        self._busy = threading.Lock()  # A real panel can only do one refresh at a time
+
+        if self.output_dir:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Virtual panel {self.width}x{self.height} "
+                    f"(SPI {spi_seconds}s, refresh {refresh_seconds}s, frames in {self.output_dir})")
+
+    def _palette_blend(self, saturation: float, dtype: str = 'uint8') -> list:
+        """Same contract as the inky driver: 7 blended colours plus 'clear', flattened"""
+        saturation = float(saturation)
+        palette = []
+        for saturated, desaturated in zip(self.SATURATED_PALETTE[:7], self.DESATURATED_PALETTE[:7]):
+            palette += [int(s * saturation + d * (1.0 - saturation)) for s, d in zip(saturated, desaturated)]
+        return palette + [255, 255, 255]
+
+    def set_image(self, image: Image.Image, saturation: float = 0.5):
+        """Copy an image to the frame buffer, quantizing it like the driver if needed"""
+        if image.size != self.resolution:
+            raise ValueError(f"Image must be ({self.width}x{self.height}) pixels!")
+        self._saturation = saturation
+        if image.mode != 'P':
+            palette_image = Image.new('P', (1, 1))
+            palette_image.putpalette(self._palette_blend(saturation) + [0, 0, 0] * 248)
+            image.load()
+            image = image.im.convert('P', True, palette_image.im)
+        self.buf = np.array(image, dtype=np.uint8).reshape((self.height, self.width))
+
+    def show(self):
+        """Simulate the SPI transfer and refresh, then save the frame"""
+        with self._busy:
+            time.sleep(self.spi_seconds)
+            time.sleep(self.refresh_seconds)
+            self.frames_shown += 1
+            if self.output_dir:
+                self._save_frame()
+
+    def render(self) -> Image.Image:
+        """What the panel is currently showing, as an RGB image"""
+        palette = np.array(self._palette_blend(self._saturation), dtype=np.uint8).reshape(-1, 3)
+        return Image.fromarray(palette[np.minimum(self.buf, len(palette) - 1)])
+
+    def _save_frame(self):
+        frame = self.render()
+        frame_path = self.output_dir / f"frame-{self.frames_shown:06d}.png"
+        frame.save(frame_path)
+        frame.save(self.output_dir / "latest.png")
+
+        # Keep only the most recent frames
+        frames = sorted(self.output_dir.glob('frame-*.png'))
+        for old_frame in frames[:-self.keep_frames]:
+            try:
+                old_frame.unlink()
+            except FileNotFoundError:
+                pass
+
+def create_panel(config):
+    """Create the panel driver selected by config.DISPLAY_DRIVER"""
+    driver = config.DISPLAY_DRIVER
+    if driver == 'virtual':
+        return VirtualPanel(
+            resolution=config.VIRTUAL_PANEL_RESOLUTION,
+            spi_seconds=config.VIRTUAL_PANEL_SPI_SECONDS,
+            refresh_seconds=config.VIRTUAL_PANEL_REFRESH_SECONDS,
+            output_dir=config.VIRTUAL_PANEL_FOLDER,
+            keep_frames=config.VIRTUAL_PANEL_KEEP_FRAMES
+        )
+    if driver == 'inky':
+        # Imported here so the virtual panel works without the hardware libraries
+        from inky.auto import auto
+        return auto(verbose=True)
+    raise ValueError(f"Unknown display driver '{driver}'. Supported: {DRIVERS}")
@@ -0,0 +1,139 @@
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from app.startup import lazy_import
+
+logger = logging.getLogger(__name__)
+
+psutil = lazy_import('psutil')
+
+class ServiceProbe:
+    """
+    Reads the state of a systemd service from cgroup and /proc files
+    instead of forking systemctl.
+
+    systemd runs every service in its own cgroup named after the unit, and
+    removes it when the service stops. A non-empty cgroup therefore means
+    the service is running, and its processes give the main PID, uptime and
+    memory. When the cgroup can't be found, for example when the service
+    runs in a custom slice, status() returns None and the caller falls back
+    to systemctl.
+    """
+
+    def __init__(self, service_name: str, run_command: Optional[Callable[[list], Tuple[bool, str]]] = None,
+                 proc_root: str = '/proc', cgroup_root: str = '/sys/fs/cgroup'):
+        self.unit = service_name if service_name.endswith('.service') else f"{service_name}.service"
+        self.run_command = run_command
+        self.proc_root = Path(proc_root)
+        self.cgroup_root = Path(cgroup_root)
+        self._restarts: Optional[int] = None
+        self._restarts_read = False
+
+    def _own_cgroups(self) -> Dict[str, str]:
+        """Controller -> cgroup path of this process, '' is the unified (v2) hierarchy"""
+        cgroups = {}
+        try:
+            for line in (self.proc_root / 'self' / 'cgroup').read_text().splitlines():
+                _, controllers, path = line.split(':', 2)
+                for controller in controllers.split(',') if controllers else ['']:
+                    cgroups[controller] = path
+        except (OSError, ValueError):
+            pass
+        return cgroups
+
+    def _unit_dirs(self) -> List[Path]:
+        """Directories that may hold the unit's cgroup, v2 first"""
+        cgroups = self._own_cgroups()
+        paths = []
+        # Running inside the service is the common case, use our own cgroup
+        for controller in ('', 'name=systemd'):
+            path = cgroups.get(controller, '')
+            if path.rstrip('/').endswith(f"/{self.unit}"):
+                paths.append(path.strip('/'))
+        paths.append(f"system.slice/{self.unit}")
+
+        dirs = []
+        for path in paths:
+            for hierarchy in ('', 'unified', 'systemd'):
+                directory = self.cgroup_root / hierarchy / path
+                if directory not in dirs:
+                    dirs.append(directory)
+        return dirs
+
+    def _read_pids(self, directory: Path) -> Optional[List[int]]:
+        try:
+            return [int(pid) for pid in (directory / 'cgroup.procs').read_text().split()]
+        except (OSError, ValueError):
+            return None
+
+    def _cgroup_memory(self, directory: Path) -> Optional[int]:
+        """Memory charged to the unit's cgroup, v2 or v1"""
+        candidates = [directory / 'memory.current']
+        memory_path = self._own_cgroups().get('memory')
+        if memory_path and memory_path.rstrip('/').endswith(f"/{self.unit}"):
+            candidates.append(self.cgroup_root / 'memory' / memory_path.strip('/') / 'memory.usage_in_bytes')
+        candidates.append(self.cgroup_root / 'memory' / 'system.slice' / self.unit / 'memory.usage_in_bytes')
+        for candidate in candidates:
+            try:
+                return int(candidate.read_text())
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def _main_process(self, pids: List[int]) -> Optional['psutil.Process']:
+        """The oldest process in the cgroup, the one systemd started"""
+        processes = []
+        for pid in pids:
+            try:
+                process = psutil.Process(pid)
+                processes.append((process.create_time(), process))
+            except psutil.Error:
+                continue
+        return min(processes, key=lambda entry: entry[0])[1] if processes else None
+
+    def get_restarts(self) -> Optional[int]:
+        """
+        systemd's automatic restart count. Only changes when the service
+        restarts, which restarts this process too, so it is read once.
+        """
+        if not self._restarts_read and self.run_command:
+            self._restarts_read = True
+            success, output = self.run_command(['systemctl', 'show', self.unit, '-p', 'NRestarts', '--value'])
+            if success and output.isdigit():
+                self._restarts = int(output)
+        return self._restarts
+
+    def status(self) -> Optional[Dict]:
+        """Service state without forking, or None if the cgroup can't be found"""
+        for directory in self._unit_dirs():
+            pids = self._read_pids(directory)
+            if not pids:
+                continue
+
+            main = self._main_process(pids)
+            if main is None:
+                continue
+
+            try:
+                started = main.create_time()
+                main_rss = main.memory_info().rss
+            except psutil.Error:
+                continue
+            since = time.strftime('%a %Y-%m-%d %H:%M:%S %Z', time.localtime(started))
+            return {
+                "active": True,
+                "state": f"active (running) since {since}",
+                "details": f"Main PID: {main.pid}, {len(pids)} processes in {directory}",
+                "source": "cgroup",
+                "main_pid": main.pid,
+                "uptime": round(time.time() - started, 1),
+                "restarts": self.get_restarts(),
+                "memory": {
+                    "main_pid_rss": main_rss,
+                    "cgroup": self._cgroup_memory(directory)
+                }
+            }
+
+        logger.debug(f"No running cgroup found for {self.unit}")
+        return None
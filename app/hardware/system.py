@@ -1,16 +1,20 @@
 import logging
 import subprocess
-import psutil
 from typing import Dict, Tuple, Optional
 from pathlib import Path
+from app.hardware.service import ServiceProbe
+from app.startup import lazy_import
 
 logger = logging.getLogger(__name__)
 
+psutil = lazy_import('psutil')
+
 class SystemHardware:
     """Hardware interface for the Raspberry Pi system"""
     
     def __init__(self, service_name: str = 'mirage'):
         self.service_name = service_name
+        self.service_probe = ServiceProbe(service_name, run_command=self.run_command)
     
     def run_command(self, command: list[str], timeout: int = 10) -> Tuple[bool, str]:
         """Run a system command and return success status and output"""
@@ -47,34 +51,45 @@ class SystemHardware:
                 logger.error(f"Failed to read CPU temperature: {e2}")
                 return None
     
+    def get_cpu_stats(self) -> Dict:
+        """CPU utilization and clock speed"""
+        frequency = psutil.cpu_freq()
+        return {
+            "percent": psutil.cpu_percent(),
+            "count": psutil.cpu_count(),
+            "frequency": frequency.current if frequency else None
+        }
+    
+    def get_memory_stats(self) -> Dict:
+        """Memory and swap usage"""
+        memory = psutil.virtual_memory()
+        return {
+            "total": memory.total,
+            "available": memory.available,
+            "percent": memory.percent,
+            "swap_percent": psutil.swap_memory().percent
+        }
+    
+    def get_disk_stats(self, path: str = '/') -> Dict:
+        """Usage of the filesystem holding path"""
+        disk = psutil.disk_usage(path)
+        return {
+            "total": disk.total,
+            "free": disk.free,
+            "percent": disk.percent
+        }
+    
     def get_system_stats(self) -> Dict:
         """Get comprehensive system statistics"""
         try:
-            cpu_percent = psutil.cpu_percent()
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
-            
             stats = {
-                "cpu": {
-                    "percent": cpu_percent,
-                    "count": psutil.cpu_count(),
-                    "temperature": self.get_temperature(),
-                    "frequency": psutil.cpu_freq().current if hasattr(psutil.cpu_freq(), 'current') else None
-                },
-                "memory": {
-                    "total": memory.total,
-                    "available": memory.available,
-                    "percent": memory.percent,
-                    "swap_percent": psutil.swap_memory().percent
-                },
-                "disk": {
-                    "total": disk.total,
-                    "free": disk.free,
-                    "percent": disk.percent
-                }
+                "cpu": {**self.get_cpu_stats(), "temperature": self.get_temperature()},
+                "memory": self.get_memory_stats(),
+                "disk": self.get_disk_stats()
             }
             
-            logger.debug(f"System stats collected: CPU {cpu_percent}%, Memory {memory.percent}%, Disk {disk.percent}%")
+            logger.debug(f"System stats collected: CPU {stats['cpu']['percent']}%, "
+                         f"Memory {stats['memory']['percent']}%, Disk {stats['disk']['percent']}%")
             return stats
             
         except Exception as e:
@@ -82,13 +97,21 @@ class SystemHardware:
             return {}
     
     def get_service_status(self) -> Dict:
-        """Get status of the service"""
+        """Get status of the service, from its cgroup when possible"""
+        try:
+            status = self.service_probe.status()
+            if status is not None:
+                return status
+        except Exception as e:
+            logger.warning(f"Service probe failed, falling back to systemctl: {e}")
+        
         success, output = self.run_command(['systemctl', 'status', self.service_name])
         
         status = {
             "active": False,
             "state": "unknown",
-            "details": output
+            "details": output,
+            "source": "systemctl"
         }
         
         if success:
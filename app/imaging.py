@@ -0,0 +1,144 @@
+"""
+Memory-conscious image decoding for the display pipeline
+"""
+import logging
+import math
+from typing import Optional, Tuple
+from app.startup import lazy_import
+from app.timing import StageTimer, stage
+
+Image = lazy_import('PIL.Image')
+
+logger = logging.getLogger(__name__)
+
+# Formats Pillow can decode at a reduced DCT scale; phone cameras write MPO, a JPEG with extra frames appended
+JPEG_FORMATS = ('JPEG', 'MPO')
+
+class ImageTooLargeError(ValueError):
+    """The image has more pixels than the decode budget allows"""
+
+def decode(img: 'Image.Image', target_size: Optional[Tuple[int, int]] = None,
+           max_pixels: Optional[int] = None) -> 'Image.Image':
+    """
+    Load an opened image at the smallest scale that still covers target_size.
+
+    JPEGs are decoded with DCT scaling (draft), so a 24MP photo never exists
+    at full size in memory. Whatever remains more than twice the target is
+    shrunk with a cheap integer reduce(). If the image is over max_pixels
+    and can't be decoded at a reduced scale, ImageTooLargeError is raised before
+    any pixel data is allocated.
+    """
+    width, height = img.size
+    request = target_size
+
+    if max_pixels and width * height > max_pixels:
+        if img.format not in JPEG_FORMATS:
+            raise ImageTooLargeError(f"Image too large ({width}x{height} pixels). Maximum: {max_pixels} pixels")
+        # DCT scaling only divides by powers of two, up to 8
+        scale = 2 ** math.ceil(math.log2(math.sqrt(width * height / max_pixels)))
+        if scale > 8:
+            raise ImageTooLargeError(f"Image too large ({width}x{height} pixels). Maximum: {max_pixels} pixels")
+        budget_size = (math.ceil(width / scale), math.ceil(height / scale))
+        if request is None or request[0] > budget_size[0] or request[1] > budget_size[1]:
+            request = budget_size
+
+    if request and img.format in JPEG_FORMATS:
+        # draft picks the largest DCT scale (1/2, 1/4, 1/8) that keeps both sides >= request
+        img.draft(img.mode if img.mode in ('RGB', 'L') else None, request)
+        if img.size != (width, height):
+            logger.debug(f"Decoding JPEG at {img.size[0]}x{img.size[1]} instead of {width}x{height}")
+
+    if max_pixels and img.size[0] * img.size[1] > max_pixels:
+        raise ImageTooLargeError(f"Image too large ({width}x{height} pixels). Maximum: {max_pixels} pixels")
+
+    img.load()
+
+    return reduce_to(img, target_size) if target_size else img
+
+def reduce_to(img: 'Image.Image', target_size: Tuple[int, int]) -> 'Image.Image':
+    """Shrink a decoded image by the largest integer factor that still covers target_size"""
+    factor = min(img.size[0] // target_size[0], img.size[1] // target_size[1])
+    return img.reduce(factor) if factor >= 2 else img
+
+FIT_MODES = ('cover', 'contain', 'center-crop', 'stretch')
+
+Box = Tuple[float, float, float, float]
+
+def fit_geometry(source_size: Tuple[int, int], target_size: Tuple[int, int],
+                 fit: str) -> Tuple[Box, Tuple[int, int], Tuple[int, int]]:
+    """
+    Work out how a source image maps onto the panel.
+    Returns the region of the source to use, the size to resample that
+    region to, and where to paste it on the panel.
+
+    cover        scale to fill the panel, cropping the overflow evenly
+    contain      scale to fit inside the panel, leaving borders
+    center-crop  no scaling, take the middle of the image at native resolution
+    stretch      scale each axis independently to the panel size
+    """
+    sw, sh = source_size
+    tw, th = target_size
+
+    if fit == 'stretch':
+        return (0, 0, sw, sh), (tw, th), (0, 0)
+
+    if fit == 'cover':
+        scale = max(tw / sw, th / sh)
+        cw, ch = tw / scale, th / scale
+        left, top = (sw - cw) / 2, (sh - ch) / 2
+        return (left, top, left + cw, top + ch), (tw, th), (0, 0)
+
+    if fit == 'contain':
+        scale = min(tw / sw, th / sh)
+        out = (max(1, round(sw * scale)), max(1, round(sh * scale)))
+        return (0, 0, sw, sh), out, ((tw - out[0]) // 2, (th - out[1]) // 2)
+
+    if fit == 'center-crop':
+        cw, ch = min(sw, tw), min(sh, th)
+        left, top = (sw - cw) // 2, (sh - ch) // 2
+        return (left, top, left + cw, top + ch), (cw, ch), ((tw - cw) // 2, (th - ch) // 2)
+
+    raise ValueError(f"Unknown fit mode '{fit}'. Supported: {FIT_MODES}")
+
+def decode_size(source_size: Tuple[int, int], target_size: Tuple[int, int], fit: str) -> Tuple[int, int]:
+    """Smallest size the whole image can be decoded at without losing detail in the fitted region"""
+    sw, sh = source_size
+    if fit == 'stretch':
+        # Each axis only has to cover its own panel dimension
+        return (min(sw, target_size[0]), min(sh, target_size[1]))
+
+    box, out, _ = fit_geometry(source_size, target_size, fit)
+    # Scale that makes the cropped region exactly the output size, never upscaling
+    scale = min(1.0, max(out[0] / (box[2] - box[0]), out[1] / (box[3] - box[1])))
+    # Rounded first so float noise like 480.0000001 doesn't become 481
+    return (min(sw, math.ceil(round(sw * scale, 6))), min(sh, math.ceil(round(sh * scale, 6))))
+
+def fit_image(img: 'Image.Image', target_size: Tuple[int, int], fit: str,
+              background=(255, 255, 255), timer: Optional[StageTimer] = None) -> 'Image.Image':
+    """
+    Fit an image to the panel. img may be freshly opened: the crop is
+    planned from the header dimensions, the image is decoded at the scale
+    that crop needs, and only the cropped region is resampled.
+    timer, if given, records the 'decode' and 'resize' stages.
+    """
+    box, out, offset = fit_geometry(img.size, target_size, fit)
+    header_size = img.size
+
+    with stage(timer, 'decode'):
+        img = decode(img, decode_size(header_size, target_size, fit))
+
+    with stage(timer, 'resize'):
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        # Map the planned box onto whatever resolution was actually decoded
+        sx, sy = img.size[0] / header_size[0], img.size[1] / header_size[1]
+        box = (box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy)
+        region = img.resize(out, box=box)
+
+        if out == tuple(target_size):
+            return region
+
+        canvas = Image.new('RGB', target_size, background)
+        canvas.paste(region, offset)
+        return canvas
@@ -0,0 +1,291 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import Config
+from app import store
+from app.metrics import DISPLAY_QUEUE_DEPTH, DISPLAY_UPDATES_SUPERSEDED_TOTAL, observe_stage
+from app.timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+class JobStatus:
+    """Lifecycle states of a display job"""
+    QUEUED = 'queued'
+    RENDERING = 'rendering'
+    REFRESHING = 'refreshing'
+    DONE = 'done'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'  # Replaced by a newer job before it started
+
+    FINISHED = (DONE, FAILED, SUPERSEDED)
+
+class DisplayJob:
+    """A single request to show an image on the display"""
+
+    def __init__(self, image_path: Path, image=None, content_hash: Optional[str] = None,
+                 fit: Optional[str] = None, timer: Optional[StageTimer] = None):
+        self.id = uuid.uuid4().hex
+        self.image_path = Path(image_path)
+        self.fit = fit or Config.DISPLAY_FIT
+        self.image = image  # Decoded pixels from ingest, released once the job finishes
+        self.content_hash = content_hash
+        self.status = JobStatus.QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.superseded_by: Optional[str] = None
+        # Pipeline stages, started by the request if it was timing the upload
+        self.timer = timer or StageTimer(observer=observe_stage)
+        # Time each state was entered, used for the timing breakdown
+        self.transitions: Dict[str, float] = {JobStatus.QUEUED: self.created_at}
+        self._done = threading.Event()
+        self._followers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JobStatus.FINISHED
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        """Move the job to a new state and record when it happened"""
+        now = time.time()
+        with self._lock:
+            self.status = status
+            self.transitions[status] = now
+
+            if status == JobStatus.RENDERING and self.started_at is None:
+                self.started_at = now
+
+            if status == JobStatus.DONE:
+                self.timer.record('total', self.timer.elapsed())
+
+            if status in JobStatus.FINISHED:
+                self.error = error
+                self.finished_at = now
+                self.image = None
+                self._done.set()
+
+            # Sent once the new state is complete
+            if self._followers:
+                state = self.to_dict()
+                for updates in self._followers:
+                    updates.put(state)
+                if self.finished:
+                    self._followers.clear()
+
+        logger.debug(f"Display job {self.id} is now {status}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job has finished, returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def follow(self) -> queue.Queue:
+        """A queue of the job's state, now and after every status change until it finishes"""
+        updates = queue.Queue()
+        with self._lock:
+            updates.put(self.to_dict())
+            if not self.finished:
+                self._followers.append(updates)
+        return updates
+
+    def get_timings(self) -> Dict[str, Optional[float]]:
+        """Seconds spent in each stage of the job"""
+        t = self.transitions
+        end = self.finished_at or time.time()
+
+        def span(start_state: str, end_time: Optional[float]) -> Optional[float]:
+            if start_state not in t or end_time is None:
+                return None
+            return round(end_time - t[start_state], 3)
+
+        return {
+            "queued": span(JobStatus.QUEUED, self.started_at or (end if self.finished else None)),
+            "rendering": span(JobStatus.RENDERING, t.get(JobStatus.REFRESHING, self.finished_at)),
+            "refreshing": span(JobStatus.REFRESHING, self.finished_at),
+            "total": span(JobStatus.QUEUED, self.finished_at)
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "image": self.image_path.name,
+            "fit": self.fit,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "superseded_by": self.superseded_by,
+            "timings": self.get_timings(),
+            "stages": self.timer.to_dict()
+        }
+
+class DisplayQueue:
+    """
+    Serializes display updates through a single background worker.
+    The worker is the only caller of Display.update, so request handlers
+    never block on an e-ink refresh.
+    
+    With coalescing enabled the queue is last-writer-wins: a new job
+    supersedes every job that has not started yet, so a burst of uploads
+    costs one refresh instead of one each.
+    """
+
+    # Class variable to track instances
+    _instances = set()
+
+    def __init__(self, display, history: int = None, coalesce: bool = None):
+        self.display = display
+        self.history = history or Config.DISPLAY_JOB_HISTORY
+        self.coalesce = Config.DISPLAY_COALESCE if coalesce is None else coalesce
+        self._pending = deque()
+        self._jobs: "OrderedDict[str, DisplayJob]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self.current: Optional[DisplayJob] = None
+
+        self.worker_thread = threading.Thread(
+            target=self._process_jobs,
+            daemon=True,
+            name="DisplayWorker"
+        )
+        self.worker_thread.start()
+        logger.info("Started display worker thread")
+
+        DisplayQueue._instances.add(self)
+
+    @classmethod
+    def shutdown_all(cls):
+        """Shutdown all display queues"""
+        for display_queue in list(cls._instances):
+            display_queue.shutdown()
+        cls._instances.clear()
+
+    def submit(self, image_path: Path, image=None, content_hash: Optional[str] = None,
+               fit: Optional[str] = None, timer: Optional[StageTimer] = None) -> DisplayJob:
+        """
+        Queue an image for display and return the job immediately.
+        image and content_hash, when the caller already has them, spare
+        the worker from decoding and hashing the file again.
+        timer carries on the stage timings of the request that made the job.
+        """
+        job = DisplayJob(image_path, image=image, content_hash=content_hash, fit=fit, timer=timer)
+        superseded = []
+
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Display queue is shut down")
+            if self.coalesce:
+                superseded = list(self._pending)
+                self._pending.clear()
+            self._remember(job)
+            self._pending.append(job)
+            DISPLAY_QUEUE_DEPTH.set(len(self._pending))
+            self._condition.notify()
+
+        for old_job in superseded:
+            old_job.superseded_by = job.id
+            old_job.set_status(JobStatus.SUPERSEDED)
+            logger.info(f"Display job {old_job.id} superseded by {job.id}")
+        if superseded:
+            DISPLAY_UPDATES_SUPERSEDED_TOTAL.inc(len(superseded))
+
+        logger.info(f"Queued display job {job.id} for {job.image_path.name}")
+        return job
+
+    def get(self, job_id: str) -> Optional[DisplayJob]:
+        """Look up a job by id"""
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def recent(self) -> List[DisplayJob]:
+        """Recent jobs, newest first"""
+        with self._condition:
+            return list(reversed(self._jobs.values()))
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _remember(self, job: DisplayJob):
+        """Keep a bounded history of jobs, dropping the oldest finished ones"""
+        self._jobs[job.id] = job
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for old_id in [j.id for j in self._jobs.values() if j.finished][:excess]:
+            del self._jobs[old_id]
+
+    def _next_job(self) -> Optional[DisplayJob]:
+        """Wait for the next pending job, returns None when shutting down"""
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            if self._stopped:
+                return None
+            job = self._pending.popleft()
+            DISPLAY_QUEUE_DEPTH.set(len(self._pending))
+            self.current = job
+            return job
+
+    def _process_jobs(self):
+        """Worker loop: run queued jobs one at a time"""
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self._run(job)
+
+    def _run(self, job: DisplayJob):
+        job.set_status(JobStatus.RENDERING)
+        try:
+            success = self.display.update(
+                str(job.image_path),
+                on_stage=job.set_status,
+                content_hash=job.content_hash,
+                image=job.image,
+                fit=job.fit,
+                timer=job.timer
+            )
+            if success:
+                self._record_display(job)
+                job.set_status(JobStatus.DONE)
+            else:
+                job.set_status(JobStatus.FAILED, "Display update failed")
+        except Exception as e:
+            logger.error(f"Display job {job.id} failed: {e}", exc_info=True)
+            job.set_status(JobStatus.FAILED, str(e))
+        finally:
+            self.current = None
+
+        duration = job.get_timings()["total"]
+        logger.info(f"Display job {job.id} {job.status} (took {duration}s)")
+
+    def _record_display(self, job: DisplayJob):
+        """Count a display the panel has shown, so superseded and failed jobs never look recently used"""
+        try:
+            store.record_display(job.image_path)
+        except Exception as e:
+            logger.error(f"Failed to record display of {job.image_path.name}: {e}")
+
+    def shutdown(self):
+        """Stop the worker, failing any jobs that never started"""
+        with self._condition:
+            self._stopped = True
+            abandoned = list(self._pending)
+            self._pending.clear()
+            DISPLAY_QUEUE_DEPTH.set(0)
+            self._condition.notify_all()
+
+        for job in abandoned:
+            job.set_status(JobStatus.FAILED, "Display queue shut down")
+
+        if self.worker_thread.is_alive() and self.worker_thread is not threading.current_thread():
+            self.worker_thread.join(timeout=5)
+        DisplayQueue._instances.discard(self)
@@ -1,9 +1,13 @@
 import logging
+import os
 import time
-import threading
-from prometheus_client import Counter, Gauge, Histogram, REGISTRY
-from app.controller import Controller
-import sys
+from typing import TYPE_CHECKING, Optional
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+if TYPE_CHECKING:
+    from app.controller import Controller
 
 logger = logging.getLogger(__name__)
 
@@ -11,12 +15,21 @@ logger = logging.getLogger(__name__)
 DISPLAY_CONNECTED = Gauge(
     'mirage_display_connected',
     'Whether the e-ink display is connected and responding (1=yes, 0=no)',
+    multiprocess_mode='livemax',  # Connected if any running worker has the panel
     registry=REGISTRY
 )
 
 DISPLAY_LAST_UPDATE_TIMESTAMP = Gauge(
     'mirage_display_last_update_timestamp_seconds',
     'Unix timestamp of last successful display update',
+    multiprocess_mode='max',
+    registry=REGISTRY
+)
+
+DISPLAY_OWNER = Gauge(
+    'mirage_display_owner',
+    'Whether this process owns the display panel (1=yes, 0=no), summed over workers',
+    multiprocess_mode='livesum',
     registry=REGISTRY
 )
 
@@ -41,133 +54,299 @@ DISPLAY_UPDATE_DURATION = Histogram(
     registry=REGISTRY
 )
 
-# System metrics
-SYSTEM_CPU_PERCENT = Gauge(
-    'mirage_system_cpu_percent',
-    'Current CPU utilization percentage',
+DISPLAY_QUEUE_DEPTH = Gauge(
+    'mirage_display_queue_depth',
+    'Number of display jobs waiting for the display worker',
+    multiprocess_mode='livesum',
+    registry=REGISTRY
+)
+
+DISPLAY_UPDATES_SUPERSEDED_TOTAL = Counter(
+    'mirage_display_updates_superseded_total',
+    'Display refreshes skipped because a newer image replaced a pending update',
+    registry=REGISTRY
+)
+
+# Pipeline stage metrics, bucketed for how long each stage typically takes on a Pi
+UPLOAD_RECEIVE_DURATION = Histogram(
+    'mirage_upload_receive_duration_seconds',
+    'Time spent receiving and parsing the multipart upload',
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    registry=REGISTRY
+)
+
+UPLOAD_VALIDATE_DURATION = Histogram(
+    'mirage_upload_validate_duration_seconds',
+    'Time spent checking an upload and reading its image header',
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25],
+    registry=REGISTRY
+)
+
+IMAGE_DECODE_DURATION = Histogram(
+    'mirage_image_decode_duration_seconds',
+    'Time spent decoding image pixel data',
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+    registry=REGISTRY
+)
+
+IMAGE_SAVE_DURATION = Histogram(
+    'mirage_image_save_duration_seconds',
+    'Time spent writing an upload to storage',
+    buckets=[0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+    registry=REGISTRY
+)
+
+IMAGE_RESIZE_DURATION = Histogram(
+    'mirage_image_resize_duration_seconds',
+    'Time spent fitting an image to the panel resolution',
+    buckets=[0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+    registry=REGISTRY
+)
+
+IMAGE_QUANTIZE_DURATION = Histogram(
+    'mirage_image_quantize_duration_seconds',
+    'Time spent mapping an image to the panel palette',
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    registry=REGISTRY
+)
+
+DISPLAY_SET_IMAGE_DURATION = Histogram(
+    'mirage_display_set_image_duration_seconds',
+    'Time spent in the driver set_image call',
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+    registry=REGISTRY
+)
+
+DISPLAY_REFRESH_DURATION = Histogram(
+    'mirage_display_refresh_duration_seconds',
+    'Time spent in the driver show call, transferring and refreshing the panel',
+    buckets=[1, 5, 10, 15, 20, 25, 30, 40, 60],
+    registry=REGISTRY
+)
+
+DISPLAY_REQUEST_TO_PANEL_DURATION = Histogram(
+    'mirage_display_request_to_panel_duration_seconds',
+    'Time from receiving a display request to the refreshed panel, including queueing',
+    buckets=[1, 5, 10, 20, 30, 45, 60, 90, 120, 300],
+    registry=REGISTRY
+)
+
+# Histogram for each StageTimer stage name
+STAGE_DURATIONS = {
+    'receive': UPLOAD_RECEIVE_DURATION,
+    'validate': UPLOAD_VALIDATE_DURATION,
+    'decode': IMAGE_DECODE_DURATION,
+    'save': IMAGE_SAVE_DURATION,
+    'resize': IMAGE_RESIZE_DURATION,
+    'quantize': IMAGE_QUANTIZE_DURATION,
+    'set_image': DISPLAY_SET_IMAGE_DURATION,
+    'refresh': DISPLAY_REFRESH_DURATION,
+    'total': DISPLAY_REQUEST_TO_PANEL_DURATION
+}
+
+def observe_stage(stage: str, seconds: float):
+    """Record a pipeline stage duration in its histogram, used as a StageTimer observer"""
+    histogram = STAGE_DURATIONS.get(stage)
+    if histogram:
+        histogram.observe(seconds)
+
+# Rendered frame cache metrics
+RENDER_CACHE_HITS_TOTAL = Counter(
+    'mirage_render_cache_hits_total',
+    'Display updates served from a cached rendered frame',
     registry=REGISTRY
 )
 
-SYSTEM_MEMORY_PERCENT = Gauge(
-    'mirage_system_memory_percent',
-    'Current memory utilization percentage',
+RENDER_CACHE_MISSES_TOTAL = Counter(
+    'mirage_render_cache_misses_total',
+    'Display updates that had to decode and quantize the source image',
     registry=REGISTRY
 )
 
-SYSTEM_DISK_PERCENT = Gauge(
-    'mirage_system_disk_percent',
-    'Current disk utilization percentage',
+RENDER_CACHE_EVICTIONS_TOTAL = Counter(
+    'mirage_render_cache_evictions_total',
+    'Rendered frames evicted to stay within the cache byte budget',
     registry=REGISTRY
 )
 
-SYSTEM_TEMPERATURE = Gauge(
-    'mirage_system_temperature_celsius',
-    'Current CPU temperature in Celsius',
+RENDER_CACHE_BYTES = Gauge(
+    'mirage_render_cache_bytes',
+    'Bytes held by cached rendered frames',
+    multiprocess_mode='livesum',  # Each worker has its own cache
     registry=REGISTRY
 )
 
-# Storage metrics
-IMAGE_COUNT = Gauge(
-    'mirage_stored_images_total',
-    'Number of images currently stored',
+RENDER_CACHE_FRAMES = Gauge(
+    'mirage_render_cache_frames',
+    'Number of cached rendered frames',
+    multiprocess_mode='livesum',
     registry=REGISTRY
 )
 
-IMAGE_STORAGE_BYTES = Gauge(
-    'mirage_image_storage_bytes',
-    'Total bytes used by stored images',
+# Image store metrics
+UPLOADS_DEDUPLICATED_TOTAL = Counter(
+    'mirage_uploads_deduplicated_total',
+    'Uploads of an image that was already stored, served without decoding or writing it',
     registry=REGISTRY
 )
 
+# Background image collector metrics
+GC_RUN_DURATION = Histogram(
+    'mirage_gc_run_duration_seconds',
+    'Time spent in one run of the background image collector',
+    buckets=[0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+    registry=REGISTRY
+)
+
+GC_RECLAIMED_BYTES_TOTAL = Counter(
+    'mirage_gc_reclaimed_bytes_total',
+    'Bytes freed by the background image collector',
+    registry=REGISTRY
+)
+
+GC_EVICTED_IMAGES_TOTAL = Counter(
+    'mirage_gc_evicted_images_total',
+    'Images deleted by the background image collector',
+    ['reason'],  # count/quota/free_space
+    registry=REGISTRY
+)
+
+GC_LAST_RUN_TIMESTAMP = Gauge(
+    'mirage_gc_last_run_timestamp_seconds',
+    'Unix timestamp of the last background image collector run',
+    multiprocess_mode='max',
+    registry=REGISTRY
+)
+
+# Rendition metrics
+RENDITION_DURATION = Histogram(
+    'mirage_rendition_duration_seconds',
+    'Time spent writing the panel rendition and thumbnails of one stored image',
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    registry=REGISTRY
+)
+
+RENDITION_SOURCE_TOTAL = Counter(
+    'mirage_rendition_source_total',
+    'Display renders by what they started from',
+    ['source'],  # frame/panel/original/upload
+    registry=REGISTRY
+)
+
+# Cost of the on-scrape collector
+METRICS_COLLECT_DURATION = Histogram(
+    'mirage_metrics_collect_duration_seconds',
+    'Time spent gathering system and storage values for a /metrics scrape',
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1],
+    registry=REGISTRY
+)
+
+METRICS_COLLECT_ERRORS_TOTAL = Counter(
+    'mirage_metrics_collect_errors_total',
+    'Scrapes where system and storage values could not be gathered',
+    registry=REGISTRY
+)
+
+def multiprocess_enabled() -> bool:
+    """
+    Whether metrics are shared between worker processes through
+    PROMETHEUS_MULTIPROC_DIR. prometheus_client reads the variable when it
+    is imported, so it has to be set before the workers start.
+    """
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'))
+
+def generate_metrics(collector: Optional['MetricsCollector'] = None) -> bytes:
+    """
+    Prometheus exposition for /metrics. In multiprocess mode counters and
+    histograms are summed across workers and gauges merged by their
+    multiprocess_mode, collector adds the host values on top.
+    """
+    if not multiprocess_enabled():
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if collector:
+        # System and storage values are the same whichever worker reads them
+        registry.register(collector)
+    return generate_latest(registry)
+
 class MetricsCollector:
-    """Collects and updates system metrics"""
+    """
+    Prometheus collector for system and storage values, gathered when
+    /metrics is scraped rather than by a polling thread.
+    
+    Values come from the controller's cached status probes, so a scrape is
+    at most as stale as the probe TTLs and a burst of scrapes probes once.
+    """
     
     # Class variable to track instances
     _instances = set()
     
-    def __init__(self, controller: Controller, interval: int = 300):
+    # Everything the gauges need, the service state isn't exported
+    STATUS_FIELDS = ['system.temperature', 'system.cpu', 'system.memory', 'system.disk', 'storage']
+    
+    def __init__(self, controller: 'Controller', registry=REGISTRY):
         self.controller = controller
-        self.interval = interval
-        self.stop_event = threading.Event()
+        self.registry = registry
         
-        # Start collection thread
-        self.collection_thread = threading.Thread(
-            target=self._collect_metrics_periodically,
-            daemon=True,
-            name="MetricsThread"
-        )
-        self.collection_thread.start()
-        logger.info(f"Started metrics collection thread (interval: {interval}s)")
+        # The registry is per process, a new app replaces the previous collector
+        for collector in list(MetricsCollector._instances):
+            if collector.registry is registry:
+                collector.shutdown()
+        
+        registry.register(self)
+        logger.info("Registered on-scrape metrics collector")
         
         # Track this instance
         MetricsCollector._instances.add(self)
     
-    def __del__(self):
-        """Cleanup when instance is garbage collected"""
-        MetricsCollector._instances.discard(self)
-    
     @classmethod
     def shutdown_all(cls):
         """Shutdown all collector instances"""
-        if cls._instances:
-            print("Shutting down all metrics collectors...")
-            for collector in list(cls._instances):
-                collector.shutdown()
-            cls._instances.clear()
-            print("All metrics collectors shutdown complete")
+        for collector in list(cls._instances):
+            collector.shutdown()
+        cls._instances.clear()
     
-    def _collect_metrics_periodically(self):
-        """Periodically collect and update metrics"""
-        while not self.stop_event.is_set():
-            try:
-                self._update_metrics()
-            except Exception as e:
-                logger.error(f"Error collecting metrics: {e}")
-            
-            # Wait for next collection or stop
-            self.stop_event.wait(timeout=self.interval)
+    def describe(self):
+        """Metric names for registration, so registering doesn't trigger a collection"""
+        return list(self._families({}))
     
-    def _update_metrics(self):
-        """Update all metrics"""
-        # Get current status
-        status = self.controller.get_status()
-        
-        # Update system metrics
-        system = status["system"]
-        if temp := system["temperature"]:
-            SYSTEM_TEMPERATURE.set(temp)
-        
-        if "cpu" in system:
-            SYSTEM_CPU_PERCENT.set(system["cpu"]["percent"])
-        
-        if "memory" in system:
-            SYSTEM_MEMORY_PERCENT.set(system["memory"]["percent"])
-        
-        if "disk" in system:
-            SYSTEM_DISK_PERCENT.set(system["disk"]["percent"])
-        
-        # Update storage metrics
-        storage = status["storage"]
-        IMAGE_COUNT.set(storage["image_count"])
-        IMAGE_STORAGE_BYTES.set(storage["total_size"])
+    def collect(self):
+        """Called by prometheus_client on every scrape"""
+        start = time.perf_counter()
+        try:
+            status = self.controller.get_status(self.STATUS_FIELDS)
+        except Exception as e:
+            logger.error(f"Error collecting metrics: {e}")
+            METRICS_COLLECT_ERRORS_TOTAL.inc()
+            status = {}
+        METRICS_COLLECT_DURATION.observe(time.perf_counter() - start)
+        return self._families(status)
+    
+    def _families(self, status: dict):
+        """Gauge families for a status dict, with no samples for missing values"""
+        system = status.get("system") or {}
+        storage = status.get("storage") or {}
+        cpu, memory, disk = system.get("cpu") or {}, system.get("memory") or {}, system.get("disk") or {}
         
-        # Update display metrics
-        display = status["display"]
-        DISPLAY_CONSECUTIVE_FAILURES.inc(display["consecutive_failures"])
-        if last_update := display["last_successful_update"]:
-            DISPLAY_LAST_UPDATE_TIMESTAMP.set(last_update)
+        values = [
+            ('mirage_system_cpu_percent', 'Current CPU utilization percentage', cpu.get("percent")),
+            ('mirage_system_memory_percent', 'Current memory utilization percentage', memory.get("percent")),
+            ('mirage_system_disk_percent', 'Current disk utilization percentage', disk.get("percent")),
+            ('mirage_system_temperature_celsius', 'Current CPU temperature in Celsius', system.get("temperature")),
+            ('mirage_stored_images_total', 'Number of images currently stored', storage.get("image_count")),
+            ('mirage_image_storage_bytes', 'Total bytes used by stored images', storage.get("total_size"))
+        ]
+        for name, documentation, value in values:
+            family = GaugeMetricFamily(name, documentation)
+            if value is not None:
+                family.add_metric([], value)
+            yield family
     
     def shutdown(self):
         """Shutdown this collector instance."""
-        if self.collection_thread and self.collection_thread.is_alive():
-            self.stop_event.set()
-            try:
-                self.collection_thread.join(timeout=5)
-                if not self.collection_thread.is_alive():
-                    print("Metrics collector thread joined successfully")
-                else:
-                    print("Warning: Metrics collector thread did not shut down cleanly")
-            except Exception as e:
-                print(f"Error during metrics shutdown: {str(e)}", file=sys.stderr)
-            finally:
-                MetricsCollector._instances.discard(self) 
\ No newline at end of file
+        try:
+            self.registry.unregister(self)
+        except KeyError:
+            pass  # Already unregistered
+        MetricsCollector._instances.discard(self)
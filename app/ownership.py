@@ -0,0 +1,378 @@
+"""
+Cross-process display ownership.
+
+Display._lock only serializes threads, so with several gunicorn workers
+each one would open the panel and drive the SPI bus on its own. Instead
+the first process to take an exclusive flock on DISPLAY_LOCK_FILE owns
+the panel: it creates the Display and the DisplayQueue and serves the
+other workers over a Unix socket at DISPLAY_SOCKET. The other workers
+hand their jobs to the owner and never touch the hardware.
+
+The kernel drops the lock when the owner exits, so if it dies another
+worker takes over the panel on its next display request. With
+DISPLAY_DAEMON set the workers never claim the panel at all and displayd.py
+owns it instead, so web workers can be restarted without touching it.
+
+Requests use the framing in app.protocol. Submits and waits can ask for
+progress, which streams the job's state each time its status changes.
+"""
+import fcntl
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from app.jobs import DisplayQueue, JobStatus
+from app.metrics import DISPLAY_OWNER, observe_stage
+from app.protocol import read_frame, write_frame
+from app.timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 5.0  # Seconds to wait for an owner that is still starting up
+REQUEST_TIMEOUT = 30.0  # Seconds for the owner to answer anything but a wait
+
+class DisplayLock:
+    """Exclusive flock on a file, released by the kernel if the holder dies"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """Take the lock without blocking, returns False if another process holds it"""
+        if self._file:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.path, 'a+')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        # The owner's PID, for whoever is debugging
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answers request frames until the client disconnects"""
+
+    def handle(self):
+        def send_progress(job: Dict):
+            write_frame(self.wfile, {"event": "progress", "job": job})
+
+        while True:
+            try:
+                request = read_frame(self.rfile)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping display client: {e}")
+                return
+            if request is None:
+                return
+            try:
+                result = self.server.owner.handle(request, on_progress=send_progress if request.get('progress') else None)
+                response = {"ok": True, "result": result}
+            except OSError:
+                return  # Client went away while progress was streaming
+            except Exception as e:
+                logger.error(f"Display request {request.get('op')} failed: {e}", exc_info=True)
+                response = {"ok": False, "error": str(e)}
+            write_frame(self.wfile, response)
+
+class _OwnerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True  # Waits for long refreshes must not hold up shutdown
+
+class DisplayOwner:
+    """
+    Elects one process to own the panel.
+    The owner runs display jobs itself, every other process forwards
+    requests to it through call(). With claim=False this process never
+    takes the panel, it only talks to an owner such as displayd.
+    """
+
+    # Class variable to track instances
+    _instances = set()
+
+    def __init__(self, create_display: Callable[[], Any], lock_file: Path, socket_path: Path,
+                 history: int = None, coalesce: bool = None, claim: bool = True):
+        self.create_display = create_display
+        self.claim = claim
+        self.lock = DisplayLock(lock_file)
+        self.socket_path = Path(socket_path)
+        self.history = history
+        self.coalesce = coalesce
+        self._display = None
+        self._display_lock = threading.Lock()
+        self.queue: Optional[DisplayQueue] = None
+        self._server: Optional[_OwnerServer] = None
+        self._lock = threading.Lock()
+
+        if not (claim and self.take_ownership()):
+            logger.info(f"Display is owned by another process, sending display jobs to {self.socket_path}")
+        DisplayOwner._instances.add(self)
+
+    @classmethod
+    def shutdown_all(cls):
+        """Shutdown all display owners"""
+        for owner in list(cls._instances):
+            owner.shutdown()
+        cls._instances.clear()
+
+    @property
+    def owner(self) -> bool:
+        """Whether this process drives the panel"""
+        return self.queue is not None
+
+    @property
+    def display(self):
+        """
+        The panel's Display, created on first use so taking ownership doesn't
+        wait for the driver to load and probe the panel. If creating it
+        fails, the next use tries again.
+        """
+        with self._display_lock:
+            if self._display is None:
+                self._display = self.create_display()
+            return self._display
+
+    def take_ownership(self) -> bool:
+        """Become the owner if no other process is, returns whether this process owns the panel"""
+        with self._lock:
+            if self.owner:
+                return True
+            if not self.claim or not self.lock.acquire():
+                return False
+            try:
+                self.queue = DisplayQueue(_DeferredDisplay(self), history=self.history, coalesce=self.coalesce)
+                self._serve()
+            except Exception:
+                if self.queue:
+                    self.queue.shutdown()
+                self.queue = None
+                self.lock.release()
+                raise
+            DISPLAY_OWNER.set(1)
+            logger.info(f"Process {os.getpid()} owns the display, serving other workers on {self.socket_path}")
+            return True
+
+    def _serve(self):
+        # Holding the lock means any socket left behind is from a dead owner
+        self.socket_path.unlink(missing_ok=True)
+        self._server = _OwnerServer(str(self.socket_path), _RequestHandler)
+        self._server.owner = self
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.1},
+                         daemon=True, name="DisplayOwnerServer").start()
+
+    def handle(self, request: Dict, on_progress: Optional[Callable[[Dict], None]] = None) -> Any:
+        """
+        Run a request on the panel this process owns.
+        on_progress, for submit and wait, is called with the job's state
+        each time its status changes until it finishes or the request's
+        timeout runs out.
+        """
+        op = request.get('op')
+        if op in ('submit', 'job', 'wait'):
+            if op == 'submit':
+                timer = StageTimer.carry_over(request.get('stages', {}), request.get('elapsed', 0.0),
+                                              observer=observe_stage)
+                job = self.queue.submit(Path(request['path']), content_hash=request.get('content_hash'),
+                                        fit=request.get('fit'), timer=timer)
+            else:
+                job = self.queue.get(request['id'])
+                if job is None:
+                    return None
+            if on_progress and op != 'job':
+                self._follow(job, request.get('timeout'), on_progress)
+            elif op == 'wait':
+                job.wait(request.get('timeout'))
+            return job.to_dict()
+        if op == 'jobs':
+            return [job.to_dict() for job in self.queue.recent()]
+        if op == 'pending':
+            return self.queue.pending_count()
+        if op == 'info':
+            return {**self.display.get_info(), "owner_pid": os.getpid()}
+        raise ValueError(f"Unknown display request '{op}'")
+
+    def _follow(self, job, timeout: Optional[float], on_progress: Callable[[Dict], None]):
+        updates = job.follow()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                state = updates.get(timeout=remaining)
+            except queue.Empty:
+                return
+            on_progress(state)
+            if state["status"] in JobStatus.FINISHED:
+                return
+
+    def call(self, request: Dict, timeout: Optional[float] = REQUEST_TIMEOUT,
+             on_progress: Optional[Callable[[Dict], None]] = None) -> Any:
+        """Run a request on the owner, taking over the panel if the owner has gone"""
+        if on_progress:
+            request = {**request, 'progress': True}
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            if self.owner:
+                return self.handle(request, on_progress=on_progress)
+            try:
+                return self._send(request, timeout, on_progress)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not self.claim:
+                    raise RuntimeError(f"Display daemon is not running on {self.socket_path}")
+                # Nobody is listening: the owner exited, or hasn't started serving yet
+                if self.take_ownership():
+                    continue
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Display owner is not answering on {self.socket_path}")
+                time.sleep(0.1)
+
+    def _send(self, request: Dict, timeout: Optional[float],
+              on_progress: Optional[Callable[[Dict], None]]) -> Any:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(self.socket_path))
+            with sock.makefile('rwb') as stream:
+                write_frame(stream, request)
+                while True:
+                    try:
+                        response = read_frame(stream)
+                    except ValueError as e:
+                        raise RuntimeError(f"Bad reply from the display owner: {e}")
+                    if response is None:
+                        raise RuntimeError("Display owner closed the connection")
+                    if response.get("event") != "progress":
+                        break
+                    if on_progress:
+                        on_progress(response["job"])
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def shutdown(self):
+        """Stop serving and give up the panel"""
+        with self._lock:
+            if self._server:
+                self._server.shutdown()
+                self._server.server_close()
+                self._server = None
+                self.socket_path.unlink(missing_ok=True)
+            if self.queue:
+                self.queue.shutdown()
+                DISPLAY_OWNER.set(0)
+            self.queue = None
+            self._display = None
+            self.lock.release()
+        DisplayOwner._instances.discard(self)
+
+class _DeferredDisplay:
+    """Stands in for the owner's Display in its DisplayQueue until the first job needs it"""
+
+    def __init__(self, owner: DisplayOwner):
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._owner.display, name)
+
+class RemoteJob:
+    """A display job running in the owner process, as seen from another worker"""
+
+    def __init__(self, owner: DisplayOwner, state: Dict):
+        self._owner = owner
+        self._state = state
+
+    id = property(lambda self: self._state["id"])
+    status = property(lambda self: self._state["status"])
+    error = property(lambda self: self._state["error"])
+    superseded_by = property(lambda self: self._state["superseded_by"])
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JobStatus.FINISHED
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job has finished, returns False on timeout"""
+        state = self._owner.call({'op': 'wait', 'id': self.id, 'timeout': timeout},
+                                 timeout=None if timeout is None else timeout + REQUEST_TIMEOUT)
+        if state:
+            self._state = state
+        return self.finished
+
+    def to_dict(self) -> Dict:
+        return dict(self._state)
+
+class SharedDisplayQueue:
+    """The DisplayQueue interface, run here when this process owns the panel and by the owner otherwise"""
+
+    def __init__(self, owner: DisplayOwner):
+        self.owner = owner
+
+    def submit(self, image_path: Path, image=None, content_hash: Optional[str] = None,
+               fit: Optional[str] = None, timer: Optional[StageTimer] = None):
+        if self.owner.owner:
+            return self.owner.queue.submit(image_path, image=image, content_hash=content_hash, fit=fit, timer=timer)
+        # The decoded image can't cross processes, the owner reads the saved file
+        state = self.owner.call({
+            'op': 'submit',
+            'path': str(image_path),
+            'content_hash': content_hash,
+            'fit': fit,
+            'stages': timer.to_dict() if timer else {},
+            'elapsed': timer.elapsed() if timer else 0.0
+        })
+        return RemoteJob(self.owner, state)
+
+    def get(self, job_id: str):
+        if self.owner.owner:
+            return self.owner.queue.get(job_id)
+        state = self.owner.call({'op': 'job', 'id': job_id})
+        return RemoteJob(self.owner, state) if state else None
+
+    def recent(self) -> List:
+        if self.owner.owner:
+            return self.owner.queue.recent()
+        return [RemoteJob(self.owner, state) for state in self.owner.call({'op': 'jobs'})]
+
+    def pending_count(self) -> int:
+        if self.owner.owner:
+            return self.owner.queue.pending_count()
+        return self.owner.call({'op': 'pending'})
+
+class SharedDisplay:
+    """The parts of Display the controller uses, answered by whichever process owns the panel"""
+
+    def __init__(self, owner: DisplayOwner):
+        self.owner = owner
+        self._resolution = None
+
+    @property
+    def resolution(self):
+        if self.owner.owner:
+            return self.owner.display.resolution
+        if self._resolution is None:
+            # Fixed for the life of the panel, so asked for once
+            self._resolution = tuple(self.get_info()["resolution"])
+        return self._resolution
+
+    def get_info(self) -> Dict:
+        return self.owner.call({'op': 'info'})
@@ -0,0 +1,41 @@
+"""
+Framing for display requests over a Unix socket.
+
+Each frame is a 4-byte big-endian length followed by that many bytes of
+UTF-8 JSON. A client sends one request frame, {"op": ..., ...}, and reads
+back zero or more progress frames, {"event": "progress", "job": {...}},
+then exactly one reply, {"ok": true, "result": ...} or
+{"ok": false, "error": "..."}. A connection can carry several requests
+one after another.
+"""
+import json
+import struct
+from typing import BinaryIO, Dict, Optional
+
+HEADER = struct.Struct('>I')
+MAX_FRAME = 1024 * 1024  # Requests and job states are small, anything bigger is a bad peer
+
+def write_frame(stream: BinaryIO, message: Dict):
+    payload = json.dumps(message, separators=(',', ':')).encode()
+    if len(payload) > MAX_FRAME:
+        raise ValueError(f"Frame of {len(payload)} bytes is over the {MAX_FRAME} byte limit")
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError(f"Connection closed after {len(data)} of {size} bytes")
+    return data
+
+def read_frame(stream: BinaryIO) -> Optional[Dict]:
+    """The next message, or None if the peer closed the connection between frames"""
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) != HEADER.size:
+        raise ValueError("Connection closed inside a frame header")
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ValueError(f"Frame of {size} bytes is over the {MAX_FRAME} byte limit")
+    return json.loads(_read_exactly(stream, size))
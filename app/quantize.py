@@ -0,0 +1,258 @@
+"""
+Palette quantization for multi-colour e-ink panels.
+
+Maps RGB images to palette indices with NumPy so the display driver can
+take a ready-made 'P' image instead of running its own conversion.
+"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Sequence
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS = ('nearest', 'ordered', 'diffusion', 'diffusion-block')
+
+# Bayer threshold matrix, normalized to [-0.5, 0.5)
+_BAYER_8 = (np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21]
+], dtype=np.float32) + 0.5) / 64.0 - 0.5
+
+# Floyd-Steinberg weights as (row offset, column offset, weight)
+_FLOYD_STEINBERG = ((0, 1, 7 / 16), (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16))
+
+# Palettes of the Inky Impression 7.3", copied from its driver. Panels that
+# define their own SATURATED_PALETTE and DESATURATED_PALETTE use those
+DESATURATED_PALETTE = [
+    [0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255],
+    [255, 0, 0], [255, 255, 0], [255, 140, 0], [255, 255, 255]
+]
+SATURATED_PALETTE = [
+    [0, 0, 0], [217, 242, 255], [3, 124, 76], [27, 46, 198],
+    [245, 80, 34], [255, 255, 68], [239, 121, 44], [255, 255, 255]
+]
+PANEL_COLOURS = 7  # The palettes end with 'clear', which isn't a visible colour
+
+def panel_palette(inky, saturation: float = 0.5) -> Optional[np.ndarray]:
+    """
+    Get the RGB palette of a multi-colour Inky panel as a (colours, 3) array,
+    blended by saturation the way the driver does. Returns None for other panels.
+    """
+    if getattr(inky, 'colour', None) != 'multi':
+        return None
+    try:
+        saturated = np.array(getattr(inky, 'SATURATED_PALETTE', SATURATED_PALETTE), dtype=np.float64)
+        desaturated = np.array(getattr(inky, 'DESATURATED_PALETTE', DESATURATED_PALETTE), dtype=np.float64)
+        blended = saturated[:PANEL_COLOURS] * saturation + desaturated[:PANEL_COLOURS] * (1.0 - saturation)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Could not read panel palette: {e}")
+        return None
+    return blended.astype(np.uint8)  # Truncated, like the driver's int()
+
+def _nearest_indices(palette: np.ndarray, rgb: np.ndarray) -> np.ndarray:
+    """Exact nearest palette colour for each row of an (N, 3) array"""
+    palette_f = palette.astype(np.float32)
+    # |x - p|^2 = |x|^2 - 2 x.p + |p|^2, and |x|^2 doesn't affect argmin
+    distances = rgb.astype(np.float32) @ (-2.0 * palette_f.T)
+    distances += (palette_f ** 2).sum(axis=1)
+    return distances.argmin(axis=1).astype(np.uint8)
+
+class PaletteLUT:
+    """
+    RGB cube of precomputed palette indices.
+
+    Each channel is truncated to `bits` bits, so a lookup is a single
+    fancy-indexing operation instead of a distance search per pixel.
+    Tables are cached on disk per palette and memory-mapped when loaded.
+    """
+
+    def __init__(self, table: np.ndarray, bits: int):
+        self.table = table
+        self.bits = bits
+        self._shift = 8 - bits
+        self._flat = table.reshape(-1)
+
+    @staticmethod
+    def build(palette: np.ndarray, bits: int) -> np.ndarray:
+        """Compute the index cube, sampling the centre of every cell"""
+        size = 1 << bits
+        step = 1 << (8 - bits)
+        levels = np.arange(size, dtype=np.float32) * step + (step - 1) / 2.0
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        cells = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+        return _nearest_indices(palette, cells).reshape(size, size, size)
+
+    @staticmethod
+    def filename(palette: np.ndarray, bits: int) -> str:
+        digest = hashlib.sha1(np.ascontiguousarray(palette, dtype=np.uint8).tobytes()).hexdigest()[:16]
+        return f"palette-{digest}-{bits}bit.npy"
+
+    @classmethod
+    def load_or_build(cls, palette: np.ndarray, bits: int, directory: Optional[Path] = None) -> 'PaletteLUT':
+        """Memory-map a cached table for this palette, building and saving it if missing"""
+        size = 1 << bits
+        path = Path(directory) / cls.filename(palette, bits) if directory else None
+
+        if path and path.exists():
+            try:
+                table = np.load(path, mmap_mode='r')
+                if table.shape == (size, size, size) and table.dtype == np.uint8:
+                    logger.info(f"Loaded palette LUT from {path}")
+                    return cls(table, bits)
+                logger.warning(f"Ignoring palette LUT with unexpected shape {table.shape} at {path}")
+            except Exception as e:
+                logger.warning(f"Failed to load palette LUT {path}: {e}")
+
+        logger.info(f"Building {size}^3 palette LUT")
+        table = cls.build(palette, bits)
+
+        if path:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, table)
+                os.replace(tmp_path, path)  # Atomic so concurrent workers never see a partial file
+                logger.info(f"Saved palette LUT to {path}")
+                table = np.load(path, mmap_mode='r')
+            except Exception as e:
+                logger.warning(f"Failed to save palette LUT to {path}: {e}")
+
+        return cls(table, bits)
+
+    def lookup(self, rgb: np.ndarray) -> np.ndarray:
+        """Palette indices for a (..., 3) array of 0-255 values"""
+        if rgb.dtype != np.uint8:
+            rgb = np.clip(rgb, 0, 255).astype(np.uint8)
+        channels = (rgb >> self._shift).astype(np.intp)
+        flat_index = (channels[..., 0] << (2 * self.bits)) | (channels[..., 1] << self.bits) | channels[..., 2]
+        return self._flat.take(flat_index)
+
+class Quantizer:
+    """Maps RGB images to indices into a fixed palette"""
+
+    def __init__(self, palette: Sequence[Sequence[int]], algorithm: str = 'ordered',
+                 spread: float = 64.0, block_size: int = 8, lut: Optional[PaletteLUT] = None):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown quantization algorithm '{algorithm}'. Supported: {ALGORITHMS}")
+
+        self.palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+        self.algorithm = algorithm
+        self.spread = spread  # Strength of the ordered dither pattern
+        self.block_size = block_size  # Tile size for block error diffusion
+        self.lut = lut
+        self._palette_f = self.palette.astype(np.float32)
+
+    def quantize(self, image: Image.Image) -> np.ndarray:
+        """Quantize an image, returns a (height, width) array of palette indices"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if self.algorithm == 'nearest':
+            if self.lut:
+                return self.lut.lookup(np.asarray(image))
+            return self.nearest(np.asarray(image, dtype=np.float32))
+
+        rgb = np.asarray(image, dtype=np.float32)
+        if self.algorithm == 'ordered':
+            return self._ordered(rgb)
+        if self.algorithm == 'diffusion':
+            return self._diffuse_rows(rgb)
+        return self._diffuse_blocks(rgb)
+
+    def to_image(self, indices: np.ndarray) -> Image.Image:
+        """Wrap palette indices in a 'P' image that drivers accept as-is"""
+        height, width = indices.shape
+        image = Image.frombytes('P', (width, height), np.ascontiguousarray(indices, dtype=np.uint8).tobytes())
+        image.putpalette(self.palette.flatten().tolist())
+        return image
+
+    def nearest(self, rgb: np.ndarray) -> np.ndarray:
+        """Index of the closest palette colour for each pixel of a (..., 3) array"""
+        if self.lut:
+            return self.lut.lookup(rgb)
+        return _nearest_indices(self.palette, rgb.reshape(-1, 3)).reshape(rgb.shape[:-1])
+
+    def _ordered(self, rgb: np.ndarray) -> np.ndarray:
+        """Ordered (Bayer) dithering: offset by a tiled threshold, then snap"""
+        height, width = rgb.shape[:2]
+        reps = (-(-height // 8), -(-width // 8))
+        threshold = np.tile(_BAYER_8, reps)[:height, :width, None] * self.spread
+        return self.nearest(rgb + threshold)
+
+    def _diffuse_rows(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        Error diffusion one row at a time. Each row is quantized in a single
+        vectorized step and its error is pushed down to the next row only,
+        which is what makes the row step vectorizable.
+        """
+        height, width = rgb.shape[:2]
+        indices = np.empty((height, width), dtype=np.uint8)
+        carry = np.zeros((width, 3), dtype=np.float32)
+
+        for y in range(height):
+            row = np.clip(rgb[y] + carry, 0, 255)
+            indices[y] = self.nearest(row)
+            error = row - self._palette_f[indices[y]]
+
+            carry = error * 0.5
+            carry[1:] += error[:-1] * 0.25
+            carry[:-1] += error[1:] * 0.25
+
+        return indices
+
+    def _diffuse_blocks(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        Floyd-Steinberg error diffusion within independent square tiles.
+        Every tile is processed at once, so the Python loop runs
+        block_size^2 times regardless of image size.
+        """
+        height, width = rgb.shape[:2]
+        b = self.block_size
+        padded_h, padded_w = -(-height // b) * b, -(-width // b) * b
+
+        work = np.zeros((padded_h, padded_w, 3), dtype=np.float32)
+        work[:height, :width] = rgb
+        # (tile_rows, b, tile_cols, b, 3) -> (b, b, tiles, 3)
+        tiles = work.reshape(padded_h // b, b, padded_w // b, b, 3).transpose(1, 3, 0, 2, 4)
+        tiles = np.ascontiguousarray(tiles).reshape(b, b, -1, 3)
+        out = np.empty(tiles.shape[:3], dtype=np.uint8)
+
+        for i in range(b):
+            for j in range(b):
+                pixel = np.clip(tiles[i, j], 0, 255)
+                out[i, j] = self.nearest(pixel)
+                error = pixel - self._palette_f[out[i, j]]
+                for di, dj, weight in _FLOYD_STEINBERG:
+                    ni, nj = i + di, j + dj
+                    if ni < b and 0 <= nj < b:
+                        tiles[ni, nj] += error * weight
+
+        out = out.reshape(b, b, padded_h // b, padded_w // b).transpose(2, 0, 3, 1)
+        return out.reshape(padded_h, padded_w)[:height, :width]
+
+def create_quantizer(inky, algorithm: str, saturation: float = 0.5,
+                     lut_bits: int = 0, lut_dir: Optional[Path] = None) -> Optional[Quantizer]:
+    """
+    Build a quantizer for the given panel, or None if the driver should do
+    its own conversion (algorithm 'none' or a panel without a palette).
+    With lut_bits > 0 colour lookups go through a cached PaletteLUT.
+    """
+    if algorithm == 'none':
+        return None
+    palette = panel_palette(inky, saturation)
+    if palette is None:
+        logger.info("Panel has no blendable palette, using driver quantization")
+        return None
+    lut = PaletteLUT.load_or_build(palette, lut_bits, lut_dir) if lut_bits else None
+    logger.info(f"Using '{algorithm}' quantization with a {len(palette)} colour palette")
+    return Quantizer(palette, algorithm, lut=lut)
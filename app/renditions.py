@@ -0,0 +1,278 @@
+"""
+Derived renditions of stored images.
+
+Each stored image gets a folder, UPLOAD_FOLDER/renditions/<image id>/, with:
+
+    panel-800x480-cover.png     the image fitted to the panel, per fit mode
+    frame-800x480-cover-...bin  palette indices for the panel, 4bpp packed,
+                                per fit mode and quantizer settings
+    thumb-512.jpg ...           a thumbnail for each THUMBNAIL_SIZES entry,
+                                each resized from the next larger one
+
+The panel rendition and thumbnails are made by a RenditionWorker thread
+right after ingest, from the pixels ingest already decoded, unless those
+were decoded too small for the largest thumbnail. The frame is
+written by the process that owns the panel the first time it quantizes
+the image, as only it has the panel's palette. Later displays load the
+frame, or failing that the panel rendition, and previews load a
+thumbnail, so none of them decode the full-size original again.
+
+The bytes written are charged to the image in the catalog, so the
+background collector counts them against STORAGE_QUOTA_BYTES.
+"""
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+from config import Config
+from app.imaging import decode, decode_size, fit_image
+from app.metrics import RENDITION_DURATION
+from app.startup import lazy_import
+from app.uploads import atomic_path
+
+Image = lazy_import('PIL.Image')
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = 'renditions'
+MAX_QUEUED_IMAGES = 4  # Decoded images held for the worker, later submits reopen the file
+
+def image_id(image_path) -> Optional[str]:
+    """Id renditions of image_path are kept under, None if it isn't a stored image"""
+    image_path = Path(image_path)
+    if image_path.parent != Config.UPLOAD_FOLDER:
+        return None  # Anything else could share a stem with a stored image
+    return image_path.stem
+
+def rendition_dir(image_id: str) -> Path:
+    return Config.UPLOAD_FOLDER / RENDITIONS_DIR / image_id
+
+def panel_path(image_id: str, resolution: Tuple[int, int], fit: str) -> Path:
+    return rendition_dir(image_id) / f"panel-{resolution[0]}x{resolution[1]}-{fit}.png"
+
+def frame_path(image_id: str, resolution: Tuple[int, int], settings: Tuple) -> Path:
+    """The quantized frame for a panel resolution and Display._render_settings"""
+    return rendition_dir(image_id) / f"frame-{resolution[0]}x{resolution[1]}-{'-'.join(str(s) for s in settings)}.bin"
+
+def thumbnail_path(image_id: str, size: int) -> Path:
+    return rendition_dir(image_id) / f"thumb-{size}.jpg"
+
+def thumbnail_size(requested: Optional[int] = None, sizes: Sequence[int] = None) -> int:
+    """The smallest configured thumbnail size at least as big as requested, the smallest one by default"""
+    sizes = sorted(sizes or Config.THUMBNAIL_SIZES)
+    if requested is None:
+        return sizes[0]
+    return next((size for size in sizes if size >= requested), sizes[-1])
+
+def generate(image_path: Path, resolution: Tuple[int, int], fit: Optional[str] = None,
+             image: Optional['Image.Image'] = None, sizes: Sequence[int] = None) -> List[Path]:
+    """
+    Write the panel rendition and thumbnails of a stored image, skipping
+    any that already exist. image, if given, is its decoded pixels, at any
+    scale that covers the panel. If that is smaller than the largest
+    thumbnail, the thumbnails are made from a decode of the original at
+    their own scale. Returns the renditions written.
+    """
+    fit = fit or Config.DISPLAY_FIT
+    sizes = sorted(sizes or Config.THUMBNAIL_SIZES, reverse=True)
+    image_path = Path(image_path)
+    key = image_id(image_path)
+    if key is None:
+        return []
+    panel = panel_path(key, resolution, fit)
+    thumbnails = [thumbnail_path(key, size) for size in sizes]
+    missing_thumbnails = not all(thumbnail.exists() for thumbnail in thumbnails)
+    if panel.exists() and not missing_thumbnails:
+        return []
+
+    start = time.perf_counter()
+    rendition_dir(key).mkdir(parents=True, exist_ok=True)
+    opened = None
+    source = image
+    try:
+        if image is None or (missing_thumbnails and max(image.size) < sizes[0]):
+            opened = Image.open(image_path)
+            # Decoded once at the larger of the scales the panel and the largest thumbnail need
+            target = decode_size(opened.size, (sizes[0], sizes[0]), 'contain')
+            if image is None:
+                panel_target = decode_size(opened.size, resolution, fit)
+                target = (max(target[0], panel_target[0]), max(target[1], panel_target[1]))
+            if image is None or max(opened.size) > max(image.size):
+                source = decode(opened, target, Config.MAX_IMAGE_PIXELS)
+            if image is None:
+                image = source
+
+        written = []
+        if not panel.exists():
+            with atomic_path(panel) as partial:
+                fit_image(image, resolution, fit).save(str(partial), format='PNG')
+            written.append(panel)
+
+        # Each thumbnail is resized from the one above it, not from the source
+        if missing_thumbnails:
+            source = source if source.mode in ('RGB', 'L') else source.convert('RGB')
+            for size, thumbnail in zip(sizes, thumbnails):
+                source = source.copy()
+                source.thumbnail((size, size))
+                if not thumbnail.exists():
+                    with atomic_path(thumbnail) as partial:
+                        source.save(str(partial), format='JPEG', quality=85)
+                    written.append(thumbnail)
+    finally:
+        if opened is not None:
+            opened.close()
+
+    _charge(key, sum(path.stat().st_size for path in written))
+    RENDITION_DURATION.observe(time.perf_counter() - start)
+    logger.debug(f"Wrote {len(written)} renditions of {image_path.name}")
+    return written
+
+def load_panel(image_path, resolution: Tuple[int, int], fit: str) -> Optional['Image.Image']:
+    """The panel rendition of a stored image, opened, or None if there is none"""
+    key = image_id(image_path)
+    panel = panel_path(key, resolution, fit) if key else None
+    try:
+        return Image.open(panel) if panel else None
+    except FileNotFoundError:
+        return None
+
+def save_frame(image_path, resolution: Tuple[int, int], settings: Tuple, indices):
+    """Keep a quantized frame of a stored image for later displays"""
+    from app.framecache import pack_4bpp
+    key = image_id(image_path)
+    if key is None:
+        return
+    path = frame_path(key, resolution, settings)
+    try:
+        replaced = path.stat().st_size if path.exists() else 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_path(path) as partial:
+            partial.write_bytes(pack_4bpp(indices))
+        _charge(key, path.stat().st_size - replaced)
+    except OSError as e:
+        logger.warning(f"Failed to save frame rendition of {Path(image_path).name}: {e}")
+
+def load_frame(image_path, resolution: Tuple[int, int], settings: Tuple):
+    """A quantized frame saved by save_frame as a (height, width) index array, or None"""
+    from app.framecache import unpack_4bpp
+    key = image_id(image_path)
+    if key is None:
+        return None
+    try:
+        data = frame_path(key, resolution, settings).read_bytes()
+    except FileNotFoundError:
+        return None
+    if len(data) != (resolution[0] * resolution[1] + 1) // 2:
+        logger.warning(f"Ignoring truncated frame rendition of {Path(image_path).name}")
+        return None
+    return unpack_4bpp(data, (resolution[1], resolution[0]))
+
+def disk_size(image_id: str) -> int:
+    """Bytes taken by an image's renditions"""
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(rendition_dir(image_id)) if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+def _charge(image_id: str, size: int):
+    """Count rendition bytes against the image in the catalog"""
+    from app import store  # store imports this module to remove renditions
+    if not size:
+        return
+    try:
+        store.add_renditions_size(image_id, size)
+    except Exception as e:
+        logger.warning(f"Failed to record rendition size of {image_id}: {e}")
+
+def remove(image_id: str):
+    """Delete every rendition of an image"""
+    shutil.rmtree(rendition_dir(image_id), ignore_errors=True)
+
+def remove_many(image_ids: Iterable[str]):
+    """Delete every rendition of several images, only visiting the ones that have any"""
+    try:
+        existing = set(os.listdir(Config.UPLOAD_FOLDER / RENDITIONS_DIR))
+    except FileNotFoundError:
+        return
+    for image_id in existing.intersection(image_ids):
+        remove(image_id)
+
+class RenditionWorker:
+    """Generates renditions of newly stored images on a background thread"""
+
+    # Class variable to track instances
+    _instances = set()
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._queued = set()  # Paths waiting for the worker, so repeated submits queue one pass
+        self._held_images = 0
+        self._lock = threading.Lock()
+        self.worker_thread = threading.Thread(target=self._process, daemon=True, name="RenditionWorker")
+        self.worker_thread.start()
+        logger.info("Started rendition worker thread")
+
+        RenditionWorker._instances.add(self)
+
+    @classmethod
+    def shutdown_all(cls):
+        """Shutdown all rendition workers"""
+        for worker in list(cls._instances):
+            worker.shutdown()
+        cls._instances.clear()
+
+    def submit(self, image_path: Path, resolution: Tuple[int, int], fit: Optional[str] = None,
+               image: Optional['Image.Image'] = None):
+        """
+        Queue renditions of a stored image without waiting for them, unless
+        it is already queued. image is its decoded pixels, only held while
+        few others are queued.
+        """
+        image_path = Path(image_path)
+        with self._lock:
+            if image_path in self._queued:
+                return
+            self._queued.add(image_path)
+            if image is not None and self._held_images < MAX_QUEUED_IMAGES:
+                self._held_images += 1
+            else:
+                image = None
+        self._queue.put((image_path, tuple(resolution), fit, image))
+
+    def _process(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                image_path, resolution, fit, image = item
+                with self._lock:
+                    self._queued.discard(image_path)
+                try:
+                    generate(image_path, resolution, fit, image)
+                except FileNotFoundError:
+                    logger.debug(f"{image_path} was removed before its renditions were made")
+                except Exception as e:
+                    logger.error(f"Failed to make renditions of {image_path}: {e}", exc_info=True)
+                finally:
+                    if image is not None:
+                        with self._lock:
+                            self._held_images -= 1
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued image has its renditions"""
+        self._queue.join()
+
+    def shutdown(self):
+        """Stop the worker after the renditions already queued"""
+        if self.worker_thread.is_alive():
+            self._queue.put(None)
+            if self.worker_thread is not threading.current_thread():
+                self.worker_thread.join(timeout=5)
+        RenditionWorker._instances.discard(self)
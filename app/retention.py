@@ -0,0 +1,165 @@
+"""
+Background retention of stored images.
+
+The collector keeps the image store within KEEP_IMAGES unpinned images,
+STORAGE_QUOTA_BYTES in total (the images plus their renditions) and
+MIN_FREE_BYTES free on its disk, evicting the least recently displayed
+unpinned images first. It runs every GC_INTERVAL seconds and soon after
+each upload, on its own thread, so uploads never wait for deletes.
+Renditions are made after the upload that triggers a run, so that run
+may not count them yet; the next one does. Evictions are deleted GC_BATCH_SIZE at a
+time, each batch forgotten by the catalog in one transaction.
+
+Every worker has a collector, but only the one holding the flock on
+UPLOAD_FOLDER/.gc.lock runs at a time; the others skip that run.
+"""
+import logging
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+from config import Config
+from app import store
+from app.metrics import GC_EVICTED_IMAGES_TOTAL, GC_LAST_RUN_TIMESTAMP, GC_RECLAIMED_BYTES_TOTAL, GC_RUN_DURATION
+from app.ownership import DisplayLock
+from app.uploads import remove_stale_partials
+
+logger = logging.getLogger(__name__)
+
+GC_LOCK_NAME = '.gc.lock'
+
+class GarbageCollector:
+    """Evicts stored images in the background, see the module docstring"""
+
+    # Class variable to track instances
+    _instances = set()
+
+    def __init__(self, keep: int = None, quota: int = None, min_free: int = None,
+                 interval: float = None, batch_size: int = None, start: bool = True):
+        self.keep = Config.KEEP_IMAGES if keep is None else keep
+        self.quota = Config.STORAGE_QUOTA_BYTES if quota is None else quota
+        self.min_free = Config.MIN_FREE_BYTES if min_free is None else min_free
+        self.interval = interval or Config.GC_INTERVAL
+        self.batch_size = batch_size or Config.GC_BATCH_SIZE
+        self.last_run: Optional[Dict] = None
+        self._wake = threading.Event()
+        self._stopped = False
+        self._run_lock = threading.Lock()
+
+        self.worker_thread = None
+        if start:
+            self.worker_thread = threading.Thread(target=self._loop, daemon=True, name="ImageCollector")
+            self.worker_thread.start()
+            logger.info(f"Started image collector (every {self.interval}s)")
+
+        GarbageCollector._instances.add(self)
+
+    @classmethod
+    def shutdown_all(cls):
+        """Shutdown all collectors"""
+        for collector in list(cls._instances):
+            collector.shutdown()
+        cls._instances.clear()
+
+    def trigger(self):
+        """Ask for a run soon, without waiting for it"""
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"Image collector run failed: {e}", exc_info=True)
+
+    def run(self) -> Optional[Dict]:
+        """
+        Evict images until every limit is met, returns what was done,
+        or None if another process is collecting
+        """
+        lock = DisplayLock(Config.UPLOAD_FOLDER / GC_LOCK_NAME)
+        with self._run_lock:
+            if not lock.acquire():
+                logger.debug("Another process is collecting images, skipping this run")
+                return None
+            try:
+                with GC_RUN_DURATION.time():
+                    result = self._collect()
+            finally:
+                lock.release()
+
+        GC_LAST_RUN_TIMESTAMP.set(time.time())
+        self.last_run = result
+        if result["evicted"]:
+            logger.info(f"Image collector evicted {result['evicted']} images, "
+                        f"reclaiming {result['reclaimed_bytes']} bytes in {result['duration']:.3f}s")
+        return result
+
+    def _collect(self) -> Dict:
+        started = time.perf_counter()
+        remove_stale_partials(Config.UPLOAD_FOLDER)
+
+        catalog = store.catalog()
+        excess_count = max(0, catalog.unpinned_count() - self.keep)
+        totals = catalog.totals()
+        excess_bytes = max(0, totals["total_size"] + totals["renditions_size"] - self.quota) if self.quota else 0
+        missing_free = max(0, self.min_free - self._free_bytes()) if self.min_free else 0
+
+        evicted, reclaimed, failed = 0, 0, 0
+        while excess_count > 0 or excess_bytes > 0 or missing_free > 0:
+            # Failed deletes stay in the catalog, step past them
+            candidates = catalog.least_recently_used(self.batch_size, offset=failed)
+            if not candidates:
+                break
+
+            batch, reasons = [], {}
+            for row in candidates:
+                if excess_count <= 0 and excess_bytes <= 0 and missing_free <= 0:
+                    break
+                reason = 'count' if excess_count > 0 else 'quota' if excess_bytes > 0 else 'free_space'
+                image = Config.UPLOAD_FOLDER / row["filename"]
+                size = row["size"] + row["renditions_size"]
+                batch.append(image)
+                reasons[image] = (reason, size)
+                excess_count -= 1
+                excess_bytes -= size
+                missing_free -= size
+
+            removed = set(store.remove_many(batch))
+            for image in batch:
+                reason, size = reasons[image]
+                if image in removed:
+                    GC_EVICTED_IMAGES_TOTAL.labels(reason=reason).inc()
+                    evicted += 1
+                    reclaimed += size
+                else:
+                    # Still there, so it still counts against the limits
+                    failed += 1
+                    excess_count += 1
+                    excess_bytes += size
+                    missing_free += size
+
+        GC_RECLAIMED_BYTES_TOTAL.inc(reclaimed)
+        return {
+            "evicted": evicted,
+            "reclaimed_bytes": reclaimed,
+            "failed": failed,
+            "duration": time.perf_counter() - started,
+            "finished_at": time.time()
+        }
+
+    def _free_bytes(self) -> int:
+        folder = Config.UPLOAD_FOLDER
+        return shutil.disk_usage(folder if folder.exists() else folder.parent).free
+
+    def shutdown(self):
+        """Stop the collector thread"""
+        self._stopped = True
+        self._wake.set()
+        if self.worker_thread and self.worker_thread.is_alive() and self.worker_thread is not threading.current_thread():
+            self.worker_thread.join(timeout=5)
+        GarbageCollector._instances.discard(self)
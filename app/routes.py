@@ -1,21 +1,35 @@
 # app/routes.py
 import logging
-from flask import Blueprint, jsonify, request, Response, current_app
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from flask import Blueprint, jsonify, request, Response, current_app, send_file, url_for
+from prometheus_client import CONTENT_TYPE_LATEST
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.imaging import FIT_MODES
+from app.jobs import JobStatus
+from app.metrics import generate_metrics, observe_stage
+from app.status import parse_fields
+from app.timing import StageTimer
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('main', __name__)
 
+MAX_IMAGES_PAGE_SIZE = 500
+THUMBNAIL_RETRY_AFTER = 1  # Seconds, for thumbnails still being made
+
 @bp.route('/metrics')
 def metrics():
     """Prometheus metrics endpoint"""
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_metrics(current_app.metrics), mimetype=CONTENT_TYPE_LATEST)
 
 @bp.route('/status', methods=['GET'])
 def get_status():
-    """Get system and display status"""
+    """Get system and display status, optionally only some fields with ?fields=system.temperature,storage"""
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     try:
-        status = current_app.controller.get_status()
+        status = current_app.controller.get_status(fields)
         logger.info("Status request successful")
         return jsonify(status)
     except Exception as e:
@@ -25,31 +39,145 @@ def get_status():
 @bp.route('/display', methods=['POST'])
 def update_display():
     """Update the e-ink display with a new image"""
-    if 'image' not in request.files:
+    timer = StageTimer(observer=observe_stage)
+    try:
+        with timer.stage('receive'):
+            # The multipart body is parsed on first access, streaming each file to disk
+            files = request.files
+    except RequestEntityTooLarge:
+        logger.warning("Upload over MAX_CONTENT_LENGTH rejected")
+        return jsonify({"error": f"File too large. Maximum size: {current_app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+    if 'image' not in files:
         logger.warning("No image file provided in request")
         return jsonify({"error": "No image file provided"}), 400
         
-    image_file = request.files['image']
+    image_file = files['image']
     if image_file.filename == '':
         logger.warning("Empty filename provided")
         return jsonify({"error": "No selected file"}), 400
         
+    fit = _requested_fit()
+    if fit not in (None, *FIT_MODES):
+        return jsonify({"error": f"Unsupported fit mode '{fit}'. Supported: {list(FIT_MODES)}"}), 400
+        
     try:
-        success, error = current_app.controller.update_display(image_file)
-        if success:
-            logger.info(f"Display successfully updated with {image_file.filename}")
-            return jsonify({"message": "Display updated successfully"})
-        logger.error(f"Display update failed: {error}")
-        return jsonify({"error": error}), 500
+        job = current_app.controller.submit_display(image_file, fit=fit, timer=timer)
+        return _job_response(job, image_file.filename)
     except Exception as e:
         logger.error(f"Display update failed: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@bp.route('/display/<image_id>', methods=['POST'])
+def display_stored_image(image_id):
+    """Show a previously uploaded image without uploading it again"""
+    fit = _requested_fit()
+    if fit not in (None, *FIT_MODES):
+        return jsonify({"error": f"Unsupported fit mode '{fit}'. Supported: {list(FIT_MODES)}"}), 400
+    
+    try:
+        job = current_app.controller.display_image(image_id, fit=fit)
+        if job is None:
+            return jsonify({"error": f"Unknown image: {image_id}"}), 404
+        return _job_response(job, image_id)
+    except Exception as e:
+        logger.error(f"Display update failed: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+def _requested_fit():
+    """Fit mode from the form or query string, None to use the configured default"""
+    return request.form.get('fit') or request.args.get('fit') or None
+
+def _job_response(job, description: str):
+    """Respond 202 with the queued job, or wait for it with ?wait=true"""
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        # Legacy behaviour: hold the request until the refresh finishes
+        job.wait(timeout=current_app.config['DISPLAY_UPDATE_TIMEOUT'])
+        if job.status == JobStatus.DONE:
+            logger.info(f"Display successfully updated with {description}")
+            return jsonify({"message": "Display updated successfully", "job": job.to_dict()})
+        if job.status == JobStatus.SUPERSEDED:
+            logger.info(f"Display update with {description} superseded by job {job.superseded_by}")
+            return jsonify({"message": "Display update superseded by a newer image", "job": job.to_dict()})
+        error = job.error or f"Display update still {job.status} after {current_app.config['DISPLAY_UPDATE_TIMEOUT']}s"
+        logger.error(f"Display update failed: {error}")
+        return jsonify({"error": error, "job": job.to_dict()}), 500
+    
+    logger.info(f"Display update queued for {description} as job {job.id}")
+    response = jsonify({"message": "Display update queued", "job": job.to_dict()})
+    response.headers['Location'] = url_for('main.display_job', job_id=job.id)
+    return response, 202
+
+@bp.route('/display/jobs', methods=['GET'])
+def display_jobs():
+    """List recent display jobs"""
+    return jsonify({"jobs": current_app.controller.get_display_jobs()})
+
+@bp.route('/display/jobs/<job_id>', methods=['GET'])
+def display_job(job_id):
+    """Get the state and timings of a display job"""
+    job = current_app.controller.get_display_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown display job: {job_id}"}), 404
+    return jsonify(job)
+
+@bp.route('/images', methods=['GET'])
+def list_images():
+    """List stored images, newest first, a page at a time with ?limit= and ?offset="""
+    try:
+        limit = int(request.args.get('limit', current_app.config['IMAGES_PAGE_SIZE']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    if not 1 <= limit <= MAX_IMAGES_PAGE_SIZE or offset < 0:
+        return jsonify({"error": f"limit must be between 1 and {MAX_IMAGES_PAGE_SIZE}, offset >= 0"}), 400
+    
+    try:
+        return jsonify(current_app.controller.list_images(limit, offset))
+    except Exception as e:
+        logger.error(f"Failed to list images: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/images/<image_id>/thumbnail', methods=['GET'])
+def image_thumbnail(image_id):
+    """A JPEG thumbnail of a stored image, the smallest one at least ?size= pixels on its longer side"""
+    try:
+        size = int(request.args['size']) if 'size' in request.args else None
+    except ValueError:
+        return jsonify({"error": "size must be an integer"}), 400
+    if size is not None and size < 1:
+        return jsonify({"error": "size must be >= 1"}), 400
+    
+    try:
+        thumbnail, ready = current_app.controller.get_thumbnail(image_id, size)
+        if thumbnail is None:
+            return jsonify({"error": f"Unknown image: {image_id}"}), 404
+        if not ready:
+            return jsonify({"status": "pending"}), 202, {'Retry-After': str(THUMBNAIL_RETRY_AFTER)}
+        return send_file(thumbnail, mimetype='image/jpeg', max_age=86400)  # Content-addressed, never changes
+    except FileNotFoundError:
+        return jsonify({"error": f"Unknown image: {image_id}"}), 404  # Evicted meanwhile
+    except Exception as e:
+        logger.error(f"Failed to get thumbnail: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/images/<image_id>/pin', methods=['POST', 'DELETE'])
+def pin_image(image_id):
+    """Pin a stored image so it is never evicted (POST), or unpin it (DELETE)"""
+    pinned = request.method == 'POST'
+    try:
+        if not current_app.controller.pin_image(image_id, pinned):
+            return jsonify({"error": f"Unknown image: {image_id}"}), 404
+        logger.info(f"Image {image_id} {'pinned' if pinned else 'unpinned'}")
+        return jsonify({"id": image_id, "pinned": pinned})
+    except Exception as e:
+        logger.error(f"Failed to pin image: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @bp.route('/system/service/status')
 def service_status():
     """Get Gunicorn service status"""
     try:
-        status = current_app.controller.get_status()["system"]["service"]
+        status = current_app.controller.get_status(['system.service'])["system"]["service"]
         return jsonify(status)
     except Exception as e:
         logger.error(f"Failed to get service status: {e}")
@@ -89,7 +217,7 @@ def power_control(action):
 def system_temperature():
     """Get system temperature"""
     try:
-        temp = current_app.controller.get_status()["system"]["temperature"]
+        temp = current_app.controller.get_status(['system.temperature'])["system"]["temperature"]
         if temp is not None:
             return jsonify({"temperature": temp})
         return jsonify({"error": "Failed to read temperature"}), 500
@@ -0,0 +1,138 @@
+"""
+Startup cost: deferred imports and the startup profile.
+
+Gunicorn boots and worker respawns only need Flask and the routes. numpy,
+PIL, psutil and the panel driver are loaded the first time something uses
+them, through lazy_import() or imports inside the functions that need them.
+
+With STARTUP_PROFILE set to a file path, the app records how long every
+module took to import and how long it took to finish its first request,
+and writes it there as JSON. A {pid} in the path is replaced with the
+process id, so each gunicorn worker writes its own profile.
+"""
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def lazy_import(name: str):
+    """
+    The named module, executed on first attribute access instead of now.
+    Module-level annotations that use it must be strings, or they load it.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+class _ImportTimer:
+    """
+    Meta path finder that times each module's execution, including the
+    modules it imports, like python -X importtime's cumulative column.
+    It only wraps exec_module on the loader the real finder returned.
+    """
+
+    def __init__(self, profile: 'StartupProfile'):
+        self.profile = profile
+
+    def find_spec(self, name, path=None, target=None):
+        finders = sys.meta_path[sys.meta_path.index(self) + 1:] if self in sys.meta_path else []
+        for finder in finders:
+            find_spec = getattr(finder, 'find_spec', None)
+            spec = find_spec(name, path, target) if find_spec else None
+            if spec is not None:
+                break
+        else:
+            return None
+
+        loader = spec.loader
+        # Class-level loaders (builtins, frozen modules) are shared, and fast anyway
+        if loader is None or isinstance(loader, type) or 'exec_module' in vars(loader):
+            return spec
+        exec_module = loader.exec_module
+        profile = self.profile
+
+        def timed_exec_module(module):
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                del loader.exec_module
+                profile.record_import(name, time.perf_counter() - start)
+
+        loader.exec_module = timed_exec_module
+        return spec
+
+class StartupProfile:
+    """Import times and startup milestones of this process, in seconds since begin()"""
+
+    def __init__(self, path: str):
+        self.path = Path(path.replace('{pid}', str(os.getpid())))
+        self.started = time.perf_counter()
+        self.imports: List[Dict] = []
+        self.milestones: Dict[str, float] = {}
+        self.first_request: Optional[str] = None
+        self._timer = _ImportTimer(self)
+        self._lock = threading.Lock()
+        sys.meta_path.insert(0, self._timer)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def record_import(self, module: str, seconds: float):
+        self.imports.append({"module": module, "seconds": round(seconds, 6), "at": round(self.elapsed(), 6)})
+
+    def mark(self, milestone: str):
+        self.milestones[milestone] = round(self.elapsed(), 6)
+
+    def request_finished(self, path: str):
+        """Record the first request and write the profile, later requests are ignored"""
+        with self._lock:
+            if self.first_request is not None:
+                return
+            self.first_request = path
+            self.mark('first_request')
+        self.finish()
+
+    def finish(self):
+        if self._timer in sys.meta_path:
+            sys.meta_path.remove(self._timer)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+        logger.info(f"Startup profile: app created in {self.milestones.get('app_created')}s, "
+                    f"first request finished at {self.milestones.get('first_request')}s, written to {self.path}")
+
+    def to_dict(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "milestones": self.milestones,
+            "first_request_path": self.first_request,
+            "imports": sorted(self.imports, key=lambda entry: entry["seconds"], reverse=True)
+        }
+
+profile: Optional[StartupProfile] = None
+
+def begin() -> Optional[StartupProfile]:
+    """Start profiling if STARTUP_PROFILE is set, call before the imports to be timed"""
+    global profile
+    path = os.environ.get('STARTUP_PROFILE')
+    if path and profile is None:
+        profile = StartupProfile(path)
+    return profile
@@ -0,0 +1,101 @@
+"""
+Cached status probes.
+
+Every part of /status comes from its own probe, cached for that probe's
+TTL. A caller that only wants the temperature doesn't fork systemctl or
+scan the image folder, and the metrics collector reads the same cached
+values as the API.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Status fields in the order they appear in a full /status response
+FIELDS = (
+    'system.temperature',
+    'system.service',
+    'system.cpu',
+    'system.memory',
+    'system.disk',
+    'storage',
+    'display'
+)
+
+class StatusCache:
+    """
+    Values computed on demand and reused until they are older than a TTL.
+    Concurrent callers asking for the same stale key wait for one computation
+    instead of all probing at once.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, key: str, ttl: float) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry and self._clock() - entry[0] < ttl:
+            return True, entry[1]
+        return False, None
+
+    def get(self, key: str, compute: Callable[[], Any], ttl: float) -> Any:
+        """Cached value of key, calling compute if there is none younger than ttl seconds"""
+        if ttl <= 0:
+            return compute()
+
+        with self._lock:
+            fresh, value = self._fresh(key, ttl)
+            if fresh:
+                return value
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another caller may have refreshed it while we waited
+            with self._lock:
+                fresh, value = self._fresh(key, ttl)
+            if fresh:
+                return value
+            value = compute()
+            with self._lock:
+                self._entries[key] = (self._clock(), value)
+            return value
+
+    def invalidate(self, key: Optional[str] = None):
+        """Drop one cached value, or all of them"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Turn a ?fields= value like 'system.temperature,storage' into status fields.
+    A section name selects all of its fields, so 'system' is every system.* field.
+    Returns None for everything, raises ValueError for unknown fields.
+    """
+    if not fields:
+        return None
+
+    selected = []
+    for name in (part.strip() for part in fields.split(',')):
+        if not name or name == 'status':
+            continue
+        matches = [field for field in FIELDS if field == name or field.startswith(f"{name}.")]
+        if not matches:
+            raise ValueError(f"Unknown status field '{name}'. Supported: {list(FIELDS)}")
+        selected.extend(field for field in matches if field not in selected)
+    return selected
+
+def build_status(values: Iterable[Tuple[str, Any]]) -> Dict:
+    """Nest (field, value) pairs into the /status response shape"""
+    status: Dict[str, Any] = {"status": "online"}
+    for field, value in values:
+        section, _, name = field.partition('.')
+        if name:
+            status.setdefault(section, {})[name] = value
+        else:
+            status[section] = value
+    return status
@@ -0,0 +1,177 @@
+"""
+Content-addressed image store.
+
+Each image in UPLOAD_FOLDER is named after the SHA-256 of the bytes that
+were uploaded, <hash>.jpg or <hash>.png, next to a <hash>.json sidecar
+holding its original name, format, dimensions and size. The sidecar is
+written last, so an image is only known to the store once it is complete,
+and uploading the same picture again finds it without decoding anything.
+
+Every change is also recorded in the SQLite catalog in UPLOAD_FOLDER, which
+listings, storage totals and cleanup read instead of scanning the folder.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import Config
+from app import renditions
+from app.catalog import Catalog
+from app.uploads import atomic_path
+
+logger = logging.getLogger(__name__)
+
+METADATA_SUFFIX = '.json'
+CATALOG_NAME = '.catalog.db'  # Hidden and not an image format, so never taken for an image
+
+_catalogs: Dict[Tuple[Path, int], Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+_CONTENT_HASH = re.compile(r'[0-9a-f]{64}')
+
+def is_content_hash(value: str) -> bool:
+    return bool(value) and _CONTENT_HASH.fullmatch(value) is not None
+
+def image_path(content_hash: str, extension: str) -> Path:
+    """Where the image with this content hash and file extension is stored"""
+    return Config.UPLOAD_FOLDER / f"{content_hash}{extension.lower()}"
+
+def metadata_path(image: Path) -> Path:
+    """The sidecar of a stored image"""
+    return image.with_suffix(METADATA_SUFFIX)
+
+def read_metadata(image: Path) -> Optional[Dict]:
+    """A stored image's sidecar, None if it has none or it can't be read"""
+    try:
+        return json.loads(metadata_path(image).read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unreadable metadata for {image.name}: {e}")
+        return None
+
+def write_metadata(image: Path, content_hash: str, original_filename: str,
+                   image_format: str, size: tuple) -> Dict:
+    """Record a newly stored image, making it findable by lookup()"""
+    metadata = {
+        "content_hash": content_hash,
+        "filename": image.name,
+        "original_filename": original_filename,
+        "format": image_format,
+        "width": size[0],
+        "height": size[1],
+        "bytes": image.stat().st_size,
+        "stored_at": time.time()
+    }
+    with atomic_path(metadata_path(image)) as partial:
+        partial.write_text(json.dumps(metadata))
+    catalog().add(_catalog_row(image, metadata, image.stat()))
+    return metadata
+
+def lookup(content_hash: str) -> Optional[Path]:
+    """The stored image with this content hash, None if it isn't stored"""
+    if not is_content_hash(content_hash):
+        return None
+    metadata = read_metadata(Config.UPLOAD_FOLDER / f"{content_hash}{METADATA_SUFFIX}")
+    if metadata is None:
+        return None
+    image = Config.UPLOAD_FOLDER / metadata["filename"]
+    return image if image.is_file() else None
+
+def remove(image: Path):
+    """Delete a stored image, its sidecar and its renditions"""
+    image.unlink(missing_ok=True)
+    metadata_path(image).unlink(missing_ok=True)
+    renditions.remove(image.stem)
+    catalog().remove(image.stem)
+
+def remove_many(images: List[Path]) -> List[Path]:
+    """
+    Delete several stored images, their sidecars and renditions, forgetting
+    them in one catalog transaction. Returns the images that were deleted,
+    ones that could not be are left in place and in the catalog.
+    """
+    removed = []
+    for image in images:
+        # Plain os calls, a sweep can hold hundreds of images and pathlib's overhead adds up
+        path = os.fspath(image)
+        try:
+            for name in (path, os.path.splitext(path)[0] + METADATA_SUFFIX):
+                try:
+                    os.unlink(name)
+                except FileNotFoundError:
+                    pass
+            removed.append(image)
+        except OSError as e:
+            logger.error(f"Failed to delete {image}: {e}")
+    renditions.remove_many(image.stem for image in removed)
+    catalog().remove_many([image.stem for image in removed])
+    return removed
+
+def set_pinned(image_id: str, pinned: bool) -> bool:
+    """Pin or unpin a stored image, returns False if there is no such image"""
+    return catalog().set_pinned(image_id, pinned)
+
+def add_renditions_size(image_id: str, delta: int):
+    """Count bytes written under a stored image's renditions towards the storage quota"""
+    catalog().add_renditions_size(image_id, delta)
+
+def register(image: Path):
+    """Catalog an image that was put in UPLOAD_FOLDER without going through the store"""
+    catalog().add(_catalog_row(image, read_metadata(image), image.stat()))
+
+def touch(image: Path):
+    """Mark a stored image as recently used, raises FileNotFoundError if it is gone"""
+    now = time.time()
+    os.utime(image, (now, now))
+    catalog().touch(image.stem, now)
+
+def record_display(image: Path):
+    """Count a display of a stored image in the catalog, anything outside the store is ignored"""
+    if image.parent != Config.UPLOAD_FOLDER:
+        return
+    catalog().record_display(image.stem, time.time())
+
+def catalog() -> Catalog:
+    """
+    This process's connection to the catalog of UPLOAD_FOLDER, created on
+    first use from whatever images are already stored
+    """
+    path = Config.UPLOAD_FOLDER / CATALOG_NAME
+    key = (path, os.getpid())  # A connection must not be shared with a forked worker
+    with _catalogs_lock:
+        opened = _catalogs.get(key)
+        if opened is None or opened not in Catalog._instances or not path.exists():
+            if opened is not None:
+                opened.close()
+            opened = _catalogs[key] = Catalog(path, populate=_scan)
+        return opened
+
+def _scan() -> Iterator[Dict]:
+    """Catalog rows for the images in UPLOAD_FOLDER, including ones stored before sidecars"""
+    for image in Config.UPLOAD_FOLDER.iterdir():
+        if image.name.startswith('.') or image.suffix.lower() not in Config.SUPPORTED_FORMATS:
+            continue
+        try:
+            yield _catalog_row(image, read_metadata(image), image.stat())
+        except FileNotFoundError:
+            continue
+
+def _catalog_row(image: Path, metadata: Optional[Dict], stat: os.stat_result) -> Dict:
+    metadata = metadata or {}
+    return {
+        "id": image.stem,
+        "filename": image.name,
+        "original_filename": metadata.get("original_filename"),
+        "content_hash": metadata.get("content_hash"),
+        "format": metadata.get("format"),
+        "width": metadata.get("width"),
+        "height": metadata.get("height"),
+        "size": stat.st_size,
+        "modified": stat.st_mtime,
+        "renditions_size": renditions.disk_size(image.stem)
+    }
@@ -12,17 +12,36 @@ class TestConfig(Config):
     # Use temporary directories for testing
     UPLOAD_FOLDER = Path(tempfile.mkdtemp()) / 'test_images'
     LOG_FILE = Path(tempfile.mkdtemp()) / 'test.log'
+    # Outside UPLOAD_FOLDER.parent, so the palette LUT is built once per run rather than per app
+    LUT_FOLDER = Path(tempfile.mkdtemp()) / 'lut'
     # Test limits
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5MB max file size
     KEEP_IMAGES = 3
-    METRICS_INTERVAL = 10
+    # Run against the virtual panel, without the refresh wait
+    DISPLAY_DRIVER = 'virtual'
+    VIRTUAL_PANEL_SPI_SECONDS = 0
+    VIRTUAL_PANEL_REFRESH_SECONDS = 0
+    VIRTUAL_PANEL_FOLDER = UPLOAD_FOLDER.parent / 'virtual_panel'
+    DISPLAY_LOCK_FILE = UPLOAD_FOLDER.parent / 'display.lock'
+    DISPLAY_SOCKET = UPLOAD_FOLDER.parent / 'display.sock'
+
+@pytest.fixture(autouse=True)
+def isolated_upload_folder(monkeypatch):
+    """Storage helpers and Display read Config directly, keep every test out of the real instance folder"""
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', TestConfig.UPLOAD_FOLDER)
+    monkeypatch.setattr(Config, 'LUT_FOLDER', TestConfig.LUT_FOLDER)
+    yield TestConfig.UPLOAD_FOLDER
+    shutil.rmtree(TestConfig.UPLOAD_FOLDER, ignore_errors=True)
 
 @pytest.fixture
 def app():
     """Create and configure a new app instance for each test."""
     app = create_app(TestConfig)
     yield app
-    # Cleanup after tests
+    # Cleanup after tests, giving up the panel for the next app
+    app.display_owner.shutdown()
+    app.collector.shutdown()
+    app.renditions.shutdown()  # After the renditions already queued, before their folder goes
     shutil.rmtree(TestConfig.UPLOAD_FOLDER.parent, ignore_errors=True)
     shutil.rmtree(TestConfig.LOG_FILE.parent, ignore_errors=True)
 
@@ -0,0 +1,128 @@
+import sqlite3
+import time
+from app import catalog as catalog_module
+from app.catalog import Catalog
+
+def row(image_id, size, modified, **extra):
+    return {"id": image_id, "filename": f"{image_id}.jpg", "size": size, "modified": modified, **extra}
+
+def test_catalog_uses_wal(tmp_path):
+    """Test the catalog is opened in WAL mode so processes can read while one writes"""
+    catalog = Catalog(tmp_path / 'catalog.db')
+    try:
+        assert catalog._read('PRAGMA journal_mode')[0][0] == 'wal'
+    finally:
+        catalog.close()
+
+def test_totals_follow_adds_and_removes(tmp_path):
+    """Test image count and bytes are kept up to date without scanning the table"""
+    catalog = Catalog(tmp_path / 'catalog.db')
+    try:
+        catalog.add(row('a', 100, 1))
+        catalog.add(row('b', 250, 2))
+        assert catalog.totals() == {"image_count": 2, "total_size": 350, "renditions_size": 0}
+        
+        # Replacing an image counts it once, with its new size
+        catalog.add(row('a', 120, 3))
+        assert catalog.totals() == {"image_count": 2, "total_size": 370, "renditions_size": 0}
+        
+        assert catalog.remove('b')
+        assert not catalog.remove('b')
+        assert catalog.totals() == {"image_count": 1, "total_size": 120, "renditions_size": 0}
+    finally:
+        catalog.close()
+
+def test_renditions_size_totals(tmp_path):
+    """Test rendition bytes are totalled separately and leave with their image"""
+    catalog = Catalog(tmp_path / 'catalog.db')
+    try:
+        catalog.add(row('a', 100, 1, renditions_size=30))
+        catalog.add(row('b', 100, 2))
+        catalog.add_renditions_size('b', 20)
+        catalog.add(row('b', 100, 3))  # Kept when the image is stored again
+        assert catalog.totals()["renditions_size"] == 50
+        assert catalog.remove('a')
+        assert catalog.totals() == {"image_count": 1, "total_size": 100, "renditions_size": 20}
+    finally:
+        catalog.close()
+
+def test_migrates_older_catalog(tmp_path):
+    """Test a version 2 catalog gains rendition sizes with its totals intact"""
+    path = tmp_path / 'catalog.db'
+    connection = sqlite3.connect(str(path))
+    for statement in catalog_module._SCHEMA + catalog_module._MIGRATIONS[2]:
+        connection.execute(statement)
+    connection.execute('PRAGMA user_version = 2')
+    connection.execute("INSERT INTO images (id, filename, size, modified) VALUES ('old', 'old.jpg', 42, 1)")
+    connection.commit()
+    connection.close()
+    
+    catalog = Catalog(path)
+    try:
+        catalog.add_renditions_size('old', 8)
+        assert catalog.totals() == {"image_count": 1, "total_size": 42, "renditions_size": 8}
+        assert catalog.remove('old')
+        assert catalog.totals() == {"image_count": 0, "total_size": 0, "renditions_size": 0}
+    finally:
+        catalog.close()
+
+def test_page_is_newest_first(tmp_path):
+    """Test listing pages through images newest first"""
+    catalog = Catalog(tmp_path / 'catalog.db')
+    try:
+        for i in range(5):
+            catalog.add(row(f'image{i}', 10, i))
+        catalog.touch('image0', 10)
+        
+        assert [r["id"] for r in catalog.page(2)] == ['image0', 'image4']
+        assert [r["id"] for r in catalog.page(2, offset=2)] == ['image3', 'image2']
+        assert [r["id"] for r in catalog.beyond(3)] == ['image2', 'image1']
+    finally:
+        catalog.close()
+
+def test_display_history_survives_replacement(tmp_path):
+    """Test displays are counted and re-adding an image keeps its history"""
+    catalog = Catalog(tmp_path / 'catalog.db')
+    try:
+        catalog.add(row('a', 100, 1, width=800, height=480))
+        now = time.time()
+        catalog.record_display('a', now)
+        catalog.record_display('a', now)
+        catalog.add(row('a', 100, 2))
+        
+        entry = catalog.get('a')
+        assert entry["display_count"] == 2
+        assert entry["last_displayed"] == now
+        assert catalog.get('missing') is None
+    finally:
+        catalog.close()
+
+def test_populate_runs_once(tmp_path):
+    """Test existing images are only imported when the database is created"""
+    calls = []
+    
+    def populate():
+        calls.append(1)
+        return [row('old', 42, 1)]
+    
+    first = Catalog(tmp_path / 'catalog.db', populate=populate)
+    second = Catalog(tmp_path / 'catalog.db', populate=populate)
+    try:
+        assert len(calls) == 1
+        # Both connections see the same catalog
+        second.add(row('new', 8, 2))
+        assert first.totals() == {"image_count": 2, "total_size": 50, "renditions_size": 0}
+    finally:
+        first.close()
+        second.close()
+
+def test_close_all(tmp_path):
+    """Test close_all closes every open catalog"""
+    catalog = Catalog(tmp_path / 'catalog.db')
+    Catalog.close_all()
+    assert catalog not in Catalog._instances
+    try:
+        catalog.totals()
+        assert False, "catalog still open"
+    except sqlite3.ProgrammingError:
+        pass
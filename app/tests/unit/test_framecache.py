@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from unittest.mock import Mock, patch
+from PIL import Image
+from config import Config
+from app.framecache import FrameCache, frame_key, pack_4bpp, unpack_4bpp
+
+FRAME_BYTES = 8 * 6 // 2
+
+def make_frame(value: int) -> np.ndarray:
+    return np.full((6, 8), value, dtype=np.uint8)
+
+@pytest.mark.parametrize('shape', [(6, 8), (3, 5)])
+def test_pack_roundtrip(shape):
+    """Test 4bpp packing halves the size and is lossless"""
+    indices = np.random.default_rng(0).integers(0, 7, shape).astype(np.uint8)
+    data = pack_4bpp(indices)
+    assert len(data) == (indices.size + 1) // 2
+    assert (unpack_4bpp(data, shape) == indices).all()
+
+def test_frame_key():
+    """Test keys change with content, resolution and settings"""
+    key = frame_key("abc", (800, 480), ("ordered", 0.5, 5))
+    assert key == "abc:800x480:ordered:0.5:5"
+    assert key != frame_key("abc", (600, 448), ("ordered", 0.5, 5))
+    assert key != frame_key("abc", (800, 480), ("diffusion", 0.5, 5))
+
+def test_hit_and_miss():
+    """Test cached frames are returned and counted"""
+    cache = FrameCache(max_bytes=FRAME_BYTES * 4)
+    assert cache.get("a") is None
+    cache.put("a", make_frame(3))
+    assert (cache.get("a") == 3).all()
+    
+    info = cache.get_info()
+    assert info["hits"] == 1
+    assert info["misses"] == 1
+    assert info["frames"] == 1
+    assert info["bytes"] == FRAME_BYTES
+
+def test_lru_eviction_under_budget():
+    """Test the least recently used frame is evicted first"""
+    cache = FrameCache(max_bytes=FRAME_BYTES * 2)
+    cache.put("a", make_frame(1))
+    cache.put("b", make_frame(2))
+    cache.get("a")  # "b" is now least recently used
+    cache.put("c", make_frame(3))
+    
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    info = cache.get_info()
+    assert info["evictions"] == 1
+    assert info["bytes"] <= FRAME_BYTES * 2
+
+def test_discard_by_content_hash():
+    """Test all renditions of a source can be dropped"""
+    cache = FrameCache(max_bytes=FRAME_BYTES * 4)
+    cache.put(frame_key("abc", (8, 6), ("ordered",)), make_frame(1))
+    cache.put(frame_key("abc", (8, 6), ("diffusion",)), make_frame(2))
+    cache.put(frame_key("def", (8, 6), ("ordered",)), make_frame(3))
+    cache.discard("abc")
+    assert cache.get_info()["frames"] == 1
+
+def test_display_reuses_rendered_frame(tmp_path, monkeypatch):
+    """Test redisplaying an image skips decode and quantization"""
+    inky = Mock()
+    inky.resolution = (80, 48)
+    inky.colour = 'multi'
+    inky.SATURATED_PALETTE = inky.DESATURATED_PALETTE = [[0, 0, 0], [255, 255, 255], [255, 0, 0]]
+    monkeypatch.setattr(Config, 'DISPLAY_LUT_BITS', 0)
+    
+    image_path = tmp_path / "test.png"
+    Image.new('RGB', (160, 96), (200, 30, 30)).save(image_path)
+    
+    from app.hardware.display import Display
+    display = Display(panel=inky)
+    
+    assert display.update(str(image_path))
+    with patch.object(display.quantizer, 'quantize') as mock_quantize:
+        assert display.update(str(image_path))
+        mock_quantize.assert_not_called()
+    
+    info = display.get_info()["render_cache"]
+    assert info["hits"] == 1
+    assert info["misses"] == 1
+    assert inky.show.call_count == 2
+    frame = inky.set_image.call_args[0][0]
+    assert frame.mode == 'P'
+    assert (np.array(frame) == 2).all()
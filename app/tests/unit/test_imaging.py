@@ -0,0 +1,80 @@
+import io
+import pytest
+from PIL import Image
+from app.imaging import FIT_MODES, ImageTooLargeError, decode, decode_size, fit_geometry, fit_image
+
+def encoded(size, format='JPEG'):
+    """An opened, not yet decoded, image of the given size"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (10, 200, 30)).save(buffer, format=format)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+def test_decode_full_size_without_target():
+    """Test images are decoded as-is when nothing limits them"""
+    assert decode(encoded((1200, 900))).size == (1200, 900)
+
+@pytest.mark.parametrize('size', [(4000, 3000), (3000, 4000), (6000, 2000)])
+def test_jpeg_decoded_at_reduced_scale(size):
+    """Test JPEGs decode at the smallest scale still covering the target"""
+    img = decode(encoded(size), (800, 480))
+    assert img.size[0] >= 800 and img.size[1] >= 480
+    assert img.size[0] * img.size[1] < size[0] * size[1] / 3
+
+def test_png_reduced_after_decode():
+    """Test formats without DCT scaling are reduced by an integer factor"""
+    img = decode(encoded((1700, 1000), 'PNG'), (800, 480))
+    assert img.size == (850, 500)
+
+def test_pixel_budget_downscales_jpeg():
+    """Test an over-budget JPEG is decoded at a scale that fits the budget"""
+    img = decode(encoded((3000, 2000)), max_pixels=2_000_000)
+    assert img.size == (1500, 1000)
+
+def test_pixel_budget_rejects_png():
+    """Test an over-budget PNG is rejected before decoding"""
+    with pytest.raises(ImageTooLargeError) as exc_info:
+        decode(encoded((3000, 2000), 'PNG'), max_pixels=2_000_000)
+    assert "Image too large" in str(exc_info.value)
+
+@pytest.mark.parametrize('fit', FIT_MODES)
+@pytest.mark.parametrize('size', [(4000, 3000), (6000, 1000), (300, 200)])
+def test_fit_image_fills_panel(fit, size):
+    """Test every fit mode produces a panel-sized RGB image"""
+    img = fit_image(encoded(size), (800, 480), fit)
+    assert img.size == (800, 480)
+    assert img.mode == 'RGB'
+
+def test_cover_crops_without_distortion():
+    """Test cover scales uniformly and crops the overflow evenly"""
+    box, out, offset = fit_geometry((6000, 1000), (800, 480), 'cover')
+    assert out == (800, 480)
+    assert offset == (0, 0)
+    assert box[1] == 0 and box[3] == 1000
+    assert (box[2] - box[0]) / (box[3] - box[1]) == pytest.approx(800 / 480)
+    assert box[0] == pytest.approx(6000 - box[2])
+
+def test_contain_letterboxes():
+    """Test contain fits the whole image and centres it on a white background"""
+    img = fit_image(encoded((6000, 1000)), (800, 480), 'contain')
+    assert img.getpixel((400, 5)) == (255, 255, 255)
+    assert img.getpixel((400, 240))[1] > 150
+
+def test_center_crop_uses_native_pixels():
+    """Test center-crop takes the middle of the image without scaling"""
+    box, out, offset = fit_geometry((4000, 3000), (800, 480), 'center-crop')
+    assert box == (1600, 1260, 2400, 1740)
+    assert out == (800, 480)
+    assert decode_size((4000, 3000), (800, 480), 'center-crop') == (4000, 3000)
+
+def test_decode_size_follows_crop():
+    """Test the decode scale is planned from the region that will be shown"""
+    # A panorama cropped to the panel aspect needs more width than the panel
+    assert decode_size((6000, 1000), (800, 480), 'cover') == (2880, 480)
+    assert decode_size((6000, 1000), (800, 480), 'stretch') == (800, 480)
+    assert decode_size((400, 300), (800, 480), 'contain') == (400, 300)
+
+def test_unknown_fit_mode():
+    """Test an unknown fit mode is rejected"""
+    with pytest.raises(ValueError):
+        fit_geometry((100, 100), (800, 480), 'zoom')
@@ -0,0 +1,177 @@
+import threading
+import pytest
+from unittest.mock import Mock
+from app.jobs import DisplayQueue, JobStatus
+
+@pytest.fixture
+def display():
+    display = Mock()
+    display.update.return_value = True
+    return display
+
+@pytest.fixture
+def queue(display):
+    display_queue = DisplayQueue(display, history=5)
+    yield display_queue
+    display_queue.shutdown()
+
+def test_job_runs_to_completion(queue, display):
+    """Test a submitted job is run by the worker"""
+    job = queue.submit('/tmp/test.jpg')
+    assert job.wait(timeout=5)
+    assert job.status == JobStatus.DONE
+    assert job.error is None
+    display.update.assert_called_once()
+    assert display.update.call_args[0][0] == '/tmp/test.jpg'
+
+def test_job_failure_is_recorded(queue, display):
+    """Test a failed display update marks the job as failed"""
+    display.update.return_value = False
+    job = queue.submit('/tmp/test.jpg')
+    assert job.wait(timeout=5)
+    assert job.status == JobStatus.FAILED
+    assert job.error == "Display update failed"
+
+def test_job_exception_is_recorded(queue, display):
+    """Test an exception in the display is captured on the job"""
+    display.update.side_effect = RuntimeError("SPI error")
+    job = queue.submit('/tmp/test.jpg')
+    assert job.wait(timeout=5)
+    assert job.status == JobStatus.FAILED
+    assert "SPI error" in job.error
+
+def test_job_stages_and_timings(queue, display):
+    """Test stage callbacks from the display are reflected in the job"""
+    def update(path, on_stage=None, **kwargs):
+        on_stage(JobStatus.REFRESHING)
+        return True
+    display.update.side_effect = update
+    
+    job = queue.submit('/tmp/test.jpg')
+    assert job.wait(timeout=5)
+    assert JobStatus.RENDERING in job.transitions
+    assert JobStatus.REFRESHING in job.transitions
+    timings = job.to_dict()["timings"]
+    for stage in ("queued", "rendering", "refreshing", "total"):
+        assert timings[stage] is not None
+
+def test_jobs_run_in_order(display):
+    """Test jobs are processed one at a time in submission order"""
+    release = threading.Event()
+    display.update.side_effect = lambda path, on_stage=None, **kwargs: release.wait(5)
+    
+    display_queue = DisplayQueue(display, coalesce=False)
+    try:
+        first = display_queue.submit('/tmp/first.jpg')
+        second = display_queue.submit('/tmp/second.jpg')
+        assert second.status == JobStatus.QUEUED
+        
+        release.set()
+        assert second.wait(timeout=5)
+        assert first.finished_at <= second.started_at
+    finally:
+        display_queue.shutdown()
+
+def test_history_is_bounded(queue):
+    """Test only the most recent jobs are kept"""
+    jobs = []
+    for i in range(8):
+        job = queue.submit(f'/tmp/{i}.jpg')
+        job.wait(timeout=5)
+        jobs.append(job)
+    
+    recent = queue.recent()
+    assert len(recent) == 5
+    assert recent[0].id == jobs[-1].id
+    assert queue.get(jobs[0].id) is None
+
+def test_coalescing_supersedes_pending_jobs(display):
+    """Test a newer job replaces jobs that have not started yet"""
+    release = threading.Event()
+    started = threading.Event()
+    def update(path, on_stage=None, **kwargs):
+        started.set()
+        return release.wait(5)
+    display.update.side_effect = update
+    
+    display_queue = DisplayQueue(display, coalesce=True)
+    try:
+        running = display_queue.submit('/tmp/running.jpg')
+        assert started.wait(5)
+        pending = display_queue.submit('/tmp/pending.jpg')
+        latest = display_queue.submit('/tmp/latest.jpg')
+        
+        # The superseded job finishes immediately without touching the display
+        assert pending.wait(timeout=0)
+        assert pending.status == JobStatus.SUPERSEDED
+        assert pending.superseded_by == latest.id
+        
+        release.set()
+        assert latest.wait(timeout=5)
+        assert running.status == JobStatus.DONE
+        assert latest.status == JobStatus.DONE
+        shown = [call[0][0] for call in display.update.call_args_list]
+        assert shown == ['/tmp/running.jpg', '/tmp/latest.jpg']
+    finally:
+        display_queue.shutdown()
+
+def test_no_coalescing_runs_every_job(display):
+    """Test every job is shown when coalescing is disabled"""
+    display_queue = DisplayQueue(display, coalesce=False)
+    try:
+        jobs = [display_queue.submit(f'/tmp/{i}.jpg') for i in range(3)]
+        for job in jobs:
+            assert job.wait(timeout=5)
+            assert job.status == JobStatus.DONE
+        assert display.update.call_count == 3
+    finally:
+        display_queue.shutdown()
+
+def test_decoded_image_is_handed_over_and_released(queue, display):
+    """Test the ingested image reaches the display and isn't kept in history"""
+    image = object()
+    job = queue.submit('/tmp/test.jpg', image=image, content_hash='abc')
+    assert job.wait(timeout=5)
+    kwargs = display.update.call_args[1]
+    assert kwargs['image'] is image
+    assert kwargs['content_hash'] == 'abc'
+    assert job.image is None
+
+def test_only_shown_images_count_as_displayed(display):
+    """Test superseded and failed jobs leave an image's display history alone"""
+    from config import Config
+    from app import store
+    images = {}
+    for name in ('running', 'pending', 'latest', 'failing'):
+        images[name] = Config.UPLOAD_FOLDER / f'{name}.jpg'
+        images[name].parent.mkdir(parents=True, exist_ok=True)
+        images[name].write_bytes(b'x')
+        store.write_metadata(images[name], name, images[name].name, 'JPEG', (1, 1))
+    
+    release = threading.Event()
+    started = threading.Event()
+    def update(path, on_stage=None, **kwargs):
+        started.set()
+        release.wait(5)
+        return not path.endswith('failing.jpg')
+    display.update.side_effect = update
+    
+    display_queue = DisplayQueue(display, coalesce=True)
+    try:
+        display_queue.submit(images['running'])
+        assert started.wait(5)
+        pending = display_queue.submit(images['pending'])
+        latest = display_queue.submit(images['latest'])
+        assert pending.status == JobStatus.SUPERSEDED
+        release.set()
+        assert latest.wait(timeout=5)
+        assert display_queue.submit(images['failing']).wait(timeout=5)
+    finally:
+        display_queue.shutdown()
+    
+    history = {name: store.catalog().get(name) for name in images}
+    assert history['running']["display_count"] == 1
+    assert history['latest']["last_displayed"] is not None
+    for name in ('pending', 'failing'):
+        assert history[name]["display_count"] == 0
+        assert history[name]["last_displayed"] is None
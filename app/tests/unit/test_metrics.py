@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+ROOT = Path(__file__).resolve().parents[3]
+
+def run_worker(metrics_dir: Path, code: str) -> str:
+    """Run code in a fresh process sharing metrics_dir, like a gunicorn worker"""
+    env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(metrics_dir), 'PYTHONPATH': str(ROOT)}
+    result = subprocess.run([sys.executable, '-c', code], env=env, cwd=ROOT,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_multiprocess_metrics_are_merged(tmp_path):
+    """Test counters add up across workers and live gauges merge by their mode"""
+    for _ in range(2):
+        run_worker(tmp_path, (
+            "from app.metrics import DISPLAY_UPDATES_TOTAL, DISPLAY_QUEUE_DEPTH\n"
+            "DISPLAY_UPDATES_TOTAL.labels(status='success').inc()\n"
+            "DISPLAY_QUEUE_DEPTH.set(2)\n"
+        ))
+    
+    output = run_worker(tmp_path, (
+        "from app.metrics import generate_metrics\n"
+        "print(generate_metrics().decode())\n"
+    ))
+    assert 'mirage_display_updates_total{status="success"} 2.0' in output
+    # livesum gauges still count the exited processes until they are marked dead
+    assert 'mirage_display_queue_depth 4.0' in output
+
+def test_child_exit_forgets_live_gauges(tmp_path, monkeypatch):
+    """Test the gunicorn hook removes a dead worker's live gauge files"""
+    (tmp_path / 'gauge_livesum_1234.db').write_bytes(b'')
+    (tmp_path / 'counter_1234.db').write_bytes(b'')
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    
+    namespace = {'__file__': str(ROOT / 'gunicorn.conf.py')}
+    exec((ROOT / 'gunicorn.conf.py').read_text(), namespace)
+    namespace['child_exit'](Mock(), SimpleNamespace(pid=1234))
+    
+    assert not (tmp_path / 'gauge_livesum_1234.db').exists()
+    assert (tmp_path / 'counter_1234.db').exists()
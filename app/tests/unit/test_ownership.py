@@ -0,0 +1,138 @@
+import io
+import os
+import pytest
+from unittest.mock import Mock
+from app.jobs import JobStatus
+from app.ownership import DisplayOwner, RemoteJob, SharedDisplay, SharedDisplayQueue
+from app.protocol import HEADER, MAX_FRAME, read_frame, write_frame
+from app.timing import StageTimer
+
+def mock_display():
+    display = Mock()
+    display.update.return_value = True
+    display.resolution = (800, 480)
+    display.get_info.return_value = {"resolution": (800, 480), "driver": "VirtualPanel"}
+    return display
+
+@pytest.fixture
+def owners(tmp_path):
+    """Two would-be owners of the same panel, standing in for two workers"""
+    created = []
+    def create(display):
+        owner = DisplayOwner(create_display=lambda: display, lock_file=tmp_path / 'display.lock',
+                             socket_path=tmp_path / 'display.sock')
+        created.append(owner)
+        return owner
+    yield create
+    for owner in created:
+        owner.shutdown()
+
+def test_only_one_process_owns_the_display(owners):
+    """Test the second worker doesn't open the panel and hands its jobs to the owner"""
+    first_display, second_display = mock_display(), mock_display()
+    first, second = owners(first_display), owners(second_display)
+    assert first.owner and not second.owner
+    
+    queue = SharedDisplayQueue(second)
+    timer = StageTimer()
+    timer.started -= 1  # As if the upload took a second
+    timer.record('receive', 0.25)
+    job = queue.submit('/tmp/remote.jpg', content_hash='abc', fit='contain', timer=timer)
+    assert isinstance(job, RemoteJob)
+    assert job.wait(timeout=5)
+    assert job.status == JobStatus.DONE
+    
+    first_display.update.assert_called_once()
+    second_display.update.assert_not_called()
+    assert first_display.update.call_args.kwargs['content_hash'] == 'abc'
+    # The stages timed in the requesting worker carry over to the owner's job
+    stages = job.to_dict()['stages']
+    assert stages['receive'] == 0.25
+    assert stages['total'] >= 1
+    
+    assert queue.get(job.id).status == JobStatus.DONE
+    assert queue.get('does-not-exist') is None
+    assert [j.id for j in queue.recent()] == [job.id]
+    
+    display = SharedDisplay(second)
+    assert display.resolution == (800, 480)
+    assert display.get_info()['owner_pid'] == os.getpid()
+
+def test_worker_takes_over_when_owner_exits(owners):
+    """Test a remaining worker takes the panel when the owner goes away"""
+    first_display, second_display = mock_display(), mock_display()
+    first, second = owners(first_display), owners(second_display)
+    first.shutdown()
+    
+    job = SharedDisplayQueue(second).submit('/tmp/takeover.jpg')
+    assert job.wait(timeout=5)
+    assert second.owner
+    second_display.update.assert_called_once()
+
+def test_owner_reports_errors(owners):
+    """Test errors in the owner are raised in the requesting worker"""
+    first, second = owners(mock_display()), owners(mock_display())
+    with pytest.raises(RuntimeError, match='Unknown display request'):
+        second.call({'op': 'explode'})
+
+def test_progress_is_streamed(owners):
+    """Test a worker following a job sees each status change, ending with the result"""
+    display = mock_display()
+    def update(image_path, on_stage=None, **kwargs):
+        on_stage(JobStatus.REFRESHING)
+        return True
+    display.update.side_effect = update
+    first, second = owners(display), owners(mock_display())
+    
+    events = []
+    job = second.call({'op': 'submit', 'path': '/tmp/progress.jpg', 'timeout': 5},
+                      on_progress=lambda state: events.append(state['status']))
+    assert job['status'] == JobStatus.DONE
+    assert events[-2:] == [JobStatus.REFRESHING, JobStatus.DONE]
+    assert 'total' in job['stages']
+
+def test_daemon_mode_never_claims_the_panel(tmp_path):
+    """Test web workers in daemon mode leave the panel alone and fail fast without a daemon"""
+    create_display = Mock()
+    owner = DisplayOwner(create_display=create_display, lock_file=tmp_path / 'display.lock',
+                         socket_path=tmp_path / 'display.sock', claim=False)
+    try:
+        with pytest.raises(RuntimeError, match='not running'):
+            SharedDisplayQueue(owner).submit('/tmp/nobody.jpg')
+        assert not owner.owner
+        create_display.assert_not_called()
+    finally:
+        owner.shutdown()
+
+def test_displayd_show(owners, tmp_path, capsys):
+    """Test the displayd client shows an image through the running owner"""
+    import displayd
+    display = mock_display()
+    owners(display)
+    
+    class DaemonConfig:
+        DISPLAY_LOCK_FILE = tmp_path / 'display.lock'
+        DISPLAY_SOCKET = tmp_path / 'display.sock'
+        DISPLAY_JOB_HISTORY = 5
+        DISPLAY_COALESCE = True
+        DISPLAY_UPDATE_TIMEOUT = 5
+    
+    assert displayd.show(str(tmp_path / 'photo.jpg'), fit='contain', config=DaemonConfig) == 0
+    output = capsys.readouterr().out
+    assert JobStatus.DONE in output.splitlines()
+    assert display.update.call_args[0][0] == str(tmp_path / 'photo.jpg')
+
+def test_frames_round_trip():
+    """Test messages survive framing, and truncated or oversized frames are rejected"""
+    stream = io.BytesIO()
+    write_frame(stream, {'op': 'submit', 'path': '/tmp/ü.jpg'})
+    write_frame(stream, {'op': 'jobs'})
+    stream.seek(0)
+    assert read_frame(stream) == {'op': 'submit', 'path': '/tmp/ü.jpg'}
+    assert read_frame(stream) == {'op': 'jobs'}
+    assert read_frame(stream) is None
+    
+    with pytest.raises(ValueError):
+        read_frame(io.BytesIO(HEADER.pack(10) + b'{}'))
+    with pytest.raises(ValueError):
+        read_frame(io.BytesIO(HEADER.pack(MAX_FRAME + 1)))
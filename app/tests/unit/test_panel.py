@@ -0,0 +1,68 @@
+import time
+import numpy as np
+import pytest
+from PIL import Image
+from config import Config
+from app.hardware.display import Display
+from app.hardware.panel import VirtualPanel, create_panel
+
+def test_virtual_panel_writes_frames(tmp_path):
+    """Test each show() leaves a PNG of the frame and old frames are pruned"""
+    panel = VirtualPanel(resolution=(40, 24), output_dir=tmp_path, keep_frames=2)
+    for colour in [(0, 0, 0), (255, 255, 255), (255, 0, 0)]:
+        panel.set_image(Image.new('RGB', (40, 24), colour))
+        panel.show()
+    
+    assert panel.frames_shown == 3
+    assert sorted(p.name for p in tmp_path.glob('frame-*.png')) == ['frame-000002.png', 'frame-000003.png']
+    with Image.open(tmp_path / 'latest.png') as latest:
+        assert latest.size == (40, 24)
+        assert latest.getpixel((0, 0)) == panel.render().getpixel((0, 0))
+
+def test_virtual_panel_accepts_palette_images():
+    """Test 'P' images are taken as palette indices, like the inky driver"""
+    panel = VirtualPanel(resolution=(8, 6))
+    frame = Image.frombytes('P', (8, 6), bytes([4] * 48))
+    panel.set_image(frame)
+    assert (panel.buf == 4).all()
+
+def test_virtual_panel_rejects_wrong_size():
+    """Test images must match the panel resolution"""
+    panel = VirtualPanel(resolution=(8, 6))
+    with pytest.raises(ValueError):
+        panel.set_image(Image.new('RGB', (6, 8)))
+
+def test_virtual_panel_simulates_latency():
+    """Test show() takes the configured SPI transfer and refresh time"""
+    panel = VirtualPanel(resolution=(8, 6), spi_seconds=0.05, refresh_seconds=0.1)
+    panel.set_image(Image.new('RGB', (8, 6)))
+    start = time.monotonic()
+    panel.show()
+    assert time.monotonic() - start >= 0.15
+
+def test_create_panel_selects_driver(tmp_path, monkeypatch):
+    """Test the driver comes from config"""
+    monkeypatch.setattr(Config, 'DISPLAY_DRIVER', 'virtual')
+    monkeypatch.setattr(Config, 'VIRTUAL_PANEL_RESOLUTION', (80, 48))
+    monkeypatch.setattr(Config, 'VIRTUAL_PANEL_FOLDER', tmp_path)
+    assert isinstance(create_panel(Config), VirtualPanel)
+    
+    monkeypatch.setattr(Config, 'DISPLAY_DRIVER', 'epaper')
+    with pytest.raises(ValueError):
+        create_panel(Config)
+
+def test_display_on_virtual_panel(tmp_path, monkeypatch):
+    """Test the full display pipeline runs against the virtual panel"""
+    monkeypatch.setattr(Config, 'DISPLAY_LUT_BITS', 0)
+    panel = VirtualPanel(resolution=(80, 48), output_dir=tmp_path / 'frames')
+    display = Display(panel=panel)
+    
+    image_path = tmp_path / "test.png"
+    Image.new('RGB', (160, 96), (255, 0, 0)).save(image_path)
+    
+    assert display.update(str(image_path))
+    assert display.get_info()["driver"] == "VirtualPanel"
+    assert panel.frames_shown == 1
+    # Solid red maps to the red palette entry
+    assert (panel.buf == 4).all()
+    assert (tmp_path / 'frames' / 'latest.png').exists()
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from PIL import Image
+from unittest.mock import Mock
+from app.quantize import ALGORITHMS, PaletteLUT, Quantizer, create_quantizer, panel_palette
+from app.hardware.panel import VirtualPanel
+
+PALETTE = [
+    [0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255],
+    [255, 0, 0], [255, 255, 0], [255, 140, 0]
+]
+
+@pytest.fixture
+def gradient():
+    """A 64x40 RGB gradient"""
+    y, x = np.mgrid[0:40, 0:64]
+    rgb = np.stack([x * 4, y * 6, (x + y) * 2], axis=-1)
+    return Image.fromarray(rgb.astype(np.uint8))
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_quantize_shape_and_range(algorithm, gradient):
+    """Test every algorithm returns one valid palette index per pixel"""
+    indices = Quantizer(PALETTE, algorithm).quantize(gradient)
+    assert indices.shape == (40, 64)
+    assert indices.dtype == np.uint8
+    assert indices.max() < len(PALETTE)
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_quantize_solid_palette_colour(algorithm):
+    """Test a solid palette colour maps to itself without dither noise"""
+    image = Image.new('RGB', (37, 19), (0, 0, 255))
+    indices = Quantizer(PALETTE, algorithm).quantize(image)
+    assert (indices == 3).all()
+
+def test_nearest_matches_brute_force(gradient):
+    """Test the vectorized search agrees with a per-pixel distance search"""
+    quantizer = Quantizer(PALETTE, 'nearest')
+    rgb = np.asarray(gradient, dtype=np.int64)
+    palette = np.array(PALETTE, dtype=np.int64)
+    expected = ((rgb[:, :, None, :] - palette) ** 2).sum(axis=-1).argmin(axis=-1)
+    assert (quantizer.quantize(gradient) == expected).all()
+
+def test_diffusion_preserves_average_colour():
+    """Test error diffusion reproduces a non-palette colour on average"""
+    image = Image.new('RGB', (64, 64), (128, 128, 128))
+    for algorithm in ('diffusion', 'diffusion-block'):
+        indices = Quantizer(PALETTE, algorithm).quantize(image)
+        average = np.array(PALETTE)[indices].mean(axis=(0, 1))
+        assert np.allclose(average, 128, atol=20)
+
+def test_to_image_is_palette_image(gradient):
+    """Test indices are wrapped in a 'P' image with the same values"""
+    quantizer = Quantizer(PALETTE, 'ordered')
+    indices = quantizer.quantize(gradient)
+    image = quantizer.to_image(indices)
+    assert image.mode == 'P'
+    assert image.size == gradient.size
+    assert (np.array(image) == indices).all()
+
+def test_unknown_algorithm():
+    """Test an unknown algorithm is rejected"""
+    with pytest.raises(ValueError):
+        Quantizer(PALETTE, 'sepia')
+
+def test_create_quantizer():
+    """Test quantizers are only created for multi-colour panels"""
+    inky = Mock(spec=['resolution', 'colour'], colour='multi')
+    quantizer = create_quantizer(inky, 'diffusion', 0.5)
+    assert quantizer.algorithm == 'diffusion'
+    assert len(quantizer.palette) == 7
+    
+    assert create_quantizer(inky, 'none') is None
+    assert create_quantizer(Mock(spec=['resolution', 'colour'], colour='red'), 'ordered') is None
+    assert panel_palette(Mock(spec=['resolution'])) is None
+
+def test_panel_palette_blends_like_the_driver():
+    """Test the palette matches the driver's blend, and a panel's own palette is preferred"""
+    panel = VirtualPanel(resolution=(8, 8))
+    for saturation in (0.0, 0.5, 1.0):
+        expected = np.array(panel._palette_blend(saturation)[:21]).reshape(-1, 3)
+        assert (panel_palette(panel, saturation) == expected).all()
+    
+    inky = Mock(spec=['colour', 'SATURATED_PALETTE', 'DESATURATED_PALETTE'], colour='multi',
+                SATURATED_PALETTE=PALETTE + [[255, 255, 255]], DESATURATED_PALETTE=PALETTE + [[255, 255, 255]])
+    assert panel_palette(inky).tolist() == PALETTE
+
+def test_lut_matches_palette_colours():
+    """Test palette colours look up to their own index"""
+    lut = PaletteLUT(PaletteLUT.build(np.array(PALETTE, dtype=np.uint8), 5), 5)
+    indices = lut.lookup(np.array(PALETTE, dtype=np.uint8))
+    assert list(indices) == list(range(len(PALETTE)))
+
+def test_lut_is_persisted_and_memory_mapped(tmp_path):
+    """Test the LUT is saved once and memory-mapped on the next load"""
+    palette = np.array(PALETTE, dtype=np.uint8)
+    first = PaletteLUT.load_or_build(palette, 4, tmp_path)
+    saved = list(tmp_path.glob('*.npy'))
+    assert len(saved) == 1
+    
+    second = PaletteLUT.load_or_build(palette, 4, tmp_path)
+    assert isinstance(second.table, np.memmap)
+    assert second.table.shape == (16, 16, 16)
+    assert (np.asarray(first.table) == np.asarray(second.table)).all()
+    
+    # A different palette gets its own table
+    PaletteLUT.load_or_build(palette[::-1].copy(), 4, tmp_path)
+    assert len(list(tmp_path.glob('*.npy'))) == 2
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_quantize_with_lut(algorithm, gradient):
+    """Test LUT-backed quantization closely follows the exact search"""
+    lut = PaletteLUT(PaletteLUT.build(np.array(PALETTE, dtype=np.uint8), 6), 6)
+    exact = Quantizer(PALETTE, 'nearest').quantize(gradient)
+    indices = Quantizer(PALETTE, algorithm, lut=lut).quantize(gradient)
+    assert indices.shape == exact.shape
+    if algorithm == 'nearest':
+        assert (indices == exact).mean() > 0.95
+
+def test_create_quantizer_with_lut(tmp_path):
+    """Test create_quantizer builds and caches a LUT when asked"""
+    inky = Mock(spec=['resolution', 'colour'], colour='multi')
+    quantizer = create_quantizer(inky, 'nearest', 0.5, lut_bits=5, lut_dir=tmp_path)
+    assert quantizer.lut is not None
+    assert quantizer.lut.bits == 5
+    assert len(list(tmp_path.glob('*.npy'))) == 1
@@ -0,0 +1,152 @@
+import threading
+import numpy as np
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from config import Config
+from app import renditions, store
+from app.hardware.panel import VirtualPanel
+from app.renditions import RenditionWorker
+
+RESOLUTION = (80, 48)
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', tmp_path)
+    monkeypatch.setattr(Config, 'THUMBNAIL_SIZES', [64, 32, 16])
+    return tmp_path
+
+def stored_image(name='image', size=(320, 200), color=(255, 0, 0)):
+    image = Config.UPLOAD_FOLDER / f'{name}.png'
+    Image.new('RGB', size, color).save(image)
+    store.write_metadata(image, name, image.name, 'PNG', size)
+    return image
+
+def test_generate_panel_and_thumbnails(upload_folder):
+    """Test the panel rendition is fitted and each thumbnail fits its size"""
+    image = stored_image()
+    written = renditions.generate(image, RESOLUTION, 'cover')
+    assert len(written) == 4
+
+    with Image.open(renditions.panel_path('image', RESOLUTION, 'cover')) as panel:
+        assert panel.size == RESOLUTION
+    for size in (64, 32, 16):
+        with Image.open(renditions.thumbnail_path('image', size)) as thumbnail:
+            assert thumbnail.format == 'JPEG'
+            assert max(thumbnail.size) == size
+    # Charged to the image for the storage quota
+    assert store.catalog().get('image')["renditions_size"] == renditions.disk_size('image') > 0
+
+    # Everything is there, nothing is decoded again
+    with patch.object(Image, 'open') as mock_open:
+        assert renditions.generate(image, RESOLUTION, 'cover') == []
+        mock_open.assert_not_called()
+
+def test_generate_from_decoded_image(upload_folder):
+    """Test renditions are made from the pixels ingest decoded, without reopening the original"""
+    image = stored_image()
+    with Image.open(image) as decoded:
+        decoded.load()
+        with patch.object(Image, 'open') as mock_open:
+            renditions.generate(image, RESOLUTION, 'contain', image=decoded)
+            mock_open.assert_not_called()
+    assert renditions.panel_path('image', RESOLUTION, 'contain').exists()
+
+def test_thumbnails_not_made_from_a_smaller_decode(upload_folder):
+    """Test a decode made for a small panel isn't upscaled into the larger thumbnails"""
+    image = stored_image()
+    panel_scale = Image.new('RGB', (40, 25), (255, 0, 0))
+    renditions.generate(image, (40, 24), 'contain', image=panel_scale)
+    with Image.open(renditions.panel_path('image', (40, 24), 'contain')) as panel:
+        assert panel.size == (40, 24)
+    with Image.open(renditions.thumbnail_path('image', 64)) as thumbnail:
+        assert thumbnail.size == (64, 40)
+
+def test_only_stored_images_have_renditions(upload_folder, tmp_path_factory):
+    """Test files outside the upload folder are left alone"""
+    elsewhere = tmp_path_factory.mktemp('elsewhere') / 'image.png'
+    Image.new('RGB', (10, 10)).save(elsewhere)
+    assert renditions.image_id(elsewhere) is None
+    assert renditions.generate(elsewhere, RESOLUTION) == []
+    assert renditions.load_frame(elsewhere, RESOLUTION, ('cover',)) is None
+
+def test_thumbnail_size():
+    """Test requests get the smallest thumbnail that is big enough"""
+    sizes = [512, 128, 256]
+    assert renditions.thumbnail_size(None, sizes) == 128
+    assert renditions.thumbnail_size(100, sizes) == 128
+    assert renditions.thumbnail_size(200, sizes) == 256
+    assert renditions.thumbnail_size(4000, sizes) == 512
+
+def test_frame_roundtrip(upload_folder):
+    """Test quantized frames are stored per settings and truncated ones ignored"""
+    image = stored_image()
+    indices = np.random.default_rng(0).integers(0, 7, (RESOLUTION[1], RESOLUTION[0]), dtype=np.uint8)
+    renditions.save_frame(image, RESOLUTION, ('cover', 'ordered'), indices)
+    assert (renditions.load_frame(image, RESOLUTION, ('cover', 'ordered')) == indices).all()
+    assert renditions.load_frame(image, RESOLUTION, ('cover', 'diffusion')) is None
+    renditions.save_frame(image, RESOLUTION, ('cover', 'ordered'), indices)  # Replacing it charges nothing more
+    assert store.catalog().get('image')["renditions_size"] == RESOLUTION[0] * RESOLUTION[1] // 2
+
+    path = renditions.frame_path('image', RESOLUTION, ('cover', 'ordered'))
+    path.write_bytes(path.read_bytes()[:10])
+    assert renditions.load_frame(image, RESOLUTION, ('cover', 'ordered')) is None
+
+def test_removed_with_image(upload_folder):
+    """Test deleting a stored image deletes its renditions"""
+    first, second = stored_image('first'), stored_image('second')
+    renditions.generate(first, RESOLUTION)
+    renditions.generate(second, RESOLUTION)
+    store.remove(first)
+    store.remove_many([second])
+    assert not (upload_folder / renditions.RENDITIONS_DIR / 'first').exists()
+    assert not (upload_folder / renditions.RENDITIONS_DIR / 'second').exists()
+
+def test_worker(upload_folder):
+    """Test the worker makes renditions in the background and survives a missing image"""
+    worker = RenditionWorker()
+    try:
+        worker.submit(upload_folder / 'missing.png', RESOLUTION)
+        worker.submit(stored_image(), RESOLUTION, 'cover')
+        worker.join()
+        assert renditions.panel_path('image', RESOLUTION, 'cover').exists()
+        assert renditions.thumbnail_path('image', 16).exists()
+    finally:
+        worker.shutdown()
+    assert not worker.worker_thread.is_alive()
+
+def test_worker_queues_an_image_once(upload_folder):
+    """Test submitting an image that is still queued doesn't queue another pass"""
+    release = threading.Event()
+    worker = RenditionWorker()
+    try:
+        with patch.object(renditions, 'generate', side_effect=lambda *args: release.wait(5)) as mock_generate:
+            worker.submit(upload_folder / 'busy.png', RESOLUTION)
+            for _ in range(3):
+                worker.submit(upload_folder / 'image.png', RESOLUTION)
+            release.set()
+            worker.join()
+        assert mock_generate.call_count == 2
+    finally:
+        worker.shutdown()
+
+def test_display_uses_renditions(upload_folder, monkeypatch):
+    """Test the display quantizes a stored image once, then loads the frame rendition"""
+    monkeypatch.setattr(Config, 'DISPLAY_LUT_BITS', 0)
+    monkeypatch.setattr(Config, 'RENDER_CACHE_BYTES', 0)  # Every display goes to disk
+    from app.hardware.display import Display
+    display = Display(panel=VirtualPanel(resolution=RESOLUTION))
+    image = stored_image()
+    renditions.generate(image, RESOLUTION, 'cover')
+
+    # First display fits the panel rendition, not the original
+    opened = []
+    real_open = Image.open
+    with patch.object(Image, 'open', side_effect=lambda path, *args: opened.append(path) or real_open(path, *args)):
+        assert display.update(str(image), fit='cover')
+    assert opened == [renditions.panel_path('image', RESOLUTION, 'cover')]
+
+    with patch.object(display.quantizer, 'quantize') as mock_quantize:
+        assert display.update(str(image), fit='cover')
+        mock_quantize.assert_not_called()
+    assert (display.inky.buf == 4).all()  # Solid red
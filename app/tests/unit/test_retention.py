@@ -0,0 +1,169 @@
+import threading
+import time
+import pytest
+from unittest.mock import Mock
+from prometheus_client import REGISTRY
+from config import Config
+from app import renditions, store
+from app.jobs import DisplayQueue, JobStatus
+from app.ownership import DisplayLock
+from app.retention import GC_LOCK_NAME, GarbageCollector
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', tmp_path)
+    return tmp_path
+
+def stored(name: str, size: int, modified: float):
+    """Put an image of size bytes in the store, last used at modified"""
+    image = Config.UPLOAD_FOLDER / f'{name}.jpg'
+    image.write_bytes(b'x' * size)
+    store.write_metadata(image, name, image.name, 'JPEG', (1, 1))
+    store.catalog().touch(name, modified)
+    return image
+
+def remaining():
+    return sorted(row["id"] for row in store.catalog().page(-1))
+
+def collector(**limits):
+    settings = {'keep': 100, 'quota': 0, 'min_free': 0, **limits}
+    return GarbageCollector(start=False, **settings)
+
+def test_keeps_newest_images(upload_folder):
+    """Test the count limit evicts the least recently used images"""
+    for i in range(4):
+        stored(f'image{i}', 100, i)
+    result = collector(keep=2).run()
+    assert result["evicted"] == 2
+    assert result["reclaimed_bytes"] == 200
+    assert remaining() == ['image2', 'image3']
+    assert not (upload_folder / 'image0.jpg').exists()
+    assert not (upload_folder / 'image0.json').exists()
+
+def test_quota_evicts_least_recently_displayed(upload_folder):
+    """Test the byte quota evicts by last display, not by age"""
+    for i in range(4):
+        stored(f'image{i}', 100, i)
+    store.catalog().record_display('image0', 10)
+    collector(quota=250).run()
+    assert remaining() == ['image0', 'image3']
+    assert store.catalog().totals() == {"image_count": 2, "total_size": 200, "renditions_size": 0}
+
+def test_quota_counts_renditions(upload_folder):
+    """Test rendition bytes count against the quota and are reclaimed with their image"""
+    for i in range(3):
+        stored(f'image{i}', 100, i)
+    rendition = renditions.rendition_dir('image0') / 'thumb-128.jpg'
+    rendition.parent.mkdir(parents=True)
+    rendition.write_bytes(b'x' * 150)
+    store.add_renditions_size('image0', 150)
+    
+    result = collector(quota=300).run()
+    assert result["reclaimed_bytes"] == 250
+    assert remaining() == ['image1', 'image2']
+    assert not rendition.parent.exists()
+    assert store.catalog().totals()["renditions_size"] == 0
+
+def test_superseded_uploads_are_not_recently_used(upload_folder):
+    """Test an image replaced before the panel showed it is evicted before images that were shown"""
+    for i in range(3):
+        stored(f'image{i}', 100, i)
+    release, started = threading.Event(), threading.Event()
+    display = Mock()
+    display.update.side_effect = lambda path, **kwargs: started.set() or release.wait(5)
+    display_queue = DisplayQueue(display, coalesce=True)
+    try:
+        display_queue.submit(upload_folder / 'image0.jpg')
+        assert started.wait(5)
+        superseded = display_queue.submit(upload_folder / 'image1.jpg')
+        latest = display_queue.submit(upload_folder / 'image2.jpg')
+        release.set()
+        assert latest.wait(timeout=5)
+    finally:
+        display_queue.shutdown()
+    
+    assert superseded.status == JobStatus.SUPERSEDED
+    assert store.catalog().get('image1')["last_displayed"] is None
+    collector(keep=2).run()
+    assert remaining() == ['image0', 'image2']
+
+def test_pinned_images_are_never_evicted(upload_folder):
+    """Test pinned images are exempt from every limit"""
+    for i in range(3):
+        stored(f'image{i}', 100, i)
+    assert store.set_pinned('image0', True)
+    assert not store.set_pinned('missing', True)
+    collector(keep=1, quota=1).run()
+    assert remaining() == ['image0']
+
+def test_free_space_floor(upload_folder, monkeypatch):
+    """Test images are evicted until the disk has MIN_FREE_BYTES free"""
+    for i in range(4):
+        stored(f'image{i}', 100, i)
+    gc = collector(min_free=1000)
+    monkeypatch.setattr(gc, '_free_bytes', lambda: 850)
+    gc.run()
+    assert remaining() == ['image2', 'image3']
+
+def test_deletes_in_batches(upload_folder, monkeypatch):
+    """Test evictions are removed from the catalog a batch at a time"""
+    for i in range(5):
+        stored(f'image{i}', 10, i)
+    batches = []
+    remove_many = store.remove_many
+    monkeypatch.setattr(store, 'remove_many', lambda images: batches.append(len(images)) or remove_many(images))
+    collector(keep=0, quota=1, batch_size=2).run()
+    assert batches == [2, 2, 1]
+    assert remaining() == []
+
+def test_failed_deletes_still_count(upload_folder, monkeypatch):
+    """Test an image that can't be deleted is stepped over and the next one evicted instead"""
+    for i in range(3):
+        stored(f'image{i}', 100, i)
+    remove_many = store.remove_many
+    monkeypatch.setattr(store, 'remove_many',
+                        lambda images: remove_many([image for image in images if image.stem != 'image0']))
+    result = collector(keep=2).run()
+    assert result["failed"] == 1
+    assert remaining() == ['image0', 'image2']
+
+def test_reports_metrics(upload_folder):
+    """Test reclaimed bytes and run duration reach the metrics"""
+    def sample(name, labels=None):
+        return REGISTRY.get_sample_value(name, labels or {}) or 0
+    
+    reclaimed, runs, evicted = (sample('mirage_gc_reclaimed_bytes_total'),
+                                sample('mirage_gc_run_duration_seconds_count'),
+                                sample('mirage_gc_evicted_images_total', {'reason': 'count'}))
+    for i in range(3):
+        stored(f'image{i}', 100, i)
+    collector(keep=1).run()
+    assert sample('mirage_gc_reclaimed_bytes_total') == reclaimed + 200
+    assert sample('mirage_gc_run_duration_seconds_count') == runs + 1
+    assert sample('mirage_gc_evicted_images_total', {'reason': 'count'}) == evicted + 2
+
+def test_one_collector_at_a_time(upload_folder):
+    """Test a run is skipped while another process holds the collector lock"""
+    stored('image0', 100, 0)
+    lock = DisplayLock(upload_folder / GC_LOCK_NAME)
+    assert lock.acquire()
+    try:
+        assert collector(keep=0, quota=1).run() is None
+    finally:
+        lock.release()
+    assert remaining() == ['image0']
+
+def test_trigger_runs_in_background(upload_folder):
+    """Test a trigger runs the collector on its own thread without waiting for the interval"""
+    for i in range(3):
+        stored(f'image{i}', 100, i)
+    gc = GarbageCollector(keep=1, quota=0, min_free=0, interval=60)
+    try:
+        gc.trigger()
+        deadline = time.time() + 5
+        while gc.last_run is None and time.time() < deadline:
+            time.sleep(0.01)
+        assert gc.last_run["evicted"] == 2
+    finally:
+        gc.shutdown()
+    assert not gc.worker_thread.is_alive()
@@ -1,7 +1,11 @@
+import hashlib
+import io
 import pytest
+from PIL import Image
 from flask import url_for
 import json
 from werkzeug.datastructures import FileStorage
+from app import renditions
 
 def test_metrics_endpoint(client):
     """Test the Prometheus metrics endpoint"""
@@ -36,6 +40,23 @@ def test_status_endpoint(client):
     assert 'memory' in system
     assert 'disk' in system
 
+def test_status_fields(client):
+    """Test /status can be limited to some fields"""
+    response = client.get('/status?fields=system.memory,storage')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert set(data) == {'status', 'system', 'storage'}
+    assert set(data['system']) == {'memory'}
+    
+    response = client.get('/status?fields=system')
+    assert set(json.loads(response.data)['system']) == {'temperature', 'service', 'cpu', 'memory', 'disk'}
+
+def test_status_unknown_field(client):
+    """Test unknown status fields are rejected"""
+    response = client.get('/status?fields=system.gpu')
+    assert response.status_code == 400
+    assert 'error' in json.loads(response.data)
+
 def test_display_endpoint_no_file(client):
     """Test display endpoint with no file"""
     response = client.post('/display')
@@ -67,16 +88,63 @@ def test_display_endpoint_invalid_file(client, corrupt_image):
     assert 'Invalid or corrupted image file' in data['error']
 
 def test_display_endpoint_success(client, test_image):
-    """Test successful display update"""
+    """Test display update is queued and reported as a job"""
     data = {
         'image': (test_image, 'test.png')
     }
     response = client.post('/display', data=data)
+    assert response.status_code == 202
+    data = json.loads(response.data)
+    assert 'Display update queued' in data['message']
+    job = data['job']
+    assert job['status'] in ('queued', 'rendering', 'refreshing', 'done', 'failed')
+    assert response.headers['Location'].endswith(f"/display/jobs/{job['id']}")
+
+def test_display_endpoint_wait(client, test_image):
+    """Test waiting for the display update to finish"""
+    data = {
+        'image': (test_image, 'test.png')
+    }
+    response = client.post('/display?wait=true', data=data)
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert 'message' in data
     assert 'Display updated successfully' in data['message']
 
+def test_display_stage_timings(client, test_image):
+    """Test a display job reports where its time went, and the stages reach /metrics"""
+    response = client.post('/display?wait=true', data={'image': (test_image, 'test.png')})
+    stages = json.loads(response.data)['job']['stages']
+    for name in ['receive', 'validate', 'decode', 'save', 'resize', 'quantize', 'set_image', 'refresh', 'total']:
+        assert stages[name] >= 0
+    assert stages['total'] >= stages['refresh']
+    
+    metrics = client.get('/metrics').data.decode()
+    assert 'mirage_display_refresh_duration_seconds_count' in metrics
+    assert 'mirage_display_request_to_panel_duration_seconds_bucket' in metrics
+
+def test_display_jobs_endpoints(client, test_image):
+    """Test listing and fetching display jobs"""
+    response = client.post('/display', data={'image': (test_image, 'test.png')})
+    job_id = json.loads(response.data)['job']['id']
+    
+    response = client.get(f'/display/jobs/{job_id}')
+    assert response.status_code == 200
+    job = json.loads(response.data)
+    assert job['id'] == job_id
+    assert 'timings' in job
+    
+    response = client.get('/display/jobs')
+    assert response.status_code == 200
+    jobs = json.loads(response.data)['jobs']
+    assert job_id in [j['id'] for j in jobs]
+
+def test_display_job_not_found(client):
+    """Test fetching an unknown display job"""
+    response = client.get('/display/jobs/does-not-exist')
+    assert response.status_code == 404
+    data = json.loads(response.data)
+    assert 'error' in data
+
 def test_system_service_status(client, monkeypatch):
     """Test service status endpoint"""
     # Mock the service status to return a known state
@@ -155,4 +223,127 @@ def test_system_temperature(client):
     assert "temperature" in data
     # Temperature should be a reasonable value for a Raspberry Pi
     assert isinstance(data["temperature"], (int, float))
-    assert 0 <= data["temperature"] <= 100  # Reasonable range in Celsius 
\ No newline at end of file
+    assert 0 <= data["temperature"] <= 100  # Reasonable range in Celsius 
+def test_list_images(client, test_image):
+    """Test stored images are listed with ids"""
+    content_hash = hashlib.sha256(test_image.getvalue()).hexdigest()
+    client.post('/display', data={'image': (test_image, 'listed.jpg')})
+    response = client.get('/images')
+    assert response.status_code == 200
+    images = json.loads(response.data)['images']
+    assert images
+    newest = images[0]
+    assert newest['original_filename'] == 'listed.jpg'
+    assert newest['id'] == newest['filename'].rsplit('.', 1)[0]
+    assert newest['id'] == content_hash
+    assert newest['size'] > 0
+
+def test_list_images_pages(client):
+    """Test the image listing is paginated and reports the total"""
+    for color in range(3):
+        client.post('/display', data={'image': (png_upload((color * 100, 0, 0)), f'page{color}.png')})
+    
+    data = json.loads(client.get('/images?limit=2').data)
+    assert data['total'] == 3
+    assert [image['original_filename'] for image in data['images']] == ['page2.png', 'page1.png']
+    data = json.loads(client.get('/images?limit=2&offset=2').data)
+    assert [image['original_filename'] for image in data['images']] == ['page0.png']
+    assert data['images'][0]['width'] == 20
+    
+    assert client.get('/images?limit=0').status_code == 400
+    assert client.get('/images?offset=x').status_code == 400
+
+def png_upload(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (20, 10), color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
+def test_pin_image(client):
+    """Test pinned images are listed as such and kept by the collector"""
+    client.post('/display', data={'image': (png_upload((1, 2, 3)), 'favourite.png')})
+    image_id = json.loads(client.get('/images').data)['images'][0]['id']
+    
+    response = client.post(f'/images/{image_id}/pin')
+    assert response.status_code == 200
+    assert json.loads(response.data) == {"id": image_id, "pinned": True}
+    assert json.loads(client.get('/images').data)['images'][0]['pinned'] is True
+    
+    # More uploads than KEEP_IMAGES, the favourite stays
+    for color in range(4):
+        client.post('/display', data={'image': (png_upload((color * 60, 0, 0)), f'other{color}.png')})
+    client.application.collector.run()
+    images = json.loads(client.get('/images').data)['images']
+    assert image_id in [image['id'] for image in images]
+    assert len(images) == client.application.config['KEEP_IMAGES'] + 1
+    
+    assert client.delete(f'/images/{image_id}/pin').status_code == 200
+    assert client.post('/images/missing/pin').status_code == 404
+
+def test_image_thumbnail(client):
+    """Test thumbnails are made after upload and served by size"""
+    client.post('/display?wait=true', data={'image': (png_upload((1, 2, 3)), 'thumb.png')})
+    client.application.renditions.join()
+    image_id = json.loads(client.get('/images').data)['images'][0]['id']
+    
+    response = client.get(f'/images/{image_id}/thumbnail?size=200')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    with Image.open(io.BytesIO(response.data)) as thumbnail:
+        assert thumbnail.size == (20, 10)  # Never upscaled
+    response.close()
+    
+    assert client.get(f'/images/{image_id}/thumbnail?size=big').status_code == 400
+    assert client.get('/images/missing/thumbnail').status_code == 404
+    
+    # A missing thumbnail is queued, not made while the request waits
+    renditions.remove(image_id)
+    response = client.get(f'/images/{image_id}/thumbnail')
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == '1'
+    client.application.renditions.join()
+    assert client.get(f'/images/{image_id}/thumbnail').status_code == 200
+
+def test_display_duplicate_upload(client, test_image):
+    """Test uploading a stored image again skips decoding and saving it"""
+    data = test_image.getvalue()
+    first = json.loads(client.post('/display?wait=true', data={'image': (io.BytesIO(data), 'first.jpg')}).data)
+    second = json.loads(client.post('/display?wait=true', data={'image': (io.BytesIO(data), 'again.jpg')}).data)
+    assert second['job']['status'] == 'done'
+    assert second['job']['image'] == first['job']['image']
+    assert 'save' in first['job']['stages']
+    assert 'decode' not in second['job']['stages'] and 'save' not in second['job']['stages']
+    assert len(json.loads(client.get('/images').data)['images']) == 1
+
+def test_display_stored_image(client, test_image):
+    """Test showing a stored image by id without uploading it again"""
+    client.post('/display?wait=true', data={'image': (test_image, 'stored.jpg')})
+    image_id = json.loads(client.get('/images').data)['images'][0]['id']
+    
+    response = client.post(f'/display/{image_id}?wait=true')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'Display updated successfully' in data['message']
+    assert data['job']['image'].startswith(image_id)
+
+@pytest.mark.parametrize('image_id', ['does-not-exist', '.hidden'])
+def test_display_stored_image_not_found(client, image_id):
+    """Test unknown or unsafe image ids are rejected"""
+    response = client.post(f'/display/{image_id}')
+    assert response.status_code == 404
+    data = json.loads(response.data)
+    assert 'error' in data
+
+def test_display_endpoint_fit_mode(client, test_image):
+    """Test the fit mode can be chosen per request"""
+    data = {'image': (test_image, 'test.jpg'), 'fit': 'contain'}
+    response = client.post('/display', data=data)
+    assert response.status_code == 202
+    assert json.loads(response.data)['job']['fit'] == 'contain'
+
+def test_display_endpoint_invalid_fit_mode(client, test_image):
+    """Test an unknown fit mode is rejected"""
+    data = {'image': (test_image, 'test.jpg'), 'fit': 'zoom'}
+    response = client.post('/display', data=data)
+    assert response.status_code == 400
+    assert 'Unsupported fit mode' in json.loads(response.data)['error']
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from config import Config
+from app.startup import lazy_import
+
+ROOT = Path(__file__).resolve().parents[3]
+
+# Loaded when the panel or the system probes are first used, never by startup itself
+DEFERRED_MODULES = ['numpy', 'PIL.Image', 'psutil', 'inky', 'inky.auto', 'app.hardware.display', 'app.quantize']
+
+COLD_START = '''
+import sys
+from pathlib import Path
+from config import Config
+work_dir = Path(sys.argv[1])
+Config.UPLOAD_FOLDER = work_dir / 'images'
+Config.LUT_FOLDER = work_dir / 'lut'
+Config.LOG_FILE = work_dir / 'mirage.log'
+Config.DISPLAY_DRIVER = 'virtual'
+Config.DISPLAY_LOCK_FILE = work_dir / 'display.lock'
+Config.DISPLAY_SOCKET = work_dir / 'display.sock'
+from app import create_app
+create_app(Config).test_client().get('/status?fields=storage')
+'''
+
+def test_cold_start_budget(tmp_path):
+    """Test a fresh process serves its first request within COLD_START_BUDGET, without loading hardware modules"""
+    profile_path = tmp_path / 'startup.json'
+    env = {**os.environ, 'STARTUP_PROFILE': str(profile_path), 'PYTHONPATH': str(ROOT)}
+    result = subprocess.run([sys.executable, '-c', COLD_START, str(tmp_path)], env=env, cwd=ROOT,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    
+    profile = json.loads(profile_path.read_text())
+    assert profile['first_request_path'] == '/status'
+    assert profile['milestones']['app_created'] <= profile['milestones']['first_request']
+    assert profile['milestones']['first_request'] <= Config.COLD_START_BUDGET, (
+        f"Cold start took {profile['milestones']['first_request']}s, budget is {Config.COLD_START_BUDGET}s. "
+        f"Slowest imports: {profile['imports'][:10]}"
+    )
+    
+    imported = {entry['module'] for entry in profile['imports']}
+    assert 'flask' in imported
+    assert not imported & set(DEFERRED_MODULES)
+
+def test_lazy_import_loads_on_first_use():
+    """Test a lazily imported module only runs when an attribute is used"""
+    sys.modules.pop('colorsys', None)
+    colorsys = lazy_import('colorsys')
+    assert sys.modules['colorsys'] is colorsys
+    assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert lazy_import('colorsys') is colorsys
@@ -0,0 +1,63 @@
+import pytest
+from app.status import FIELDS, StatusCache, build_status, parse_fields
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+def test_cache_reuses_values_within_ttl():
+    """Test values are recomputed only once they are older than the TTL"""
+    clock = FakeClock()
+    cache = StatusCache(clock=clock)
+    calls = []
+    compute = lambda: calls.append(clock.now) or len(calls)
+    
+    assert cache.get('storage', compute, ttl=10) == 1
+    clock.now = 9.9
+    assert cache.get('storage', compute, ttl=10) == 1
+    clock.now = 10.0
+    assert cache.get('storage', compute, ttl=10) == 2
+    
+    cache.invalidate('storage')
+    assert cache.get('storage', compute, ttl=10) == 3
+
+def test_cache_zero_ttl_always_computes():
+    """Test a TTL of 0 disables caching"""
+    cache = StatusCache()
+    calls = []
+    for _ in range(3):
+        cache.get('display', lambda: calls.append(1), ttl=0)
+    assert len(calls) == 3
+
+def test_parse_fields():
+    """Test field selections, including whole sections"""
+    assert parse_fields(None) is None
+    assert parse_fields('system.temperature,storage') == ['system.temperature', 'storage']
+    assert parse_fields('system') == [field for field in FIELDS if field.startswith('system.')]
+    assert parse_fields('status,display,display') == ['display']
+    with pytest.raises(ValueError):
+        parse_fields('system.gpu')
+
+def test_build_status():
+    """Test fields are nested into the /status shape"""
+    assert build_status([('system.temperature', 45.0), ('storage', {"image_count": 1})]) == {
+        "status": "online",
+        "system": {"temperature": 45.0},
+        "storage": {"image_count": 1}
+    }
+
+def test_status_ttls_setting(monkeypatch):
+    """Test malformed STATUS_TTLS entries are ignored with a warning and unknown fields rejected"""
+    from config import Config, _parse_ttls
+    ttls, malformed = _parse_ttls('storage=5, system.cpu = 1.5,storage,display=abc,=3,')
+    assert ttls == {'storage': 5.0, 'system.cpu': 1.5}
+    assert malformed == ['storage', 'display=abc', '=3']
+
+    monkeypatch.setattr(Config, '_MALFORMED_STATUS_TTLS', malformed)
+    monkeypatch.setattr(Config, 'STATUS_TTLS', {**ttls, 'system.fan': 1.0})
+    errors = Config.validate()
+    assert "WARNING: Ignoring STATUS_TTLS entry 'display=abc', expected field=seconds" in errors
+    assert [error for error in errors if 'system.fan' in error and not error.startswith('WARNING')]
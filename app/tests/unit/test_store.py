@@ -0,0 +1,45 @@
+import pytest
+from config import Config
+from app import store
+
+HASH = 'ab' * 32
+
+@pytest.fixture
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', tmp_path)
+    return tmp_path
+
+def test_lookup_needs_metadata(upload_folder):
+    """Test an image is only found once its sidecar has been written"""
+    image = store.image_path(HASH, '.JPG')
+    assert image == upload_folder / f'{HASH}.jpg'
+    image.write_bytes(b'jpeg bytes')
+    assert store.lookup(HASH) is None
+    
+    metadata = store.write_metadata(image, HASH, 'holiday.jpg', 'JPEG', (800, 600))
+    assert metadata["bytes"] == len(b'jpeg bytes')
+    assert store.lookup(HASH) == image
+    assert store.read_metadata(image)["original_filename"] == 'holiday.jpg'
+
+def test_lookup_ignores_missing_image(upload_folder):
+    """Test a sidecar left without its image is not a hit"""
+    image = store.image_path(HASH, '.png')
+    image.write_bytes(b'png bytes')
+    store.write_metadata(image, HASH, 'a.png', 'PNG', (1, 1))
+    image.unlink()
+    assert store.lookup(HASH) is None
+
+def test_lookup_rejects_non_hashes(upload_folder):
+    """Test only content hashes are looked up, nothing can escape the upload folder"""
+    assert store.lookup('../config') is None
+    assert store.lookup('') is None
+    assert not store.is_content_hash(HASH.upper())
+
+def test_remove_deletes_sidecar(upload_folder):
+    """Test removing an image also removes its metadata"""
+    image = store.image_path(HASH, '.png')
+    image.write_bytes(b'png bytes')
+    store.write_metadata(image, HASH, 'a.png', 'PNG', (1, 1))
+    store.remove(image)
+    assert list(upload_folder.glob('[!.]*')) == []
+    assert store.catalog().get(HASH) is None
@@ -1,8 +1,10 @@
 import pytest
 from unittest.mock import Mock, patch
 from pathlib import Path
+from app.hardware.service import ServiceProbe
 from app.hardware.system import SystemHardware
 from app.controller import Controller
+from config import Config
 
 @pytest.fixture
 def mock_display():
@@ -26,6 +28,14 @@ def mock_system():
         "state": "active (running)",
         "details": "Service is running"
     }
+    system.get_cpu_stats.return_value = {"percent": 25.0, "count": 4, "frequency": 1400.0}
+    system.get_memory_stats.return_value = {
+        "total": 8589934592,
+        "available": 4294967296,
+        "percent": 50.0,
+        "swap_percent": 10.0
+    }
+    system.get_disk_stats.return_value = {"total": 64424509440, "free": 32212254720, "percent": 50.0}
     system.get_system_stats.return_value = {
         "cpu": {
             "percent": 25.0,
@@ -68,6 +78,57 @@ def test_system_hardware_temperature_vcgencmd():
             assert temp == 45.6
             mock_run.assert_called_once_with(['vcgencmd', 'measure_temp'])
 
+def make_service_cgroup(tmp_path, cgroup_line):
+    """Fake /proc and /sys/fs/cgroup with this process in mirage.service"""
+    import os
+    proc_root, cgroup_root = tmp_path / "proc", tmp_path / "cgroup"
+    (proc_root / "self").mkdir(parents=True)
+    (proc_root / "self" / "cgroup").write_text(cgroup_line)
+    unit_dir = cgroup_root / "system.slice" / "mirage.service"
+    unit_dir.mkdir(parents=True)
+    (unit_dir / "cgroup.procs").write_text(f"{os.getpid()}\n")
+    (unit_dir / "memory.current").write_text("12345678\n")
+    return proc_root, cgroup_root
+
+def test_service_probe_reads_cgroup(tmp_path):
+    """Test service state comes from the unit's cgroup without running systemctl status"""
+    import os
+    proc_root, cgroup_root = make_service_cgroup(tmp_path, "0::/system.slice/mirage.service\n")
+    run_command = Mock(return_value=(True, "2"))
+    probe = ServiceProbe('mirage', run_command=run_command, proc_root=proc_root, cgroup_root=cgroup_root)
+    
+    status = probe.status()
+    assert status["active"] is True
+    assert status["state"].startswith("active (running)")
+    assert status["main_pid"] == os.getpid()
+    assert status["uptime"] >= 0
+    assert status["restarts"] == 2
+    assert status["memory"]["cgroup"] == 12345678
+    assert status["memory"]["main_pid_rss"] > 0
+    
+    # The restart count is only read once per process
+    probe.status()
+    run_command.assert_called_once_with(['systemctl', 'show', 'mirage.service', '-p', 'NRestarts', '--value'])
+
+def test_service_probe_without_cgroup(tmp_path):
+    """Test the probe gives up when the unit has no cgroup"""
+    proc_root = tmp_path / "proc"
+    (proc_root / "self").mkdir(parents=True)
+    (proc_root / "self" / "cgroup").write_text("0::/user.slice\n")
+    probe = ServiceProbe('mirage', proc_root=proc_root, cgroup_root=tmp_path / "cgroup")
+    assert probe.status() is None
+
+def test_service_status_falls_back_to_systemctl():
+    """Test systemctl status is used when the cgroup probe has no answer"""
+    system = SystemHardware()
+    with patch.object(ServiceProbe, 'status', return_value=None), \
+         patch.object(SystemHardware, 'run_command') as mock_run:
+        mock_run.return_value = (True, "   Active: active (running) since Mon")
+        status = system.get_service_status()
+    assert status["active"] is True
+    assert status["source"] == "systemctl"
+    mock_run.assert_called_once_with(['systemctl', 'status', 'mirage'])
+
 def test_system_hardware_service_control():
     """Test service control commands"""
     system = SystemHardware()
@@ -116,22 +177,58 @@ def test_controller_status(mock_display, mock_system):
     assert system["cpu"]["percent"] == 25.0
     assert system["memory"]["percent"] == 50.0
     
+    assert system["cpu"]["temperature"] == 45.6
+    assert system["disk"]["percent"] == 50.0
+    assert system["service"]["active"] is True
+    
     # Check display info
     display = status["display"]
     assert display["resolution"] == [800, 480]
     assert display["connected"] is True
 
-def test_controller_storage_stats(mock_display, mock_system, tmp_path):
+def test_controller_status_fields(mock_display, mock_system):
+    """Test a partial status only runs the probes it needs"""
+    controller = Controller(mock_display, mock_system)
+    status = controller.get_status(['system.temperature', 'storage'])
+    
+    assert status["system"] == {"temperature": 45.6}
+    assert "storage" in status
+    assert "display" not in status
+    mock_system.get_service_status.assert_not_called()
+    mock_system.get_cpu_stats.assert_not_called()
+    mock_display.get_info.assert_not_called()
+
+def test_controller_status_is_cached(mock_display, mock_system):
+    """Test repeated status calls reuse probes within their TTL"""
+    controller = Controller(mock_display, mock_system)
+    controller.get_status()
+    controller.get_status()
+    
+    # The cpu stats reuse the cached temperature too
+    mock_system.get_temperature.assert_called_once()
+    mock_system.get_service_status.assert_called_once()
+    # Display info has no TTL, it is cheap and changes with every update
+    assert mock_display.get_info.call_count == 2
+
+def test_controller_status_probe_failure(mock_display, mock_system):
+    """Test a failing probe reports None instead of failing the whole status"""
+    mock_system.get_disk_stats.side_effect = OSError("no disk")
+    controller = Controller(mock_display, mock_system)
+    status = controller.get_status()
+    assert status["system"]["disk"] is None
+    assert status["system"]["memory"]["percent"] == 50.0
+
+def test_controller_storage_stats(mock_display, mock_system, tmp_path, monkeypatch):
     """Test storage statistics collection"""
-    # Create some test files
+    # Create some test files, stored before there was a catalog
     image_dir = tmp_path / "images"
     image_dir.mkdir()
     (image_dir / "test1.jpg").write_bytes(b"test1")
     (image_dir / "test2.png").write_bytes(b"test2")
     (image_dir / "test3.txt").write_bytes(b"test3")  # Should be ignored
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', image_dir)
     
     controller = Controller(mock_display, mock_system)
-    controller.image_dir = image_dir
     
     stats = controller.get_storage_stats()
     assert stats["image_count"] == 2  # Only jpg and png
@@ -142,9 +239,9 @@ def test_controller_display_update(mock_display, mock_system):
     mock_display.update.return_value = True
     controller = Controller(mock_display, mock_system)
     
-    # Mock the save_image function
-    with patch('app.controller.save_image') as mock_save:
-        mock_save.return_value = Path("/tmp/test.jpg")
+    # Mock the ingest_image function
+    with patch('app.controller.ingest_image') as mock_ingest:
+        mock_ingest.return_value = Mock(path=Path("/tmp/test.jpg"), image=None, content_hash="abc")
         
         # Test successful update
         success, error = controller.update_display(Mock())
@@ -155,4 +252,28 @@ def test_controller_display_update(mock_display, mock_system):
         mock_display.update.return_value = False
         success, error = controller.update_display(Mock())
         assert not success
-        assert error == "Display update failed" 
\ No newline at end of file
+        assert error == "Display update failed" 
+def test_metrics_collected_on_scrape(mock_display, mock_system):
+    """Test system and storage gauges are gathered by the scrape itself"""
+    from prometheus_client import CollectorRegistry, generate_latest
+    from app.metrics import MetricsCollector
+    
+    registry = CollectorRegistry()
+    controller = Controller(mock_display, mock_system)
+    collector = MetricsCollector(controller, registry=registry)
+    # Registering only describes the metrics, it doesn't probe anything
+    mock_system.get_cpu_stats.assert_not_called()
+    
+    output = generate_latest(registry).decode()
+    assert 'mirage_system_cpu_percent 25.0' in output
+    assert 'mirage_system_temperature_celsius 45.6' in output
+    assert 'mirage_stored_images_total' in output
+    # The service state isn't exported, so scrapes never need systemctl
+    mock_system.get_service_status.assert_not_called()
+    
+    # A second scrape within the probe TTLs reuses the cached values
+    generate_latest(registry)
+    mock_system.get_cpu_stats.assert_called_once()
+    
+    collector.shutdown()
+    assert 'mirage_system_cpu_percent' not in generate_latest(registry).decode()
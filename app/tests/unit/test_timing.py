@@ -0,0 +1,21 @@
+import time
+from app.timing import StageTimer, stage
+
+def test_stage_timer_accumulates():
+    """Test repeated stages add up and each measurement reaches the observer"""
+    observed = []
+    timer = StageTimer(observer=lambda name, seconds: observed.append(name))
+    for _ in range(2):
+        with timer.stage('decode'):
+            time.sleep(0.01)
+    timer.record('refresh', 1.5)
+    
+    assert timer.stages['decode'] >= 0.02
+    assert timer.to_dict()['refresh'] == 1.5
+    assert observed == ['decode', 'decode', 'refresh']
+    assert timer.elapsed() >= 0.02
+
+def test_stage_without_timer():
+    """Test stage() is a no-op when nothing is timing the pipeline"""
+    with stage(None, 'decode'):
+        pass
@@ -0,0 +1,102 @@
+import hashlib
+import io
+import json
+import os
+import time
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import Config
+from app.uploads import FILE_MODE, UploadSpool, atomic_path, remove_stale_partials
+from app.utils import ingest_image
+
+def jpeg_bytes(size=(640, 480)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def test_spool_hashes_and_counts_as_it_writes(tmp_path):
+    """Test the spool's hash and size match the data, and commit renames it into place"""
+    data = os.urandom(200_000)
+    spool = UploadSpool(tmp_path)
+    for offset in range(0, len(data), 16_384):
+        spool.write(data[offset:offset + 16_384])
+    assert spool.size == len(data)
+    assert spool.sha256 == hashlib.sha256(data).hexdigest()
+    
+    spool.seek(0)
+    assert spool.read() == data
+    partial = spool.path
+    spool.commit(tmp_path / 'kept.bin')
+    spool.close()
+    assert not partial.exists()
+    assert (tmp_path / 'kept.bin').read_bytes() == data
+    assert (tmp_path / 'kept.bin').stat().st_mode & 0o777 == FILE_MODE  # Not the partial file's 0600
+
+def test_spool_refuses_oversized_upload(tmp_path):
+    """Test an upload is refused once it passes the limit, and its partial file is removed"""
+    spool = UploadSpool(tmp_path, max_size=1000)
+    spool.write(b'x' * 600)
+    with pytest.raises(RequestEntityTooLarge):
+        spool.write(b'x' * 600)
+    assert list(tmp_path.iterdir()) == []  # Even if the parser never closes it
+    spool.close()
+
+def test_atomic_path_leaves_nothing_on_failure(tmp_path):
+    """Test the destination only appears once the write succeeds"""
+    dest = tmp_path / 'image.jpg'
+    with pytest.raises(RuntimeError):
+        with atomic_path(dest) as partial:
+            partial.write_bytes(b'half')
+            raise RuntimeError("write failed")
+    assert list(tmp_path.iterdir()) == []
+    
+    with atomic_path(dest) as partial:
+        partial.write_bytes(b'whole')
+    assert dest.read_bytes() == b'whole'
+    assert list(tmp_path.iterdir()) == [dest]
+    assert dest.stat().st_mode & 0o777 == FILE_MODE
+
+def test_stale_partials_are_removed(tmp_path):
+    """Test partial files left by a dead worker are cleaned up, fresh ones are kept"""
+    stale, fresh = tmp_path / '.upload-old.part', tmp_path / '.upload-new.part'
+    stale.write_bytes(b'old')
+    fresh.write_bytes(b'new')
+    an_hour_ago = time.time() - 7200
+    os.utime(stale, (an_hour_ago, an_hour_ago))
+    assert remove_stale_partials(tmp_path) == 1
+    assert not stale.exists() and fresh.exists()
+
+def test_ingest_renames_spooled_upload(tmp_path, monkeypatch):
+    """Test a spooled upload is stored by renaming it, with the hash taken while it streamed"""
+    monkeypatch.setattr(Config, 'UPLOAD_FOLDER', tmp_path)
+    data = jpeg_bytes()
+    spool = UploadSpool(tmp_path)
+    spool.write(data)
+    spool.seek(0)
+    
+    ingested = ingest_image(FileStorage(stream=spool, filename='photo.jpg'))
+    assert spool.path == ingested.path
+    assert ingested.content_hash == hashlib.sha256(data).hexdigest()
+    assert ingested.path.read_bytes() == data
+    spool.close()
+    assert sorted(p.name for p in tmp_path.glob('[!.]*')) == [f'{ingested.content_hash}.jpg', f'{ingested.content_hash}.json']
+
+def test_upload_route_streams_to_upload_folder(client):
+    """Test an upload through the API leaves only the stored image behind"""
+    data = jpeg_bytes()
+    response = client.post('/display', data={'image': (io.BytesIO(data), 'streamed.jpg')})
+    assert response.status_code == 202
+    
+    stored = Config.UPLOAD_FOLDER / f'{hashlib.sha256(data).hexdigest()}.jpg'
+    assert stored.read_bytes() == data
+    assert not list(Config.UPLOAD_FOLDER.glob('.*.part'))
+
+def test_upload_route_rejects_oversized_upload(client):
+    """Test an upload over MAX_CONTENT_LENGTH gets a JSON 413"""
+    data = b'x' * (client.application.config['MAX_CONTENT_LENGTH'] + 1)
+    response = client.post('/display', data={'image': (io.BytesIO(data), 'huge.jpg')})
+    assert response.status_code == 413
+    assert 'File too large' in json.loads(response.data)['error']
+    assert not list(Config.UPLOAD_FOLDER.glob('.*.part'))
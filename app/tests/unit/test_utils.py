@@ -1,9 +1,20 @@
+import hashlib
+import io
 import pytest
+from PIL import Image
 from pathlib import Path
 from werkzeug.datastructures import FileStorage
-from ...utils import validate_image, save_image, cleanup_old_images
+from ...utils import validate_image, save_image, cleanup_old_images, list_images, find_image, ingest_image, file_sha256, storage_totals
+from ... import utils
 from config import Config
 
+def png_file(color, size=(40, 20)) -> io.BytesIO:
+    """A small PNG, distinct for each color"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer
+
 def create_file_storage(file_obj, filename):
     """Helper to create FileStorage objects for testing"""
     return FileStorage(
@@ -82,25 +93,148 @@ def test_save_image_invalid(corrupt_image, app):
             save_image(file)
         assert "Invalid or corrupted image file" in str(exc_info.value)
 
-def test_cleanup_old_images(app, test_image):
+def test_cleanup_old_images(app):
     """Test cleanup of old images"""
     with app.app_context():
         # Save multiple images
         files = []
         for i in range(5):
-            file = create_file_storage(test_image, f"test_{i}.jpg")
+            file = create_file_storage(png_file((i * 50, 0, 0)), f"test_{i}.png")
             path = save_image(file)
             files.append(path)
         
-        # Verify initial count
-        assert len(list(Config.UPLOAD_FOLDER.glob("*"))) == 5
+        # Verify initial count, each image has a metadata sidecar
+        assert len(list(Config.UPLOAD_FOLDER.glob("*.png"))) == 5
+        assert len(list(Config.UPLOAD_FOLDER.glob("*.json"))) == 5
         
         # Clean up
         cleanup_old_images(keep_last=2)
         
         # Verify final count
-        remaining = list(Config.UPLOAD_FOLDER.glob("*"))
-        assert len(remaining) == 2
+        remaining = list(Config.UPLOAD_FOLDER.glob("[!.]*"))
+        assert len(remaining) == 4
         # Verify we kept the most recent files
         assert files[-1] in remaining
-        assert files[-2] in remaining 
\ No newline at end of file
+        assert files[-2] in remaining
+        assert files[-1].with_suffix('.json') in remaining
+        assert storage_totals()["image_count"] == 2
+
+def test_list_and_find_images(app, test_image):
+    """Test stored images are listed newest first and resolvable by id"""
+    with app.app_context():
+        path = save_image(create_file_storage(test_image, "findme.jpg"))
+        images = list_images()
+        assert images[0]["id"] == path.stem
+        assert find_image(path.stem) == path
+        assert find_image("missing") is None
+        assert find_image("../config") is None
+
+def test_ingest_keeps_original_bytes(app, test_image):
+    """Test an upload that needs no conversion is stored byte for byte"""
+    original = test_image.getvalue()
+    with app.app_context():
+        ingested = ingest_image(create_file_storage(test_image, "original.jpg"))
+        assert ingested.path.read_bytes() == original
+        assert ingested.content_hash == file_sha256(ingested.path)
+        # The decoded pixels come along so the display needn't reopen the file
+        assert ingested.image.size == Image.open(io.BytesIO(original)).size
+
+def test_ingest_converts_rgba(app):
+    """Test images that need conversion are re-encoded as RGB"""
+    buffer = io.BytesIO()
+    Image.new('RGBA', (40, 20), (255, 0, 0, 128)).save(buffer, format='PNG')
+    buffer.seek(0)
+    with app.app_context():
+        ingested = ingest_image(create_file_storage(buffer, "alpha.png"))
+        assert ingested.image.mode == 'RGB'
+        with Image.open(ingested.path) as stored:
+            assert stored.mode == 'RGB'
+        # Named after what was uploaded, not what was stored
+        assert ingested.content_hash == hashlib.sha256(buffer.getvalue()).hexdigest()
+        assert ingested.path.stem == ingested.content_hash
+
+def test_validate_image_pixel_budget(monkeypatch):
+    """Test images over MAX_IMAGE_PIXELS are rejected when they can't be downscaled"""
+    monkeypatch.setattr(Config, 'MAX_IMAGE_PIXELS', 1_000_000)
+    buffer = io.BytesIO()
+    Image.new('RGB', (1500, 1000)).save(buffer, format='PNG')
+    buffer.seek(0)
+    is_valid, error = validate_image(create_file_storage(buffer, "huge.png"))
+    assert not is_valid
+    assert "Image too large" in error
+
+def test_ingest_decodes_at_panel_scale(app):
+    """Test large JPEGs are decoded small but stored untouched"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (4000, 3000), (0, 0, 255)).save(buffer, format='JPEG')
+    original = buffer.getvalue()
+    buffer.seek(0)
+    with app.app_context():
+        ingested = ingest_image(create_file_storage(buffer, "photo.jpg"), target_size=(800, 480))
+        assert ingested.image.size == (1000, 750)
+        assert ingested.path.read_bytes() == original
+
+def test_ingest_converts_at_full_resolution(app, monkeypatch):
+    """Test converted images are stored at their own size from one decode, only the display copy is reduced"""
+    buffer = io.BytesIO()
+    Image.new('RGBA', (3200, 2400), (0, 0, 255, 200)).save(buffer, format='PNG')
+    buffer.seek(0)
+    opened = []
+    real_open = Image.open
+    monkeypatch.setattr(Image, 'open', lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs))
+    with app.app_context():
+        ingested = ingest_image(create_file_storage(buffer, "alpha.png"), target_size=(800, 480))
+        assert ingested.image.size == (800, 600)
+        assert ingested.image.mode == 'RGB'
+        with Image.open(ingested.path) as stored:
+            assert stored.size == (3200, 2400)
+            assert stored.mode == 'RGB'
+        assert list_images()[0]["width"] == 3200
+        assert len(opened) == 2  # The upload, and the stored image above
+
+def test_ingest_deduplicates_known_content(app, monkeypatch):
+    """Test uploading stored content again returns the stored image without decoding it"""
+    data = png_file((0, 128, 0)).getvalue()
+    with app.app_context():
+        first = ingest_image(create_file_storage(io.BytesIO(data), "first.png"))
+        
+        def no_decode(*args, **kwargs):
+            raise AssertionError("known content was decoded again")
+        monkeypatch.setattr(utils, '_decode_upload', no_decode)
+        again = ingest_image(create_file_storage(io.BytesIO(data), "renamed.png"))
+        
+        assert again.deduplicated and not first.deduplicated
+        assert again.path == first.path
+        assert again.content_hash == first.content_hash
+        assert again.image is None
+        assert list_images()[0]["original_filename"] == "first.png"
+
+def test_ingest_same_name_different_content(app):
+    """Test uploads with the same name don't overwrite each other"""
+    with app.app_context():
+        red = save_image(create_file_storage(png_file((255, 0, 0)), "photo.png"))
+        blue = save_image(create_file_storage(png_file((0, 0, 255)), "photo.png"))
+        assert red != blue
+        assert red.exists() and blue.exists()
+
+def test_ingest_keeps_mpo_as_jpeg(app):
+    """Test phone photos, which Pillow reports as MPO, keep their original bytes as a JPEG"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (0, 255, 0)).save(buffer, format='MPO', save_all=True,
+                                                  append_images=[Image.new('RGB', (64, 48))])
+    original = buffer.getvalue()
+    buffer.seek(0)
+    with app.app_context():
+        ingested = ingest_image(create_file_storage(buffer, "phone.jpg"), target_size=(16, 12))
+        assert ingested.path.suffix == '.jpg'
+        assert ingested.path.read_bytes() == original
+        assert ingested.image.size == (16, 12)  # Decoded at a reduced scale like any JPEG
+        assert utils.store.read_metadata(ingested.path)["format"] == 'JPEG'
+
+def test_ingest_stores_in_detected_format(app):
+    """Test a PNG uploaded with a .jpg name is stored as the PNG it is"""
+    data = png_file((10, 20, 30)).getvalue()
+    with app.app_context():
+        path = save_image(create_file_storage(io.BytesIO(data), "mislabelled.jpg"))
+        assert path.suffix == '.png'
+        assert path.read_bytes() == data
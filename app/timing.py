@@ -0,0 +1,57 @@
+"""
+Per-stage timing of the upload and display pipeline
+"""
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional
+
+class StageTimer:
+    """
+    Accumulates wall-clock seconds per named pipeline stage.
+    One timer follows an upload from the request through to the panel
+    refresh, so its stages add up to where that request's time went.
+    """
+
+    def __init__(self, observer: Optional[Callable[[str, float], None]] = None):
+        self.observer = observer  # Called with (stage, seconds) as each stage completes
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @classmethod
+    def carry_over(cls, stages: Dict[str, float], elapsed: float,
+                   observer: Optional[Callable[[str, float], None]] = None) -> 'StageTimer':
+        """
+        Continue a timer started in another process. The stages it already
+        recorded were observed there, so they are not passed to the observer again.
+        """
+        timer = cls(observer=observer)
+        timer.started -= elapsed
+        timer.stages.update(stages)
+        return timer
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the body of a with block as the named stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        """Add a measured duration, stages that run more than once accumulate"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if self.observer:
+            self.observer(name, seconds)
+
+    def elapsed(self) -> float:
+        """Seconds since the timer was created"""
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, float]:
+        # Copied first, the display worker may be adding stages while this is read
+        return {name: round(seconds, 4) for name, seconds in list(self.stages.items())}
+
+def stage(timer: Optional[StageTimer], name: str):
+    """timer.stage(name), or a no-op context when there is no timer"""
+    return timer.stage(name) if timer else nullcontext()
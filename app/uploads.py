@@ -0,0 +1,126 @@
+"""
+Streaming upload storage.
+
+Werkzeug's multipart parser writes each uploaded file to whatever stream
+the request's _get_file_stream returns, one chunk at a time. UploadRequest
+hands it an UploadSpool, which writes the chunks straight to a partial
+file inside UPLOAD_FOLDER, hashing and counting them as they arrive and
+refusing the upload as soon as it passes MAX_CONTENT_LENGTH. Keeping the
+upload is then a rename of that file, so it is never held whole in worker
+memory and never copied.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_SUFFIX = '.part'  # Not a supported format, so listings and cleanup skip files being written
+STALE_PARTIAL_SECONDS = 3600  # Partial files this old were left by a worker that died mid-write
+
+def _umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Partial files are created 0600, kept files get the mode open() would have given them.
+# Read once at import, as setting the umask to read it is process-wide
+FILE_MODE = 0o666 & ~_umask()
+
+class UploadSpool:
+    """
+    A writable, readable file in the upload folder that keeps a running
+    SHA-256 and size of everything written to it. Removed on close unless
+    commit() has moved it into place.
+    """
+
+    def __init__(self, folder: Path, max_size: Optional[int] = None):
+        folder.mkdir(parents=True, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=folder, prefix='.upload-', suffix=PARTIAL_SUFFIX, delete=False)
+        self.path = Path(self._file.name)
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._committed = False
+
+    @property
+    def sha256(self) -> str:
+        """Hex SHA-256 of everything written so far"""
+        return self._digest.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            # The parser gives up without closing its streams, so nothing else would remove it
+            self.close()
+            raise RequestEntityTooLarge(f"File too large. Maximum size: {self.max_size} bytes")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read, seek, tell and the rest come from the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def commit(self, dest: Path):
+        """Atomically move the upload to dest, it is no longer removed on close"""
+        self._file.flush()
+        os.chmod(self.path, FILE_MODE)
+        os.replace(self.path, dest)
+        self.path = Path(dest)
+        self._committed = True
+
+    def close(self):
+        self._file.close()
+        if not self._committed:
+            self.path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class UploadRequest(Request):
+    """Request that streams uploaded files into UploadSpools in the upload folder"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(Config.UPLOAD_FOLDER, max_size=Config.MAX_CONTENT_LENGTH)
+
+@contextmanager
+def atomic_path(dest: Path) -> Iterator[Path]:
+    """A partial file next to dest, renamed over dest once the with block succeeds"""
+    fd, partial = tempfile.mkstemp(dir=dest.parent, prefix='.', suffix=PARTIAL_SUFFIX)
+    os.close(fd)
+    partial = Path(partial)
+    try:
+        yield partial
+        os.chmod(partial, FILE_MODE)
+        os.replace(partial, dest)
+    finally:
+        partial.unlink(missing_ok=True)
+
+def remove_stale_partials(folder: Path, max_age: float = STALE_PARTIAL_SECONDS) -> int:
+    """Delete partial files older than max_age seconds, returns how many were removed"""
+    cutoff = time.time() - max_age
+    removed = 0
+    for partial in folder.glob(f'.*{PARTIAL_SUFFIX}'):
+        try:
+            if partial.stat().st_mtime < cutoff:
+                partial.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        logger.info(f"Removed {removed} stale partial uploads from {folder}")
+    return removed
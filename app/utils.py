@@ -1,26 +1,47 @@
 from pathlib import Path
 import logging
 from werkzeug.utils import secure_filename
-from datetime import datetime
 from config import Config
 import os
-from PIL import Image
-import io
+import hashlib
+import shutil
+from typing import Optional, Tuple
+from app import store
+from app.imaging import ImageTooLargeError, decode, decode_size, reduce_to
+from app.metrics import UPLOADS_DEDUPLICATED_TOTAL
+from app.startup import lazy_import
+from app.uploads import UploadSpool, atomic_path
+from app.timing import StageTimer, stage
 
 logger = logging.getLogger(__name__)
 
-def validate_image(file) -> tuple[bool, str]:
-    """
-    Validate image file before saving
-    Returns (is_valid, error_message)
-    """
+Image = lazy_import('PIL.Image')
+
+# Formats whose original bytes can be stored as-is, by file extension
+_NATIVE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+# Extension stored images of each format are given
+_STORED_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png'}
+# Formats Pillow reports for files that are stored as another, MPO being a JPEG with extra frames
+_FORMAT_ALIASES = {'MPO': 'JPEG'}
+
+class IngestedImage:
+    """An upload that has been validated and stored, plus its decoded pixels"""
+    
+    def __init__(self, path: Path, image: Optional['Image.Image'], content_hash: str, deduplicated: bool = False):
+        self.path = path
+        self.image = image  # Already decoded, so the display stage needn't reopen the file
+        self.content_hash = content_hash
+        self.deduplicated = deduplicated  # Already stored, image is None as nothing was decoded
+
+def _check_upload(file) -> Optional[str]:
+    """Cheap checks that don't need the image decoded, returns an error message or None"""
     if not file or not file.filename:
-        return False, "No file provided"
+        return "No file provided"
         
     # Check file extension
     extension = Path(file.filename).suffix.lower()
     if extension not in Config.SUPPORTED_FORMATS:
-        return False, f"Unsupported format '{extension}'. Supported formats: {Config.SUPPORTED_FORMATS}"
+        return f"Unsupported format '{extension}'. Supported formats: {Config.SUPPORTED_FORMATS}"
     
     # Check file size
     file.seek(0, os.SEEK_END)
@@ -28,96 +49,230 @@ def validate_image(file) -> tuple[bool, str]:
     file.seek(0)  # Reset file pointer
     
     if size > Config.MAX_CONTENT_LENGTH:
-        return False, f"File too large ({size} bytes). Maximum size: {Config.MAX_CONTENT_LENGTH} bytes"
+        return f"File too large ({size} bytes). Maximum size: {Config.MAX_CONTENT_LENGTH} bytes"
     
     if size == 0:
-        return False, "File is empty"
+        return "File is empty"
     
-    # Validate image integrity and dimensions
+    return None
+
+def _needs_conversion(image_format: str, image_mode: str) -> bool:
+    """Whether an upload is re-encoded as RGB rather than stored as uploaded"""
+    return image_mode not in ('RGB', 'L') or image_format not in _STORED_EXTENSIONS
+
+def _decode_upload(file, target_size: Optional[Tuple[int, int]] = None, fit: Optional[str] = None,
+                   timer: Optional[StageTimer] = None,
+                   full_size_if_converted: bool = False) -> Tuple['Image.Image', str, Tuple[int, int]]:
+    """
+    Decode an upload exactly once. Loading the pixel data doubles as the
+    integrity check, so there is no separate verify() pass.
+    With target_size the image is decoded at the smallest scale the fit
+    mode needs, unless full_size_if_converted is set and it will have to be
+    converted. MAX_IMAGE_PIXELS is enforced before decoding.
+    Returns the decoded image, the source format and the source size.
+    """
     try:
-        image_bytes = file.read()
-        file.seek(0)  # Reset file pointer after reading
+        try:
+            with stage(timer, 'validate'):
+                img = Image.open(file)
+                image_format, image_mode, image_size = _FORMAT_ALIASES.get(img.format, img.format), img.mode, img.size
+        except Exception as e:
+            raise ValueError(f"Invalid or corrupted image file: {str(e)}")
         
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            # Basic integrity check by attempting to load the image
-            img.verify()
-            
-            # Re-open for additional checks (verify() closes the file)
-            img = Image.open(io.BytesIO(image_bytes))
-            
-            # Check image mode (convert if necessary)
-            if img.mode not in ('RGB', 'L'):
-                logger.warning(f"Image mode '{img.mode}' will be converted to RGB")
-            
-            # Log image details
-            logger.info(f"Image validation - Format: {img.format}, Mode: {img.mode}, Size: {img.size}")
-            
-            return True, ""
-            
-    except Exception as e:
-        return False, f"Invalid or corrupted image file: {str(e)}"
+        # Log image details
+        logger.info(f"Image validation - Format: {image_format}, Mode: {image_mode}, Size: {image_size}")
+        
+        try:
+            size = None
+            if target_size and not (full_size_if_converted and _needs_conversion(image_format, image_mode)):
+                size = decode_size(img.size, target_size, fit or Config.DISPLAY_FIT)
+            with stage(timer, 'decode'):
+                img = decode(img, size, Config.MAX_IMAGE_PIXELS)
+        except ImageTooLargeError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Invalid or corrupted image file: {str(e)}")
+    finally:
+        file.seek(0)  # Leave the stream ready for copying the original bytes
+    
+    # Check image mode (convert if necessary)
+    if img.mode not in ('RGB', 'L'):
+        logger.warning(f"Image mode '{img.mode}' will be converted to RGB")
+    
+    return img, image_format, image_size
 
-def save_image(file) -> Path:
+def validate_image(file) -> tuple[bool, str]:
     """
-    Save uploaded image with timestamp-based unique name
-    Returns path to saved image
+    Validate image file before saving
+    Returns (is_valid, error_message)
     """
-    # Validate file
-    is_valid, error_message = validate_image(file)
-    if not is_valid:
-        logger.error(f"Image validation failed: {error_message}")
-        raise ValueError(error_message)
+    error = _check_upload(file)
+    if error:
+        return False, error
     
-    # Create safe filename with timestamp
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    original_filename = secure_filename(file.filename)
-    filename = f"{timestamp}_{original_filename}"
+    try:
+        img, _, _ = _decode_upload(file)
+        img.close()
+        return True, ""
+    except ValueError as e:
+        return False, str(e)
+
+def file_sha256(path: Path, chunk_size: int = 64 * 1024) -> str:
+    """Hex SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _upload_sha256(file, chunk_size: int = 64 * 1024) -> str:
+    """Hex SHA-256 of the uploaded bytes, taken while it streamed in if it was spooled"""
+    spool = getattr(file, 'stream', None)
+    if isinstance(spool, UploadSpool):
+        return spool.sha256
+    digest = hashlib.sha256()
+    while chunk := file.read(chunk_size):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+def _store_original(file, dest: Path):
+    """Keep the uploaded bytes at dest, renaming a spooled upload into place and copying anything else"""
+    spool = getattr(file, 'stream', None)
+    if isinstance(spool, UploadSpool):
+        spool.commit(dest)
+        return
+    with atomic_path(dest) as partial:
+        with open(partial, 'wb') as f:
+            shutil.copyfileobj(file, f, 64 * 1024)
+
+def ingest_image(file, target_size: Optional[Tuple[int, int]] = None, fit: Optional[str] = None,
+                 timer: Optional[StageTimer] = None) -> IngestedImage:
+    """
+    Validate and store an upload, decoding it only once.
+    Images are stored under the SHA-256 of the uploaded bytes, so an upload
+    that is already stored is returned as is, without decoding or writing.
+    The original bytes are kept when the image needs no conversion,
+    otherwise it is decoded at full resolution, within MAX_IMAGE_PIXELS,
+    and converted to RGB and re-encoded from that one decode.
+    target_size is the panel resolution the image will be fitted to with
+    the given fit mode; the image handed on for display is decoded at, or
+    for a converted image reduced to, the scale that needs.
+    timer, if given, records the 'validate', 'decode' and 'save' stages.
+    """
+    with stage(timer, 'validate'):
+        error = _check_upload(file)
+    if error:
+        logger.error(f"Image validation failed: {error}")
+        raise ValueError(error)
+    
+    with stage(timer, 'validate'):
+        content_hash = _upload_sha256(file)
+        stored = store.lookup(content_hash)
+    if stored is not None:
+        try:
+            # Count the upload as recent use so cleanup keeps the image around
+            store.touch(stored)
+        except FileNotFoundError:
+            stored = None  # Removed by a concurrent cleanup, store it again
+    if stored is not None:
+        UPLOADS_DEDUPLICATED_TOTAL.inc()
+        logger.info(f"Image {file.filename} is already stored as {stored.name}")
+        return IngestedImage(stored, None, content_hash, deduplicated=True)
     
-    # Ensure upload directory exists
-    image_path = Config.UPLOAD_FOLDER / filename
+    try:
+        img, image_format, image_size = _decode_upload(file, target_size, fit, timer, full_size_if_converted=True)
+    except ValueError as e:
+        logger.error(f"Image validation failed: {e}")
+        raise
+    
+    # Named after the uploaded bytes, so the same picture is only ever stored once,
+    # in its own format whatever the upload's extension says
+    stored_format = image_format if image_format in _STORED_EXTENSIONS else _NATIVE_FORMATS[Path(file.filename).suffix.lower()]
+    image_path = store.image_path(content_hash, _STORED_EXTENSIONS[stored_format])
     image_path.parent.mkdir(parents=True, exist_ok=True)
     
     try:
-        # Convert image if necessary and save
-        with Image.open(file) as img:
-            if img.mode not in ('RGB', 'L'):
-                img = img.convert('RGB')
-            img.save(str(image_path), quality=95, optimize=True)
+        with stage(timer, 'save'):
+            if not _needs_conversion(image_format, img.mode):
+                # Nothing to convert, keep the uploaded bytes
+                _store_original(file, image_path)
+                stored_size = image_size
+            else:
+                # Decoded at full resolution for this, display gets a reduced copy
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                stored_size = img.size
+                with atomic_path(image_path) as partial:
+                    img.save(str(partial), format=stored_format, quality=95, optimize=True)
+                if target_size:
+                    img = reduce_to(img, decode_size(img.size, target_size, fit or Config.DISPLAY_FIT))
+            store.write_metadata(image_path, content_hash, file.filename, stored_format, stored_size)
         
         logger.info(f"Saved image to {image_path}")
         
-        # Clean up old images
-        cleanup_old_images(Config.KEEP_IMAGES)
-        
-        return image_path
+        # Old images are evicted in the background by app.retention
+        return IngestedImage(image_path, img, content_hash)
         
     except Exception as e:
         logger.error(f"Failed to save image: {e}")
-        if image_path.exists():
-            try:
-                image_path.unlink()  # Clean up failed save
-            except:
-                pass
+        try:
+            store.remove(image_path)  # Clean up failed save
+        except OSError:
+            pass
         raise ValueError(f"Failed to save image: {str(e)}")
 
+def save_image(file) -> Path:
+    """
+    Save uploaded image under its content hash
+    Returns path to saved image
+    """
+    return ingest_image(file).path
+
+def list_images(limit: Optional[int] = None, offset: int = 0) -> list[dict]:
+    """
+    List stored images, newest first, from the catalog.
+    The id is the file stem, the image's content hash, which stays the same
+    for as long as the file is kept.
+    """
+    rows = store.catalog().page(limit if limit is not None else -1, offset)
+    return [{
+        "id": row["id"],
+        "filename": row["filename"],
+        "original_filename": row["original_filename"],
+        "size": row["size"],
+        "width": row["width"],
+        "height": row["height"],
+        "modified": row["modified"],
+        "last_displayed": row["last_displayed"],
+        "display_count": row["display_count"],
+        "pinned": bool(row["pinned"])
+    } for row in rows]
+
+def storage_totals() -> dict:
+    """Number of stored images and their total size, read from the catalog without scanning"""
+    return store.catalog().totals()
+
+def find_image(image_id: str) -> Optional[Path]:
+    """Resolve an image id from list_images to its path, or None if it isn't stored"""
+    # Ids are plain file stems, anything else could escape the upload folder
+    if not image_id or secure_filename(image_id) != image_id:
+        return None
+    for extension in Config.SUPPORTED_FORMATS:
+        image_path = Config.UPLOAD_FOLDER / f"{image_id}{extension}"
+        if image_path.is_file():
+            return image_path
+    return None
+
 def cleanup_old_images(keep_last: int = None):
-    """Remove old images, keeping only the specified number of most recent ones"""
+    """Remove old images, keeping only the specified number of most recent unpinned ones"""
     if keep_last is None:
         keep_last = Config.KEEP_IMAGES
         
     try:
-        images = sorted(
-            [f for f in Config.UPLOAD_FOLDER.glob('*') if f.suffix.lower() in Config.SUPPORTED_FORMATS],
-            key=lambda x: x.stat().st_mtime,
-            reverse=True
-        )
-        
-        # Remove all but the most recent files
-        for image_path in images[keep_last:]:
-            try:
-                image_path.unlink()
-                logger.info(f"Cleaned up old image: {image_path}")
-            except Exception as e:
-                logger.error(f"Failed to delete {image_path}: {e}")
+        # Remove all but the most recent files, forgotten by the catalog in one transaction
+        old_images = [Config.UPLOAD_FOLDER / row["filename"] for row in store.catalog().beyond(keep_last)]
+        for image_path in store.remove_many(old_images):
+            logger.info(f"Cleaned up old image: {image_path}")
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
\ No newline at end of file
@@ -0,0 +1,3 @@
+"""
+Benchmarks for Mirage's image pipeline
+"""
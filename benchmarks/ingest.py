@@ -0,0 +1,121 @@
+"""
+End-to-end CPU time and peak RSS of handling one upload, from the request
+file to the resized image the display quantizes.
+
+"legacy" reproduces the pipeline before the single-decode ingest: verify()
+plus a second decode in validate_image, a third decode and a re-encode in
+save_image, and a fourth decode of the saved file in Display.update.
+"ingest" is app.utils.ingest_image, decoding at the smallest scale that
+covers the panel and handing that image to the display.
+
+Each variant runs in a fresh process so peak RSS isn't shared between them.
+
+    python -m benchmarks.ingest [--image photo.jpg] [--megapixels 12] [--json]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+import numpy as np
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+PANEL_RESOLUTION = (800, 480)
+
+def synthetic_jpeg(megapixels: float, seed: int = 0) -> bytes:
+    """A 4:3 photo-like JPEG of roughly the given size"""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    small = np.random.default_rng(seed).integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def legacy_pipeline(data: bytes, filename: str, upload_dir: Path):
+    file = FileStorage(stream=io.BytesIO(data), filename=filename)
+
+    # validate_image: read everything, verify, then decode again
+    image_bytes = file.read()
+    file.seek(0)
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.verify()
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
+
+    # save_image: decode and re-encode
+    image_path = upload_dir / filename
+    with Image.open(file) as img:
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(str(image_path), quality=95, optimize=True)
+
+    # Display.update: decode the saved file and resize
+    with Image.open(image_path) as image:
+        image.resize(PANEL_RESOLUTION)
+
+def ingest_pipeline(data: bytes, filename: str, upload_dir: Path):
+    from app.utils import ingest_image
+    ingested = ingest_image(FileStorage(stream=io.BytesIO(data), filename=filename), target_size=PANEL_RESOLUTION)
+    ingested.image.resize(PANEL_RESOLUTION)
+
+VARIANTS = {"legacy": legacy_pipeline, "ingest": ingest_pipeline}
+
+def _child(variant: str, data: bytes, results):
+    from config import Config
+    import app.utils  # noqa: F401 - keep import time out of the measurement
+    with tempfile.TemporaryDirectory() as upload_dir:
+        Config.UPLOAD_FOLDER = Path(upload_dir)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        VARIANTS[variant](data, "upload.jpg", Path(upload_dir))
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    results.put({
+        "cpu_ms": round(cpu * 1000, 1),
+        "wall_ms": round(wall * 1000, 1),
+        "peak_rss_mb": round(rss_after / 1024, 1),
+        "rss_growth_mb": round((rss_after - rss_before) / 1024, 1)
+    })
+
+def run_variant(variant: str, data: bytes) -> Dict[str, float]:
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_child, args=(variant, data, results))
+    process.start()
+    result = results.get(timeout=300)
+    process.join()
+    return result
+
+def run(data: bytes) -> Dict[str, Dict[str, float]]:
+    return {variant: run_variant(variant, data) for variant in VARIANTS}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help="JPEG to ingest (default: synthetic photo)")
+    parser.add_argument('--megapixels', type=float, default=12, help="Size of the synthetic photo")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    data = Path(args.image).read_bytes() if args.image else synthetic_jpeg(args.megapixels)
+    results = run(data)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Upload: {len(data) / 1e6:.1f}MB")
+    print(f"{'variant':<10}{'cpu ms':>10}{'wall ms':>10}{'peak RSS MB':>14}{'RSS growth MB':>16}")
+    for name, result in results.items():
+        print(f"{name:<10}{result['cpu_ms']:>10.1f}{result['wall_ms']:>10.1f}"
+              f"{result['peak_rss_mb']:>14.1f}{result['rss_growth_mb']:>16.1f}")
+
+if __name__ == '__main__':
+    main()
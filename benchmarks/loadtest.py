@@ -0,0 +1,307 @@
+"""
+HTTP load test for the Flask API.
+
+Boots create_app on the virtual panel with the system probes mocked, in
+its own process (gunicorn, or the werkzeug development server when
+gunicorn isn't installed), then drives a weighted mix of /status,
+/metrics and /display requests from client threads at a fixed
+concurrency. Reports throughput, latency percentiles and error rates per
+route.
+
+With /display in the mix and a refresh time above zero the display worker
+is busy for most of the run, so the read latencies reflect serving while a
+refresh is in progress. Each upload is a different file, so it is decoded,
+stored and rendered like a new photo; --duplicate-uploads sends the same
+bytes every time to measure the deduplicated path instead.
+
+    python -m benchmarks.loadtest [--workers 1] [--threads 1] [--concurrency 8]
+                                  [--duration 30] [--mix status=6,metrics=3,display=1]
+                                  [--refresh-seconds 5] [--duplicate-uploads] [--json]
+"""
+import argparse
+import http.client
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+from benchmarks.quantize import synthetic_photo
+
+ROUTES = {
+    'status': ('GET', '/status'),
+    'metrics': ('GET', '/metrics'),
+    'display': ('POST', '/display')
+}
+
+BOUNDARY = 'mirage-loadtest-boundary'
+
+def create_loadtest_app():
+    """
+    App factory for the load test server, configured from LOADTEST_* variables.
+    Uses the virtual panel and fixed system readings so it runs anywhere.
+    """
+    from unittest.mock import patch
+    from config import Config
+
+    work_dir = Path(os.environ.get('LOADTEST_DIR') or tempfile.mkdtemp(prefix='mirage-loadtest-'))
+    # utils reads storage settings from Config itself, not the app config
+    Config.UPLOAD_FOLDER = work_dir / 'images'
+    Config.LUT_FOLDER = work_dir / 'lut'
+    Config.LOG_FILE = work_dir / 'mirage.log'
+    Config.LOG_LEVEL = 'WARNING'
+    Config.DISPLAY_DRIVER = 'virtual'
+    Config.VIRTUAL_PANEL_FOLDER = work_dir / 'virtual_panel'
+    # Away from a real panel owner's lock and socket, shared by this run's workers
+    Config.DISPLAY_LOCK_FILE = work_dir / 'display.lock'
+    Config.DISPLAY_SOCKET = work_dir / 'display.sock'
+    Config.VIRTUAL_PANEL_SPI_SECONDS = float(os.environ.get('LOADTEST_SPI_SECONDS', '0'))
+    Config.VIRTUAL_PANEL_REFRESH_SECONDS = float(os.environ.get('LOADTEST_REFRESH_SECONDS', '5'))
+
+    if os.environ.get('LOADTEST_REAL_SYSTEM') != '1':
+        from app.hardware.system import SystemHardware
+        patch.object(SystemHardware, 'get_temperature', return_value=45.0).start()
+        patch.object(SystemHardware, 'get_service_status', return_value={
+            "active": True, "state": "active (running)", "details": ""
+        }).start()
+
+    from app import create_app
+    return create_app(Config)
+
+def _serve_werkzeug(port: int, environ: Dict[str, str]):
+    os.environ.update(environ)
+    from werkzeug.serving import run_simple
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No access log per request
+    run_simple('127.0.0.1', port, create_loadtest_app(), threaded=True)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class Server:
+    """The app under test, running in its own process"""
+
+    def __init__(self, server: str, workers: int, threads: int, refresh_seconds: float, real_system: bool):
+        self.port = _free_port()
+        self.work_dir = tempfile.mkdtemp(prefix='mirage-loadtest-')
+        self.environ = {
+            'LOADTEST_DIR': self.work_dir,
+            'LOADTEST_REFRESH_SECONDS': str(refresh_seconds),
+            'LOADTEST_REAL_SYSTEM': '1' if real_system else '0'
+        }
+
+        if server == 'gunicorn':
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+                 '-b', f'127.0.0.1:{self.port}', 'benchmarks.loadtest:create_loadtest_app()'],
+                env={**os.environ, **self.environ},
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        else:
+            ctx = multiprocessing.get_context('spawn')
+            self.process = ctx.Process(target=_serve_werkzeug, args=(self.port, self.environ), daemon=True)
+            self.process.start()
+
+    def wait_ready(self, timeout: float = 60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+                connection.request('GET', '/status')
+                if connection.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"Server did not come up within {timeout}s")
+
+    def stop(self):
+        self.process.terminate()
+        if isinstance(self.process, subprocess.Popen):
+            self.process.wait(timeout=30)
+        else:
+            self.process.join(timeout=30)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def upload_jpeg(size=(800, 480)) -> bytes:
+    """A panel-sized JPEG"""
+    buffer = io.BytesIO()
+    synthetic_photo(size).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def unique_jpeg(jpeg: bytes, tag: str) -> bytes:
+    """
+    jpeg with tag in a comment segment after the SOI marker: a file with a
+    content hash of its own, so it misses the store and the frame cache,
+    without encoding a new image per request
+    """
+    comment = tag.encode()
+    return jpeg[:2] + b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment + jpeg[2:]
+
+def upload_body(jpeg: bytes) -> bytes:
+    """multipart/form-data body with a JPEG"""
+    return (
+        f'--{BOUNDARY}\r\n'
+        f'Content-Disposition: form-data; name="image"; filename="loadtest.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + jpeg + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(','):
+        route, _, weight = part.partition('=')
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route '{route}'. Supported: {list(ROUTES)}")
+        weights[route] = float(weight or 1)
+    return weights
+
+def _client(port: int, weights: Dict[str, float], jpeg: bytes, deadline: float,
+            samples: Dict[str, List], seed: int, duplicate_uploads: bool = False):
+    """One client connection, sending requests back to back until the deadline"""
+    rng = random.Random(seed)
+    uploads = 0
+    routes, route_weights = list(weights), list(weights.values())
+    connection = None
+    while time.monotonic() < deadline:
+        route = rng.choices(routes, route_weights)[0]
+        method, path = ROUTES[route]
+        headers, payload = {}, None
+        if route == 'display':
+            headers['Content-Type'] = f'multipart/form-data; boundary={BOUNDARY}'
+            payload = upload_body(jpeg if duplicate_uploads else unique_jpeg(jpeg, f'loadtest {seed} {uploads}'))
+            uploads += 1
+
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            ok = 200 <= response.status < 300
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            ok = False
+            connection = None
+        # list.append is atomic, so the clients can share the sample lists
+        samples[route].append((time.perf_counter() - start, ok))
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(samples: Dict[str, List], duration: float) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for route, route_samples in samples.items():
+        latencies = sorted(latency for latency, _ in route_samples)
+        errors = sum(1 for _, ok in route_samples if not ok)
+        count = len(route_samples)
+        summary[route] = {
+            "requests": count,
+            "throughput_rps": round(count / duration, 2),
+            "error_rate": round(errors / count, 4) if count else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0
+        }
+    return summary
+
+def run(server: str = 'gunicorn', workers: int = 1, threads: int = 1, concurrency: int = 8,
+        duration: float = 30, mix: str = 'status=6,metrics=3,display=1', refresh_seconds: float = 5,
+        real_system: bool = False, seed: int = 0, duplicate_uploads: bool = False) -> Dict:
+    weights = parse_mix(mix)
+    jpeg = upload_jpeg()
+    app_server = Server(server, workers, threads, refresh_seconds, real_system)
+    try:
+        app_server.wait_ready()
+        samples: Dict[str, List] = {route: [] for route in weights}
+        deadline = time.monotonic() + duration
+        clients = [
+            threading.Thread(target=_client, args=(app_server.port, weights, jpeg, deadline, samples, seed + i,
+                                                  duplicate_uploads))
+            for i in range(concurrency)
+        ]
+        started = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - started
+    finally:
+        app_server.stop()
+
+    routes = summarize(samples, elapsed)
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "config": {
+            "server": server, "workers": workers, "threads": threads, "concurrency": concurrency,
+            "duration": duration, "mix": weights, "refresh_seconds": refresh_seconds, "real_system": real_system,
+            "duplicate_uploads": duplicate_uploads
+        },
+        "throughput_rps": round(total / elapsed, 2),
+        "routes": routes
+    }
+
+def _gunicorn_available() -> bool:
+    try:
+        import gunicorn  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'],
+                        help="Server to run the app under (default: gunicorn if installed)")
+    parser.add_argument('--workers', type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument('--threads', type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent client connections")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run for")
+    parser.add_argument('--mix', default='status=6,metrics=3,display=1', help="Weighted routes, route=weight,...")
+    parser.add_argument('--refresh-seconds', type=float, default=5, help="Simulated panel refresh time")
+    parser.add_argument('--real-system', action='store_true', help="Probe the real temperature and service state")
+    parser.add_argument('--duplicate-uploads', action='store_true',
+                        help="Upload the same file every time, measuring the deduplicated path")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    server = args.server or ('gunicorn' if _gunicorn_available() else 'werkzeug')
+    if server == 'werkzeug' and (args.workers > 1 or args.threads > 1):
+        parser.error("--workers and --threads need --server gunicorn")
+
+    results = run(server, args.workers, args.threads, args.concurrency, args.duration,
+                  args.mix, args.refresh_seconds, args.real_system, duplicate_uploads=args.duplicate_uploads)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    config = results["config"]
+    print(f"{server}: {config['workers']} worker(s) x {config['threads']} thread(s), "
+          f"{config['concurrency']} clients for {config['duration']:.0f}s, refresh {config['refresh_seconds']}s")
+    print(f"{'route':<10}{'requests':>10}{'req/s':>9}{'errors':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for route, stats in results["routes"].items():
+        print(f"{route:<10}{stats['requests']:>10}{stats['throughput_rps']:>9.1f}{stats['error_rate']:>9.1%}"
+              f"{stats['p50_ms']:>10.1f}{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"Total throughput: {results['throughput_rps']:.1f} req/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Image pipeline benchmark suite with stored baselines.
+
+Runs validate_image, save_image and cleanup_old_images, and the decode,
+resize, quantize and set_image stages of Display.update against the
+virtual panel, over a fixed corpus of generated images. Each case runs in
+a fresh process, reporting the median wall time over --repeat runs and the
+peak RSS growth while it ran.
+
+Results can be saved as a baseline and later runs compared against it;
+any case slower or hungrier than the baseline by more than the tolerance
+is reported and the exit status is 1. Baselines are machine-specific, so
+compare against one recorded on the same hardware.
+
+    python -m benchmarks.pipeline [--repeat 5] [--only save_image] [--json]
+    python -m benchmarks.pipeline --save-baseline benchmarks/baselines/pipeline.json
+    python -m benchmarks.pipeline --baseline benchmarks/baselines/pipeline.json
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import PIL
+from PIL import Image
+from benchmarks.ingest import PANEL_RESOLUTION, synthetic_jpeg
+from benchmarks.quantize import synthetic_photo
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baselines' / 'pipeline.json'
+
+def _png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def _small_jpeg() -> bytes:
+    buffer = io.BytesIO()
+    synthetic_photo((320, 240)).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def _panel_jpeg() -> bytes:
+    buffer = io.BytesIO()
+    synthetic_photo(PANEL_RESOLUTION).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def _palette_png() -> bytes:
+    return _png(synthetic_photo(PANEL_RESOLUTION).quantize(colors=16))
+
+def _rgba_png() -> bytes:
+    image = synthetic_photo((1600, 1200)).convert('RGBA')
+    alpha = np.tile(np.linspace(0, 255, 1600, dtype=np.uint8), (1200, 1))
+    image.putalpha(Image.fromarray(alpha))
+    return _png(image)
+
+# Fixed corpus: name -> (upload filename, generator)
+CORPUS: Dict[str, tuple] = {
+    'small-jpeg': ('small.jpg', _small_jpeg),
+    'panel-jpeg': ('panel.jpg', _panel_jpeg),
+    '12mp-jpeg': ('12mp.jpg', lambda: synthetic_jpeg(12)),
+    '24mp-jpeg': ('24mp.jpg', lambda: synthetic_jpeg(24)),
+    'palette-png': ('palette.png', _palette_png),
+    'rgba-png': ('rgba.png', _rgba_png)
+}
+
+CLEANUP_FILES = 50  # Stored images cleanup_old_images has to sort through
+
+def build_corpus(directory: Path) -> Dict[str, Path]:
+    """Write the corpus to a directory, returns name -> path"""
+    paths = {}
+    for name, (filename, generate) in CORPUS.items():
+        path = directory / filename
+        path.write_bytes(generate())
+        paths[name] = path
+    return paths
+
+def _upload(path: Path):
+    from werkzeug.datastructures import FileStorage
+    return FileStorage(stream=io.BytesIO(path.read_bytes()), filename=path.name)
+
+def bench_validate_image(path: Path, repeat: int) -> Dict[str, List[float]]:
+    from app.utils import validate_image
+    times = []
+    for _ in range(repeat):
+        upload = _upload(path)
+        start = time.perf_counter()
+        valid, error = validate_image(upload)
+        times.append(time.perf_counter() - start)
+        assert valid, error
+    return {'total': times}
+
+def bench_save_image(path: Path, repeat: int) -> Dict[str, List[float]]:
+    from app import store
+    from app.utils import save_image
+    times = []
+    for _ in range(repeat):
+        upload = _upload(path)
+        start = time.perf_counter()
+        saved = save_image(upload)
+        times.append(time.perf_counter() - start)
+        store.remove(saved)  # Otherwise the next repeat is a deduplicated upload
+    return {'total': times}
+
+def bench_cleanup_old_images(path: Path, repeat: int) -> Dict[str, List[float]]:
+    from config import Config
+    from app import store
+    from app.utils import cleanup_old_images
+    data = path.read_bytes()
+    times = []
+    for _ in range(repeat):
+        for i in range(CLEANUP_FILES):
+            image = Config.UPLOAD_FOLDER / f"{i:04d}_{path.name}"
+            image.write_bytes(data)
+            store.register(image)
+        start = time.perf_counter()
+        cleanup_old_images(Config.KEEP_IMAGES)
+        times.append(time.perf_counter() - start)
+    return {'total': times}
+
+def bench_display(path: Path, repeat: int) -> Dict[str, List[float]]:
+    from app.hardware.display import Display
+    from app.hardware.panel import VirtualPanel
+    from app.timing import StageTimer
+    display = Display(panel=VirtualPanel(resolution=PANEL_RESOLUTION))
+    stages = {'decode': [], 'resize': [], 'quantize': [], 'set_image': [], 'total': []}
+    for _ in range(repeat):
+        timer = StageTimer()
+        start = time.perf_counter()
+        assert display.update(str(path), timer=timer)
+        stages['total'].append(time.perf_counter() - start)
+        for name in ('decode', 'resize', 'quantize', 'set_image'):
+            stages[name].append(timer.stages.get(name, 0.0))
+    return stages
+
+BENCHMARKS: Dict[str, Callable[[Path, int], Dict[str, List[float]]]] = {
+    'validate_image': bench_validate_image,
+    'save_image': bench_save_image,
+    'cleanup_old_images': bench_cleanup_old_images,
+    'display': bench_display
+}
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the kernel's peak RSS counter for this process. Without this the
+    peak carries over from the parent we were forked from, which built the
+    corpus. Needs Linux 4.0+, returns False if unavailable.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_kb() -> int:
+    """Peak RSS in kilobytes, from /proc where available so it honours _reset_peak_rss"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _child(benchmark: str, path: Path, repeat: int, results):
+    from config import Config
+    import app.utils  # noqa: F401 - keep import time out of the measurement
+    import app.hardware.display  # noqa: F401
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        Config.UPLOAD_FOLDER = work_dir / 'images'
+        Config.UPLOAD_FOLDER.mkdir()
+        Config.LUT_FOLDER = work_dir / 'lut'
+        Config.MAX_CONTENT_LENGTH = 64 * 1024 * 1024  # The corpus includes uploads over the default limit
+        Config.RENDER_CACHE_BYTES = 0  # Every repeat has to do the work
+        Config.DISPLAY_DRIVER = 'virtual'
+
+        _reset_peak_rss()
+        rss_before = _peak_rss_kb()
+        stages = BENCHMARKS[benchmark](path, repeat)
+        rss_after = _peak_rss_kb()
+
+    result = {f"{name}_ms": round(statistics.median(times) * 1000, 2) for name, times in stages.items()}
+    result['rss_growth_mb'] = round((rss_after - rss_before) / 1024, 1)
+    results.put(result)
+
+def run_case(benchmark: str, path: Path, repeat: int) -> Dict[str, float]:
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_child, args=(benchmark, path, repeat, results))
+    process.start()
+    result = results.get(timeout=600)
+    process.join()
+    return result
+
+def run(repeat: int = 5, only: Optional[List[str]] = None, log=None) -> Dict:
+    """Run every benchmark over the corpus, returns the results document"""
+    benchmarks = only or list(BENCHMARKS)
+    results = {}
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpus = build_corpus(Path(corpus_dir))
+        for benchmark in benchmarks:
+            # Cleanup cost depends on the file count, not the image
+            names = ['small-jpeg'] if benchmark == 'cleanup_old_images' else list(corpus)
+            for name in names:
+                case = f"{benchmark}/{name}"
+                if log:
+                    log(f"Running {case}")
+                results[case] = run_case(benchmark, corpus[name], repeat)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": repeat
+        },
+        "results": results
+    }
+
+def compare(results: Dict, baseline: Dict, time_tolerance: float = 0.25,
+            memory_tolerance: float = 0.25, min_ms: float = 1.0, min_mb: float = 2.0) -> List[str]:
+    """
+    Regressions of results against a baseline, one message each.
+    A measurement regresses when it is worse by more than the relative
+    tolerance and by more than min_ms/min_mb, so timer noise on very fast
+    cases doesn't count.
+    """
+    regressions = []
+    for case, base in baseline["results"].items():
+        current = results["results"].get(case)
+        if current is None:
+            continue
+        for key, base_value in base.items():
+            value = current.get(key)
+            if value is None:
+                continue
+            if key.endswith('_ms'):
+                tolerance, floor, unit = time_tolerance, min_ms, 'ms'
+            else:
+                tolerance, floor, unit = memory_tolerance, min_mb, 'MB'
+            if value > base_value * (1 + tolerance) and value - base_value > floor:
+                regressions.append(f"{case} {key}: {value}{unit} vs baseline {base_value}{unit} "
+                                   f"(+{(value / base_value - 1) * 100 if base_value else float('inf'):.0f}%)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per case, the median is reported")
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help="Run only this benchmark (repeatable)")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Write the results as a baseline")
+    parser.add_argument('--baseline', metavar='PATH', nargs='?', const=str(DEFAULT_BASELINE),
+                        help="Compare against a baseline (default: benchmarks/baselines/pipeline.json)")
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help="Allowed relative slowdown")
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help="Allowed relative RSS growth")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.only, log=None if args.json else lambda message: print(message, file=sys.stderr))
+
+    if args.save_baseline:
+        path = Path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {path}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'case':<34}{'total ms':>10}{'decode':>9}{'resize':>9}{'quantize':>10}{'set_image':>11}{'RSS MB':>9}")
+        for case, result in results["results"].items():
+            stage_columns = "".join(
+                f"{result[f'{name}_ms']:>{width}.1f}" if f'{name}_ms' in result else f"{'':>{width}}"
+                for name, width in (('decode', 9), ('resize', 9), ('quantize', 10), ('set_image', 11))
+            )
+            print(f"{case:<34}{result['total_ms']:>10.1f}{stage_columns}{result['rss_growth_mb']:>9.1f}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
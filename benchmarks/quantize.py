@@ -0,0 +1,99 @@
+"""
+Per-frame CPU time of palette quantization at panel resolution.
+
+Compares the conversion the Inky driver does itself (PIL's Floyd-Steinberg
+quantize against the blended palette) with each algorithm in app.quantize,
+with and without a precomputed colour LUT.
+
+    python -m benchmarks.quantize [--image photo.jpg] [--repeat 5] [--lut-bits 5] [--json]
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import Callable, Dict
+import numpy as np
+from PIL import Image
+from app.quantize import ALGORITHMS, PaletteLUT, Quantizer
+
+PANEL_RESOLUTION = (800, 480)
+
+# Blended 7-colour palette of the Inky Impression 7.3" at saturation 0.5
+IMPRESSION_PALETTE = [
+    [0, 0, 0], [236, 248, 255], [1, 189, 38], [13, 23, 226],
+    [250, 40, 17], [255, 255, 34], [247, 130, 22]
+]
+
+def synthetic_photo(size=PANEL_RESOLUTION, seed: int = 0) -> Image.Image:
+    """Smooth gradients plus noise, a rough stand-in for a photo"""
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    rgb = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 255
+    rgb += np.random.default_rng(seed).normal(0, 12, rgb.shape)
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+
+def driver_quantize(palette) -> Callable[[Image.Image], object]:
+    """The conversion inky's set_image runs when handed an RGB image"""
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette([c for colour in palette for c in colour] + [255, 255, 255] + [0, 0, 0] * 248)
+
+    def run(image: Image.Image):
+        image.load()
+        return np.array(image.im.convert("P", True, palette_image.im), dtype=np.uint8)
+    return run
+
+def measure(func: Callable, image: Image.Image, repeat: int) -> Dict[str, float]:
+    """CPU and wall time per frame, best of `repeat` runs"""
+    func(image)  # Warm up
+    cpu, wall = [], []
+    for _ in range(repeat):
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        func(image)
+        cpu.append(time.process_time() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+    return {"cpu_ms": round(min(cpu) * 1000, 2), "wall_ms": round(min(wall) * 1000, 2)}
+
+def run(image: Image.Image, repeat: int = 5, lut_bits: int = 5) -> Dict[str, Dict[str, float]]:
+    image = image.convert('RGB').resize(PANEL_RESOLUTION)
+    results = {"driver": measure(driver_quantize(IMPRESSION_PALETTE), image, repeat)}
+    for algorithm in ALGORITHMS:
+        quantizer = Quantizer(IMPRESSION_PALETTE, algorithm)
+        results[algorithm] = measure(quantizer.quantize, image, repeat)
+
+    if lut_bits:
+        with tempfile.TemporaryDirectory() as lut_dir:
+            palette = np.array(IMPRESSION_PALETTE, dtype=np.uint8)
+            start = time.perf_counter()
+            PaletteLUT.load_or_build(palette, lut_bits, lut_dir)
+            build_ms = (time.perf_counter() - start) * 1000
+            # Time the memory-mapped load a restarted worker would do
+            lut = PaletteLUT.load_or_build(palette, lut_bits, lut_dir)
+            for algorithm in ALGORITHMS:
+                quantizer = Quantizer(IMPRESSION_PALETTE, algorithm, lut=lut)
+                results[f"{algorithm}+lut"] = measure(quantizer.quantize, image, repeat)
+            results["lut build"] = {"cpu_ms": round(build_ms, 2), "wall_ms": round(build_ms, 2)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', help="Image to quantize (default: synthetic 800x480 photo)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--lut-bits', type=int, default=5, help="Bits per channel of the LUT variants, 0 to skip them")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    image = Image.open(args.image) if args.image else synthetic_photo()
+    results = run(image, args.repeat, args.lut_bits)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    baseline = results["driver"]["cpu_ms"]
+    print(f"{'path':<22}{'cpu ms':>10}{'wall ms':>10}{'vs driver':>12}")
+    for name, result in results.items():
+        speedup = "" if name == "lut build" else f"{baseline / result['cpu_ms']:.2f}x"
+        print(f"{name:<22}{result['cpu_ms']:>10.1f}{result['wall_ms']:>10.1f}{speedup:>12}")
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,21 @@
 from pathlib import Path
 import os
-from typing import List
+from typing import Dict, List, Tuple
+
+def _parse_ttls(value: str) -> Tuple[Dict[str, float], List[str]]:
+    """Parse "field=seconds,..." into TTLs, and the entries that aren't in that form"""
+    ttls, malformed = {}, []
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        key, separator, ttl = item.partition('=')
+        try:
+            if not separator or not key.strip():
+                raise ValueError
+            ttls[key.strip()] = float(ttl)
+        except ValueError:
+            malformed.append(item.strip())
+    return ttls, malformed
 
 class Config:
     # Flask settings
@@ -12,12 +27,55 @@ class Config:
     UPLOAD_FOLDER = Path(__file__).parent / 'instance' / 'images'
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5MB max file size
     KEEP_IMAGES = int(os.environ.get('KEEP_IMAGES', '5'))
+    MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(16_000_000)))  # Larger JPEGs decode at reduced scale, others are rejected
+    IMAGES_PAGE_SIZE = int(os.environ.get('IMAGES_PAGE_SIZE', '50'))  # Default ?limit= of GET /images
+    # Background image collector, evicting the least recently displayed unpinned images
+    STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES', '0'))  # Stored images plus their renditions, 0 disables
+    MIN_FREE_BYTES = int(os.environ.get('MIN_FREE_BYTES', '0'))  # Free space to keep on the upload disk, 0 disables
+    GC_INTERVAL = float(os.environ.get('GC_INTERVAL', '300'))  # Seconds between runs, uploads also trigger one
+    GC_BATCH_SIZE = int(os.environ.get('GC_BATCH_SIZE', '50'))  # Images deleted per catalog transaction
+    # Panel-sized, quantized and thumbnail renditions made after ingest, so displays and previews skip the original
+    RENDITIONS = os.environ.get('RENDITIONS', 'true').lower() in ('1', 'true', 'yes')
+    THUMBNAIL_SIZES = [int(size) for size in os.environ.get('THUMBNAIL_SIZES', '512,256,128').split(',') if size.strip()]
     
     # Display settings
     SUPPORTED_FORMATS = ['.png', '.jpg', '.jpeg']
-    METRICS_INTERVAL = int(os.environ.get('METRICS_INTERVAL', '300'))  # 5 minutes
     DISPLAY_STATUS_TIMEOUT = int(os.environ.get('DISPLAY_STATUS_TIMEOUT', '30'))  # 30 seconds
+    # Seconds each /status field is cached for, override with e.g. STATUS_TTLS="system.service=30,storage=5"
+    _STATUS_TTL_OVERRIDES, _MALFORMED_STATUS_TTLS = _parse_ttls(os.environ.get('STATUS_TTLS', ''))
+    STATUS_TTLS = {
+        'system.temperature': 5.0,
+        'system.service': 10.0,
+        'system.cpu': 2.0,
+        'system.memory': 2.0,
+        'system.disk': 30.0,
+        'storage': 10.0,
+        'display': 0.0,  # Cheap and changes with every update
+        **_STATUS_TTL_OVERRIDES
+    }
     DISPLAY_UPDATE_TIMEOUT = int(os.environ.get('DISPLAY_UPDATE_TIMEOUT', '120'))  # 2 minutes
+    DISPLAY_JOB_HISTORY = int(os.environ.get('DISPLAY_JOB_HISTORY', '20'))  # Finished jobs kept for /display/jobs
+    DISPLAY_FIT = os.environ.get('DISPLAY_FIT', 'cover')  # cover/contain/center-crop/stretch
+    DISPLAY_DITHER = os.environ.get('DISPLAY_DITHER', 'ordered')  # nearest/ordered/diffusion/diffusion-block/none
+    DISPLAY_SATURATION = float(os.environ.get('DISPLAY_SATURATION', '0.5'))  # Palette saturation, 0.0-1.0
+    DISPLAY_LUT_BITS = int(os.environ.get('DISPLAY_LUT_BITS', '5'))  # Bits per channel of the colour LUT (5 = 32^3), 0 disables
+    LUT_FOLDER = UPLOAD_FOLDER.parent / 'lut'
+    RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', str(4 * 1024 * 1024)))  # Rendered frames kept in memory, 0 disables
+    DISPLAY_COALESCE = os.environ.get('DISPLAY_COALESCE', 'true').lower() in ('1', 'true', 'yes')  # Newer uploads replace pending ones
+    DISPLAY_DRIVER = os.environ.get('DISPLAY_DRIVER', 'inky')  # inky, or virtual to run without a panel
+    # The worker holding this lock drives the panel, the others send it display jobs over the socket
+    DISPLAY_LOCK_FILE = Path(os.environ.get('DISPLAY_LOCK_FILE', str(UPLOAD_FOLDER.parent / 'display.lock')))
+    DISPLAY_SOCKET = Path(os.environ.get('DISPLAY_SOCKET', str(UPLOAD_FOLDER.parent / 'display.sock')))
+    # Leave the panel to displayd.py, web workers only send it jobs
+    DISPLAY_DAEMON = os.environ.get('DISPLAY_DAEMON', 'false').lower() in ('1', 'true', 'yes')
+    DISPLAYD_METRICS_PORT = int(os.environ.get('DISPLAYD_METRICS_PORT', '9101'))  # displayd's own /metrics, 0 disables
+    
+    # Virtual panel settings (DISPLAY_DRIVER=virtual)
+    VIRTUAL_PANEL_RESOLUTION = tuple(int(v) for v in os.environ.get('VIRTUAL_PANEL_RESOLUTION', '800x480').split('x'))
+    VIRTUAL_PANEL_SPI_SECONDS = float(os.environ.get('VIRTUAL_PANEL_SPI_SECONDS', '1.5'))  # Frame buffer transfer
+    VIRTUAL_PANEL_REFRESH_SECONDS = float(os.environ.get('VIRTUAL_PANEL_REFRESH_SECONDS', '30'))  # 7-colour refresh cycle
+    VIRTUAL_PANEL_FOLDER = UPLOAD_FOLDER.parent / 'virtual_panel'  # Shown frames are written here as PNGs
+    VIRTUAL_PANEL_KEEP_FRAMES = int(os.environ.get('VIRTUAL_PANEL_KEEP_FRAMES', '10'))
     
     # Logging settings
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -26,6 +84,13 @@ class Config:
     LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', '10240'))  # 10KB per file
     LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '10'))
     
+    # Metrics shared between gunicorn workers, set in the environment before the workers start
+    PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    
+    # Startup
+    STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE')  # JSON file for import times and time to first request, {pid} allowed
+    COLD_START_BUDGET = float(os.environ.get('COLD_START_BUDGET', '2.0'))  # Seconds to first request the startup test allows
+    
     # Optional API authentication
     API_TOKEN = os.environ.get('API_TOKEN')  # If set, will require token auth
     
@@ -46,15 +111,37 @@ class Config:
         except Exception as e:
             errors.append(f"Cannot create log folder: {e}")
         
+        # Check the shared metrics folder
+        if cls.PROMETHEUS_MULTIPROC_DIR:
+            try:
+                Path(cls.PROMETHEUS_MULTIPROC_DIR).mkdir(parents=True, exist_ok=True)
+            except Exception as e:
+                errors.append(f"Cannot create PROMETHEUS_MULTIPROC_DIR: {e}")
+        
         # Validate numeric values
-        if cls.METRICS_INTERVAL < 10:
-            errors.append("METRICS_INTERVAL must be >= 10 seconds")
-            
         if cls.MAX_CONTENT_LENGTH < 1024:
             errors.append("MAX_CONTENT_LENGTH must be >= 1024 bytes")
             
+        if cls.MAX_IMAGE_PIXELS < 1_000_000:
+            errors.append("MAX_IMAGE_PIXELS must be >= 1000000")
+            
         if cls.KEEP_IMAGES < 1:
             errors.append("KEEP_IMAGES must be >= 1")
+        
+        if cls.IMAGES_PAGE_SIZE < 1:
+            errors.append("IMAGES_PAGE_SIZE must be >= 1")
+        
+        if cls.STORAGE_QUOTA_BYTES < 0 or cls.MIN_FREE_BYTES < 0:
+            errors.append("STORAGE_QUOTA_BYTES and MIN_FREE_BYTES must be >= 0")
+        
+        if cls.GC_INTERVAL <= 0:
+            errors.append("GC_INTERVAL must be > 0")
+        
+        if cls.GC_BATCH_SIZE < 1:
+            errors.append("GC_BATCH_SIZE must be >= 1")
+        
+        if not cls.THUMBNAIL_SIZES or min(cls.THUMBNAIL_SIZES) < 16:
+            errors.append("THUMBNAIL_SIZES must list at least one size, each >= 16 pixels")
             
         if cls.LOG_MAX_BYTES < 1024:
             errors.append("LOG_MAX_BYTES must be >= 1024 bytes")
@@ -69,6 +156,56 @@ class Config:
         if cls.DISPLAY_UPDATE_TIMEOUT < 30:
             errors.append("DISPLAY_UPDATE_TIMEOUT must be >= 30 seconds")
         
+        valid_fits = ['cover', 'contain', 'center-crop', 'stretch']
+        if cls.DISPLAY_FIT not in valid_fits:
+            errors.append(f"DISPLAY_FIT must be one of: {valid_fits}")
+        
+        valid_dithers = ['none', 'nearest', 'ordered', 'diffusion', 'diffusion-block']
+        if cls.DISPLAY_DITHER not in valid_dithers:
+            errors.append(f"DISPLAY_DITHER must be one of: {valid_dithers}")
+        
+        if not 0.0 <= cls.DISPLAY_SATURATION <= 1.0:
+            errors.append("DISPLAY_SATURATION must be between 0.0 and 1.0")
+        
+        if cls.DISPLAY_LUT_BITS != 0 and not 4 <= cls.DISPLAY_LUT_BITS <= 7:
+            errors.append("DISPLAY_LUT_BITS must be 0 (disabled) or between 4 and 7")
+        
+        if cls.RENDER_CACHE_BYTES < 0:
+            errors.append("RENDER_CACHE_BYTES must be >= 0")
+        
+        from app.status import FIELDS as status_fields  # The probe names
+        for entry in cls._MALFORMED_STATUS_TTLS:
+            errors.append(f"WARNING: Ignoring STATUS_TTLS entry '{entry}', expected field=seconds")
+        for field, ttl in cls.STATUS_TTLS.items():
+            if field not in status_fields:
+                errors.append(f"STATUS_TTLS has unknown field '{field}'. Supported: {list(status_fields)}")
+            elif ttl < 0:
+                errors.append(f"STATUS_TTLS for '{field}' must be >= 0 seconds")
+        
+        if cls.DISPLAY_JOB_HISTORY < 1:
+            errors.append("DISPLAY_JOB_HISTORY must be >= 1")
+        
+        if cls.COLD_START_BUDGET <= 0:
+            errors.append("COLD_START_BUDGET must be > 0 seconds")
+        
+        if len(str(cls.DISPLAY_SOCKET)) > 100:
+            errors.append("DISPLAY_SOCKET path must be at most 100 characters")
+        
+        if not 0 <= cls.DISPLAYD_METRICS_PORT <= 65535:
+            errors.append("DISPLAYD_METRICS_PORT must be between 0 and 65535")
+        
+        valid_drivers = ['inky', 'virtual']
+        if cls.DISPLAY_DRIVER not in valid_drivers:
+            errors.append(f"DISPLAY_DRIVER must be one of: {valid_drivers}")
+        
+        if cls.DISPLAY_DRIVER == 'virtual':
+            if len(cls.VIRTUAL_PANEL_RESOLUTION) != 2 or min(cls.VIRTUAL_PANEL_RESOLUTION) < 1:
+                errors.append("VIRTUAL_PANEL_RESOLUTION must be WIDTHxHEIGHT")
+            if cls.VIRTUAL_PANEL_SPI_SECONDS < 0 or cls.VIRTUAL_PANEL_REFRESH_SECONDS < 0:
+                errors.append("VIRTUAL_PANEL_SPI_SECONDS and VIRTUAL_PANEL_REFRESH_SECONDS must be >= 0")
+            if cls.VIRTUAL_PANEL_KEEP_FRAMES < 1:
+                errors.append("VIRTUAL_PANEL_KEEP_FRAMES must be >= 1")
+        
         # Validate log level
         valid_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
         if cls.LOG_LEVEL.upper() not in valid_levels:
@@ -0,0 +1,121 @@
+"""
+Mirage display daemon
+
+Owns the e-ink panel in its own long-lived process. Web workers started
+with DISPLAY_DAEMON=1 never open the panel; they send display jobs here
+over DISPLAY_SOCKET, so they start quickly, can be restarted freely, and a
+hung refresh can't take the API down with it.
+
+    python displayd.py                                  # Serve the panel
+    python displayd.py show photo.jpg [--fit contain]   # Show an image through the running daemon
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from pathlib import Path
+from config import Config
+from app import setup_logging
+from app.imaging import FIT_MODES
+
+logger = logging.getLogger('displayd')
+
+def _display_owner(config, claim: bool):
+    from app.ownership import DisplayOwner
+
+    def create_display():
+        from app.hardware.display import Display
+        from app.hardware.panel import create_panel
+        return Display(panel=create_panel(config))
+
+    return DisplayOwner(
+        create_display=create_display,
+        lock_file=config.DISPLAY_LOCK_FILE,
+        socket_path=config.DISPLAY_SOCKET,
+        history=config.DISPLAY_JOB_HISTORY,
+        coalesce=config.DISPLAY_COALESCE,
+        claim=claim
+    )
+
+def serve(config=Config) -> int:
+    """Run the panel until SIGTERM or SIGINT"""
+    errors = [error for error in config.validate() if not error.startswith('WARNING')]
+    for error in errors:
+        print(f"\033[91m{error}\033[0m", file=sys.stderr)
+    if errors:
+        return 1
+
+    # Its own log file, two processes rotating one file would lose lines
+    config.LOG_FILE = config.LOG_FILE.with_name('displayd.log')
+    setup_logging(config)
+
+    owner = _display_owner(config, claim=True)
+    if not owner.owner:
+        logger.error(f"The display is already owned by another process, see {config.DISPLAY_LOCK_FILE}")
+        return 1
+    try:
+        # Unlike the web app the daemon is long-lived, so open the panel now and fail early
+        owner.display
+    except Exception as e:
+        logger.error(f"Cannot open the display: {e}", exc_info=True)
+        owner.shutdown()
+        return 1
+
+    if config.DISPLAYD_METRICS_PORT:
+        from prometheus_client import start_http_server
+        start_http_server(config.DISPLAYD_METRICS_PORT)
+        logger.info(f"Serving display metrics on port {config.DISPLAYD_METRICS_PORT}")
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    logger.info(f"Display daemon ready on {config.DISPLAY_SOCKET}")
+    stop.wait()
+
+    logger.info("Display daemon shutting down")
+    owner.shutdown()
+    return 0
+
+def show(image: str, fit: str = None, timeout: float = None, config=Config) -> int:
+    """Show an image through the running daemon, printing the job's progress"""
+    from app.ownership import REQUEST_TIMEOUT
+    timeout = timeout or config.DISPLAY_UPDATE_TIMEOUT
+    owner = _display_owner(config, claim=False)
+
+    def progress(job):
+        print(job["status"], flush=True)
+
+    try:
+        job = owner.call(
+            {'op': 'submit', 'path': str(Path(image).resolve()), 'fit': fit, 'timeout': timeout},
+            timeout=timeout + REQUEST_TIMEOUT,
+            on_progress=progress
+        )
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in job["stages"].items())
+    print(f"Job {job['id']} {job['status']}{': ' + job['error'] if job['error'] else ''} ({stages})")
+    return 0 if job["status"] == 'done' else 1
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    show_parser = commands.add_parser('show', help="Show an image through the running daemon")
+    show_parser.add_argument('image', help="Image file, readable by the daemon")
+    show_parser.add_argument('--fit', choices=FIT_MODES, help="Fit mode (default: DISPLAY_FIT)")
+    show_parser.add_argument('--timeout', type=float, help="Seconds to wait (default: DISPLAY_UPDATE_TIMEOUT)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        return show(args.image, args.fit, args.timeout)
+    # The daemon serves its own metrics, shared worker files would be wiped by gunicorn restarts
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    os.environ.pop('prometheus_multiproc_dir', None)
+    return serve()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+Gunicorn settings for Mirage
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With more than one worker, metrics are shared between the workers through
+PROMETHEUS_MULTIPROC_DIR so /metrics reports totals whichever worker answers.
+"""
+import os
+from pathlib import Path
+
+bind = os.environ.get('MIRAGE_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+# Longer than DISPLAY_UPDATE_TIMEOUT, so ?wait=true requests aren't killed mid-refresh
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '150'))
+
+if workers > 1:
+    # Must be in the environment before the workers import prometheus_client
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', str(Path(__file__).parent / 'instance' / 'metrics'))
+
+def on_starting(server):
+    """Start with an empty metrics folder, files from a previous run would be merged in"""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not directory:
+        return
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for stale in directory.glob('*.db'):
+        stale.unlink()
+    server.log.info(f"Sharing metrics between workers in {directory}")
+
+def child_exit(server, worker):
+    """Forget a dead worker's live gauges, its counters stay in the totals"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)